@@ -3,13 +3,30 @@
 
 """Console script for ardumgr."""
 
+import json
 import click
 import yaml
 from pathlib import Path
 from collections import OrderedDict
 from .ardumgr import ArduMgr
 from .programmer import Programmer
-from .configs import Platform
+from .configs import OS_SUFFIXES, DIFF_EXCLUDED_PREFIXES
+from .watcher import Watcher
+from .checker import check_platform
+from .libraries import LibraryIndex
+from .builder import Builder
+from .matrix import BuildMatrix, write_json as write_matrix_json
+from .distributed import DistributedCompiler, serve
+from .export import export_programmer, write_export, read_export
+from .ports import PortPool
+from .jobqueue import JobQueue
+from .emulator import emulate as emulate_bootloaders
+from .pkgindex import PackageIndex
+from .image import format_ranges
+from . import size as size_report
+from .exceptions import ArduMgrError
+from . import profiling
+from . import metrics
 
 
 def calc_max_len(str_list, spaces=4):
@@ -22,37 +39,90 @@ def calc_max_len(str_list, spaces=4):
 
 
 def print_table(alist, callback):
-    max_len = calc_max_len(alist)
-    for element in alist:
-        result = callback(element)
-        if not result:
-            continue
+    """
+    @arg callback Returns (left, right) of an element, or None to skip it
+    """
 
-        left, right = result
+    rows = [result for result in map(callback, alist) if result]
+    max_len = calc_max_len([left for left, _ in rows])
+    for left, right in rows:
         click.echo("%s%s%s" % (left, " " * (max_len - len(left)), right))
 
 
+def parse_preferences(option, values):
+    """
+    @return An OrderedDict of preferences given as "KEY=VALUE"
+    """
+
+    preferences = OrderedDict()
+    for value in values:
+        parts = value.split("=", 1)
+        if len(parts) != 2:
+            raise click.BadOptionUsage(
+                option, "Wrong format of preference : %s" % value)
+
+        preferences[parts[0].strip()] = parts[1].strip()
+
+    return preferences
+
+
 @click.group()
 @click.option('-c', '--config', type=click.File('r'), default=None)
 @click.option('-p', '--preference', multiple=True, default=None)
+@click.option('--profile', is_flag=True, default=False,
+              help="Print timers and counters to stderr on exit")
+@click.option('--profile-format', type=click.Choice(["table", "json"]),
+              default="table")
+@click.option('--metrics-textfile', type=click.Path(dir_okay=False),
+              default=None,
+              help="Write upload metrics for textfile collector on exit")
+@click.option('--from-export', type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help="Use configs written by export instead of an Arduino "
+              "installation")
 @click.pass_context
-def main(ctx, config, preference):
+def main(ctx, config, preference, profile, profile_format, metrics_textfile,
+         from_export):
     """Console script for ardumgr."""
 
     ctx.obj = {}
 
+    if ctx.invoked_subcommand in ("worker", "emulate"):
+        # Workers only need compilers, emulators need nothing, not an
+        # Arduino installation
+        return
+
+    if metrics_textfile:
+        ctx.call_on_close(
+            lambda: metrics.REGISTRY.write_textfile(metrics_textfile))
+
+    if profile:
+        profiler = profiling.enable()
+
+        def print_profile():
+            if profile_format == "json":
+                click.echo(profiler.format_json(), err=True)
+            else:
+                click.echo(profiler.format_table(), err=True)
+
+        ctx.call_on_close(print_profile)
+
     configs = OrderedDict()
     if config:
         configs.update(yaml.load(config))
 
     if preference:
-        for value in preference:
-            parts = value.split("=", 1)
-            if len(parts) != 2:
-                raise click.BadOptionUsage(
-                    "Wrong format of preference : %s" % value)
+        configs.update(parse_preferences("--preference", preference))
+
+    if from_export:
+        try:
+            export = read_export(from_export)
+        except (ArduMgrError, ValueError) as e:
+            raise click.BadOptionUsage("--from-export", str(e))
 
-            configs[parts[0].strip()] = parts[1].strip()
+        ctx.obj["manager"] = ArduMgr.from_export(export)
+        ctx.obj["programmer"] = Programmer.from_export(export, configs)
+        return
 
     if "ardumgr.home_path" not in configs:
         raise click.BadOptionUsage(
@@ -68,35 +138,674 @@ def main(ctx, config, preference):
     ctx.obj["manager"] = manager
 
 
+def get_programmer(ctx):
+    """
+    Programmer of current board, or the exported one
+    """
+
+    programmer = ctx.obj.get("programmer")
+    if programmer is None:
+        manager = ctx.obj["manager"]
+        platform = manager.get_platform(manager._cfgs["ardumgr.platform"])
+
+        port = None
+        key = "ardumgr.serial_port"
+        if (key in manager._cfgs) and (manager._cfgs[key] == "auto"):
+            board = manager._cfgs["ardumgr.board"]
+            ports = PortPool().find_ports(platform, board)
+            if not ports:
+                raise click.UsageError(
+                    "No serial port found for board \"%s\"!" % board)
+
+            port = ports[0].device
+
+        programmer = ctx.obj["programmer"] = platform.get_programmer(
+            port=port)
+
+    return programmer
+
+
 @main.command()
 @click.argument("project_name", required=False)
 @click.argument("path", required=False)
+@click.option('-r', '--retries', type=int, default=None,
+              help="Retries after a failed upload")
 @click.pass_context
-def upload(ctx, project_name, path):
+def upload(ctx, project_name, path, retries):
     """
     Upload by project
     """
 
-    manager = ctx.obj["manager"]
-    platform = Platform(manager, manager._cfgs["ardumgr.platform"])
-    programmer = Programmer(platform)
-
-    programmer.upload(path, project_name)
+    programmer = get_programmer(ctx)
+    programmer.upload(path, project_name, retries)
 
 
 @main.command()
 @click.argument("path")
+@click.option('-r', '--retries', type=int, default=None,
+              help="Retries after a failed upload")
 @click.pass_context
-def uploadbin(ctx, path):
+def uploadbin(ctx, path, retries):
     """
     Upload generated binary file name
     """
 
+    programmer = get_programmer(ctx)
+    programmer.upload_bin(path, retries)
+
+
+def parse_address(value):
+    """
+    Decimal or "0x" prefixed hexadecimal integers
+    """
+
+    return int(value, 0)
+
+
+@main.command()
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option('-s', '--start', type=parse_address, default="0",
+              help="Address to start reading")
+@click.option('-l', '--length', type=parse_address, default=None,
+              help="Bytes to read, defaults to upload.maximum_size")
+@click.pass_context
+def dump(ctx, output, start, length):
+    """
+    Read flash of the board into an Intel HEX (.hex) or binary file
+    """
+
+    programmer = get_programmer(ctx)
+    try:
+        flash = programmer.dump(start, length)
+    except (ArduMgrError, OSError) as e:
+        raise click.ClickException(str(e))
+
+    if output.lower().endswith(".hex"):
+        flash.write_hex(output)
+    else:
+        flash.write_bin(output)
+
+    click.echo("%d bytes, CRC32 0x%08X" % (flash.size, flash.crc32()))
+
+
+@main.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option('-d', '--dump', "dump_path",
+              type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Compare against a previous dump instead of the board")
+@click.option('--hash-only', is_flag=True, default=False,
+              help="Only compare digests of page ranges")
+@click.pass_context
+def verify(ctx, path, dump_path, hash_only):
+    """
+    Verify flash of the board against an image
+    """
+
+    programmer = get_programmer(ctx)
+    try:
+        mismatches = programmer.verify_bin(path, dump_path, hash_only)
+    except (ArduMgrError, OSError) as e:
+        raise click.ClickException(str(e))
+
+    if mismatches:
+        click.echo("Mismatched: %s" % format_ranges(mismatches))
+        ctx.exit(1)
+
+    click.echo("Verified")
+
+
+@main.command()
+@click.option('-i', '--interval', type=float, default=1.0,
+              help="Seconds to wait for changes per check")
+@click.pass_context
+def watch(ctx, interval):
+    """
+    Watch configs and tools, print invalidated entries
+    """
+
     manager = ctx.obj["manager"]
-    platform = Platform(manager, manager._cfgs["ardumgr.platform"])
-    programmer = Programmer(platform)
 
-    programmer.upload_bin(path)
+    with Watcher(manager) as watcher:
+        for id_ in manager.platforms:
+            watcher.watch_platform(manager.get_platform(id_))
+
+        while True:
+            for kind, id_ in watcher.check(interval):
+                click.echo("%s%s" % (kind, "" if id_ is None else " " + id_))
+
+
+@main.command()
+@click.argument("sketch_path", type=click.Path(exists=True, file_okay=False))
+@click.argument("build_path", required=False)
+@click.option('-j', '--jobs', type=int, default=None,
+              help="Parallel compile jobs, defaults to CPU count")
+@click.option('-w', '--worker', multiple=True,
+              help="Compile worker HOST:PORT[:SLOTS]")
+@click.option('--worker-token', envvar="ARDUMGR_WORKER_TOKEN", default=None,
+              help="Secret of compile workers")
+@click.pass_context
+def build(ctx, sketch_path, build_path, jobs, worker, worker_token):
+    """
+    Build sketch, only changed sources will be recompiled
+    """
+
+    manager = ctx.obj["manager"]
+    platform = manager.get_platform(manager._cfgs["ardumgr.platform"])
+    programmer = platform.get_programmer()
+
+    if build_path is None:
+        build_path = Path(sketch_path) / "build"
+
+    compiler = None
+    if worker:
+        compiler = DistributedCompiler(
+            [value.split(":") for value in worker], jobs or 1,
+            token=worker_token)
+        jobs = compiler.jobs
+
+    builder = Builder(programmer, sketch_path, build_path, jobs,
+                      compiler=compiler)
+    try:
+        result = builder.build()
+    except ArduMgrError as e:
+        raise click.ClickException(str(e))
+
+    click.echo("%s (compiled %s, %s)" % (
+        result.elf, result.compiled,
+        "linked" if result.linked else "up to date"))
+
+
+@main.command(name="build-matrix")
+@click.argument("sketches", nargs=-1, required=True,
+                type=click.Path(exists=True, file_okay=False))
+@click.option('-b', '--board', multiple=True,
+              help="Board identity PLATFORM:BOARD[:MENU=OPTION,...], "
+              "defaults to preferences")
+@click.option('-o', '--output', "build_root", default="build-matrix",
+              help="Build root of all jobs")
+@click.option('-j', '--jobs', type=int, default=None,
+              help="Parallel tasks, defaults to CPU count")
+@click.option('-w', '--worker', multiple=True,
+              help="Compile worker HOST:PORT[:SLOTS]")
+@click.option('--worker-token', envvar="ARDUMGR_WORKER_TOKEN", default=None,
+              help="Secret of compile workers")
+@click.option('-f', '--format', "format_",
+              type=click.Choice(["table", "json"]), default="table")
+@click.pass_context
+def build_matrix(ctx, sketches, board, build_root, jobs, worker,
+                 worker_token, format_):
+    """
+    Build every sketch for every board, boards with the same core share
+    its build
+    """
+
+    manager = ctx.obj["manager"]
+    boards = list(board)
+    if not boards:
+        try:
+            boards.append(get_default_identity(manager))
+        except KeyError:
+            raise click.UsageError("No board specified!")
+
+    compiler = None
+    if worker:
+        compiler = DistributedCompiler(
+            [value.split(":") for value in worker], jobs or 1,
+            token=worker_token)
+        jobs = compiler.jobs
+
+    try:
+        result = BuildMatrix(
+            manager, sketches, boards, build_root, jobs, compiler).run()
+    except ArduMgrError as e:
+        raise click.UsageError(str(e))
+
+    if format_ == "json":
+        write_matrix_json(result, click.get_text_stream("stdout"))
+    else:
+        def parse(job):
+            if job.error is not None:
+                state = "failed"
+            else:
+                state = "%.2fs (compiled %s, %s)" % (
+                    job.finished - job.started, job.compiled,
+                    "linked" if job.linked else "up to date")
+            return "%s %s" % (Path(job.sketch).name, job.board), state
+
+        print_table(result.jobs, parse)
+
+        click.echo("%s jobs, %s cores, %.2fs, critical path %.2fs:" % (
+            len(result.jobs), result.cores, result.seconds,
+            result.critical_seconds))
+        print_table(result.critical_path, lambda timing: (
+            "  " + timing.name, "%.2fs" % timing.seconds))
+
+        for job in result.jobs:
+            if job.error is not None:
+                click.echo("%s %s:\n%s" % (
+                    Path(job.sketch).name, job.board, job.error), err=True)
+
+    if any(job.error is not None for job in result.jobs):
+        ctx.exit(1)
+
+
+@main.command()
+@click.option('-b', '--bind', default="127.0.0.1", help="Address to bind")
+@click.option('--port', type=int, default=7410)
+@click.option('-t', '--toolchain', multiple=True, required=True,
+              help="Path of a compiler this worker provides")
+@click.option('-j', '--jobs', type=int, default=None,
+              help="Parallel compile jobs, defaults to CPU count")
+@click.option('--token', envvar="ARDUMGR_WORKER_TOKEN", default=None,
+              help="Secret clients must present, required unless bound to "
+              "a loopback address")
+def worker(bind, port, toolchain, jobs, token):
+    """
+    Accept compile jobs from other hosts
+    """
+
+    try:
+        serve(bind, port, toolchain, jobs, token)
+    except ArduMgrError as e:
+        raise click.UsageError(str(e))
+
+
+@main.command()
+@click.option('-n', '--count', type=int, default=1,
+              help="Count of emulated boards")
+@click.option('--baudrate', type=int, default=None,
+              help="Emulate transfer time of serial lines")
+@click.option('--sessions', type=int, default=None,
+              help="Exit after every board finished SESSIONS uploads, "
+              "defaults to run until interrupted")
+def emulate(count, baudrate, sessions):
+    """
+    Emulate optiboot bootloaders on pseudo-terminals, print their ports,
+    then timing reports of uploads as JSON
+    """
+
+    with emulate_bootloaders(count, baudrate=baudrate) as emulators:
+        for emulator in emulators:
+            click.echo(emulator.port)
+
+        try:
+            for emulator in emulators:
+                while not emulator.wait_sessions(sessions or float("inf"),
+                                                 timeout=1.0):
+                    pass
+        except KeyboardInterrupt:
+            pass
+
+        reports = OrderedDict(
+            (emulator.port, emulator.report()) for emulator in emulators)
+
+    click.echo(json.dumps(reports, indent=2))
+
+
+@main.command()
+@click.argument("platform")
+@click.option('-j', '--jobs', type=int, default=None,
+              help="Worker processes, defaults to CPU count")
+@click.pass_context
+def check(ctx, platform, jobs):
+    """
+    Check patterns of all boards and programmers on specific platform.
+    """
+
+    manager = ctx.obj["manager"]
+
+    if platform not in manager.platforms:
+        raise click.BadParameter("Unsupported platform!")
+
+    issues = check_platform(manager, platform, jobs)
+    for issue in issues:
+        click.echo("%s[%s] %s: %s %s: %s" % (
+            issue.board, issue.menus, issue.programmer, issue.kind,
+            issue.key, issue.detail))
+
+    if issues:
+        ctx.exit(1)
+
+
+@main.command(name="export")
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option('-x', '--expand', is_flag=True, default=False,
+              help="Expand values for current OS")
+@click.option('-f', '--format', "format_",
+              type=click.Choice(["json", "msgpack"]), default=None,
+              help="Defaults to msgpack if OUTPUT ends with .msgpack")
+@click.pass_context
+def export(ctx, output, expand, format_):
+    """
+    Export resolved configs of current programmer
+    """
+
+    data = export_programmer(get_programmer(ctx), expand)
+    try:
+        write_export(data, output, format_)
+    except ArduMgrError as e:
+        raise click.UsageError(str(e))
+
+
+def print_changes(changes, indent=""):
+    for change in changes:
+        if change.old is None:
+            click.echo("%s+ %s=%s" % (indent, change.key, change.new))
+        elif change.new is None:
+            click.echo("%s- %s=%s" % (indent, change.key, change.old))
+        else:
+            click.echo("%s~ %s=%s -> %s" % (
+                indent, change.key, change.old, change.new))
+
+
+@main.command(name="diff")
+@click.argument("old")
+@click.argument("new", required=False)
+@click.option('-P', '--other-preference', multiple=True,
+              help="Preference of NEW side, for ex: ardumgr.home_path of "
+              "another installation")
+@click.option('-x', '--expand', is_flag=True, default=False,
+              help="Compare values expanded for current OS")
+@click.pass_context
+def diff(ctx, old, new, other_preference, expand):
+    """
+    Show added (+), removed (-) and changed (~) configs from OLD to NEW.
+
+    Both are a platform, or a board identity
+    PLATFORM:BOARD[:MENU=OPTION,...]. NEW defaults to OLD.
+    """
+
+    manager = ctx.obj["manager"]
+    other_manager = manager
+    if other_preference:
+        preferences = OrderedDict(manager._preferences)
+        preferences.update(
+            parse_preferences("--other-preference", other_preference))
+        other_manager = ArduMgr(preferences, manager.file_cache)
+
+    if new is None:
+        new = old
+
+    if (":" in old) != (":" in new):
+        raise click.UsageError("Can't compare a platform with a board!")
+
+    try:
+        if ":" in old:
+            old_cfgs = size_report.get_identity_programmer(
+                manager, old).cfgs
+            new_cfgs = size_report.get_identity_programmer(
+                other_manager, new).cfgs
+            changes = old_cfgs.diff(
+                new_cfgs, expand, DIFF_EXCLUDED_PREFIXES, True)
+            print_changes(changes)
+            if changes:
+                ctx.exit(1)
+
+            return
+
+        old_platform = manager.get_platform(old)
+        new_platform = other_manager.get_platform(new)
+        diffs = old_platform.diff(new_platform, expand)
+    except (ArduMgrError, KeyError) as e:
+        raise click.UsageError(str(e))
+
+    old_boards = set(old_platform.boards)
+    new_boards = set(new_platform.boards)
+    for board in sorted(old_boards - new_boards):
+        click.echo("- %s" % board)
+
+    for board in sorted(new_boards - old_boards):
+        click.echo("+ %s" % board)
+
+    for board, changes in diffs.items():
+        click.echo("%s:" % board)
+        print_changes(changes, "    ")
+
+    if diffs or (old_boards != new_boards):
+        ctx.exit(1)
+
+
+@main.group()
+@click.option('--db', type=click.Path(dir_okay=False), default=None,
+              help="Queue database, defaults to upload-queue.sqlite in "
+              "cache directory")
+@click.pass_context
+def queue(ctx, db):
+    """
+    Persistent upload job queue
+    """
+
+    if db is None:
+        cache_dir = ctx.obj["manager"].cache_dir
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        db = cache_dir / "upload-queue.sqlite"
+
+    ctx.obj["queue"] = JobQueue(db)
+    ctx.call_on_close(ctx.obj["queue"].close)
+
+
+def print_queue_status(status):
+    click.echo(" ".join("%s=%s" % item for item in status.items()))
+
+
+@queue.command(name="add")
+@click.argument("images", nargs=-1, required=True)
+@click.option('-b', '--batch', default="default")
+@click.pass_context
+def queue_add(ctx, images, batch):
+    """
+    Enqueue images for current board, use "-p" to specific the target
+    """
+
+    manager = ctx.obj["manager"]
+    preferences = OrderedDict(
+        (k, v) for k, v in manager._preferences.items()
+        if k.startswith("ardumgr.") and (k != "ardumgr.home_path"))
+
+    for image in images:
+        ctx.obj["queue"].add(str(Path(image).resolve()), preferences, batch)
+
+    print_queue_status(ctx.obj["queue"].status(batch))
+
+
+@queue.command(name="run")
+@click.option('-b', '--batch', default=None)
+@click.option('-j', '--jobs', type=int, default=1,
+              help="Parallel uploads")
+@click.pass_context
+def queue_run(ctx, batch, jobs):
+    """
+    Upload pending jobs
+    """
+
+    status = ctx.obj["queue"].run(ctx.obj["manager"], jobs, batch)
+    print_queue_status(status)
+    if status["failed"]:
+        ctx.exit(1)
+
+
+@queue.command(name="resume")
+@click.option('-b', '--batch', default=None)
+@click.option('-j', '--jobs', type=int, default=1,
+              help="Parallel uploads")
+@click.pass_context
+def queue_resume(ctx, batch, jobs):
+    """
+    Upload unfinished and failed jobs again
+    """
+
+    ctx.obj["queue"].resume(batch)
+    ctx.invoke(queue_run, batch=batch, jobs=jobs)
+
+
+@queue.command(name="status")
+@click.option('-b', '--batch', default=None)
+@click.option('-v', '--verbose', is_flag=True, default=False,
+              help="Show every job")
+@click.pass_context
+def queue_status(ctx, batch, verbose):
+    """
+    Show counts of jobs by state
+    """
+
+    if verbose:
+        for job in ctx.obj["queue"].jobs(batch):
+            click.echo("%s %s %s %s exit=%s attempts=%s %s" % (
+                job.id, job.batch, job.state, job.image, job.exit_code,
+                job.attempts, job.error or ""))
+
+    print_queue_status(ctx.obj["queue"].status(batch))
+
+
+@main.group(name="index")
+@click.option('--db', type=click.Path(dir_okay=False), default=None,
+              help="Index database, defaults to package-index.sqlite in "
+              "cache directory")
+@click.pass_context
+def package_index(ctx, db):
+    """
+    Search Boards Manager package index files
+    """
+
+    ctx.obj["index"] = PackageIndex.for_manager(ctx.obj["manager"], db)
+    ctx.call_on_close(ctx.obj["index"].close)
+
+
+@package_index.command(name="update")
+@click.option('-f', '--force', is_flag=True, default=False,
+              help="Parse all files even if they are not changed")
+@click.pass_context
+def index_update(ctx, force):
+    """
+    Parse changed package index files
+    """
+
+    index = ctx.obj["index"]
+    for path in index.update(force):
+        click.echo("Parsed %s" % path)
+
+    for table, count in sorted(index.counts.items()):
+        click.echo("%s: %s" % (table, count))
+
+
+@package_index.command(name="platforms")
+@click.argument("package", required=False)
+@click.option('-a', '--all-versions', is_flag=True, default=False)
+@click.pass_context
+def index_platforms(ctx, package, all_versions):
+    """
+    Show platforms of all packages or a package
+    """
+
+    def parse(platform):
+        return "%s:%s@%s" % (platform.package, platform.architecture,
+                             platform.version), platform.name
+
+    print_table(ctx.obj["index"].get_platforms(package, all_versions), parse)
+
+
+@package_index.command(name="boards")
+@click.argument("name")
+@click.option('-a', '--all-versions', is_flag=True, default=False)
+@click.pass_context
+def index_boards(ctx, name, all_versions):
+    """
+    Show platforms provide boards whose names contain NAME
+    """
+
+    def parse(board):
+        return "%s:%s@%s" % (board.package, board.architecture,
+                             board.version), board.name
+
+    print_table(ctx.obj["index"].find_boards(name, all_versions), parse)
+
+
+@package_index.command(name="deps")
+@click.argument("platform")
+@click.pass_context
+def index_deps(ctx, platform):
+    """
+    Show tools required by PLATFORM (PACKAGE:ARCHITECTURE[@VERSION])
+    """
+
+    platform, _, version = platform.partition("@")
+    package, sep, architecture = platform.partition(":")
+    if not sep:
+        raise click.BadParameter("Platform must be PACKAGE:ARCHITECTURE!")
+
+    try:
+        dependencies = ctx.obj["index"].get_tool_dependencies(
+            package, architecture, version or None)
+    except ArduMgrError as e:
+        raise click.UsageError(str(e))
+
+    for dependency in dependencies:
+        click.echo("%s:%s@%s" % dependency)
+
+
+def get_default_identity(manager):
+    cfgs = manager._cfgs
+    options = []
+    if ("ardumgr.cpu" in cfgs) and cfgs["ardumgr.cpu"]:
+        options.append("cpu=%s" % cfgs["ardumgr.cpu"])
+    for menu, option in cfgs.get_subtree("ardumgr.menu").items():
+        options.append("%s=%s" % (menu, option))
+
+    identity = "%s:%s" % (cfgs["ardumgr.platform"], cfgs["ardumgr.board"])
+    if options:
+        identity += ":" + ",".join(options)
+
+    return identity
+
+
+@main.command()
+@click.argument("images", nargs=-1, required=True)
+@click.option('-b', '--board', default=None,
+              help="Board identity PLATFORM:BOARD[:MENU=OPTION,...] of "
+              "images, defaults to preferences")
+@click.option('-f', '--format', "format_", type=click.Choice(["json", "csv"]),
+              default="json")
+@click.option('-o', '--output', type=click.File("w"), default="-")
+@click.option('-j', '--jobs', type=int, default=None,
+              help="Parallel size tools, defaults to CPU count")
+@click.pass_context
+def size(ctx, images, board, format_, output, jobs):
+    """
+    Report sizes of images against board limits.
+
+    An image could be given as IDENTITY@PATH to override the board. Only
+    flash sizes are reported for .hex and .bin images.
+    """
+
+    manager = ctx.obj["manager"]
+
+    builds = []
+    for image in images:
+        identity, sep, path = image.partition("@")
+        if sep and (":" in identity) and not Path(image).exists():
+            builds.append((path, identity))
+            continue
+
+        if board is None:
+            try:
+                board = get_default_identity(manager)
+            except KeyError:
+                raise click.UsageError("Board of %s not specified!" % image)
+
+        builds.append((image, board))
+
+    try:
+        results = size_report.measure(manager, builds, jobs)
+    except ArduMgrError as e:
+        raise click.UsageError(str(e))
+
+    if format_ == "csv":
+        size_report.write_csv(results, output)
+    else:
+        size_report.write_json(results, output)
+
+    if not all(result.passed for result in results):
+        ctx.exit(1)
 
 
 @main.group()
@@ -117,7 +826,7 @@ def show_platforms(ctx):
     manager = ctx.obj["manager"]
 
     def parse(id_):
-        platform = Platform(manager, id_)
+        platform = manager.get_platform(id_)
         return id_, platform.cfgs["name"]
     print_table(manager.platforms, parse)
 
@@ -148,7 +857,7 @@ def show_programmers(ctx, platform):
     if platform not in manager.platforms:
         raise click.BadParameter("Unsupported platform!")
 
-    platform = Platform(manager, platform)
+    platform = manager.get_platform(platform)
 
     def parse(id_):
         name = platform.cfgs["programmers.%s.name" % id_]
@@ -169,7 +878,7 @@ def show_boards(ctx, platform):
     if platform not in manager.platforms:
         raise click.BadParameter("Unsupported platform!")
 
-    platform = Platform(manager, platform)
+    platform = manager.get_platform(platform)
 
     def parse(id_):
         name = platform.cfgs["boards.%s.name" % id_]
@@ -178,6 +887,58 @@ def show_boards(ctx, platform):
     print_table(platform.boards, parse)
 
 
+@show.command(name="menus")
+@click.argument("platform")
+@click.argument("board")
+@click.pass_context
+def show_menus(ctx, platform, board):
+    """
+    Show menus and their options of specific board.
+    """
+
+    manager = ctx.obj["manager"]
+
+    if platform not in manager.platforms:
+        raise click.BadParameter("Unsupported platform!")
+
+    platform = manager.get_platform(platform)
+
+    if board not in platform.boards:
+        raise click.BadParameter("Unsupported board!")
+
+    labels = platform.menus
+    for menu, options in platform.get_board_menus(board).items():
+        click.echo("%s: %s" % (menu, labels.get(menu, "")))
+
+        max_len = calc_max_len(options.keys())
+        for id_, name in options.items():
+            click.echo("    %s%s%s" % (id_, " " * (max_len - len(id_)), name))
+
+
+@show.command(name="libraries")
+@click.argument("platform")
+@click.pass_context
+def show_libraries(ctx, platform):
+    """
+    Show libraries available on specific platform.
+    """
+
+    manager = ctx.obj["manager"]
+
+    if platform not in manager.platforms:
+        raise click.BadParameter("Unsupported platform!")
+
+    index = LibraryIndex.for_platform(manager.get_platform(platform))
+    libraries = dict()
+    for library in index.libraries:
+        libraries.setdefault(library.name, library)
+
+    def parse(name):
+        return name, libraries[name].root
+
+    print_table(sorted(libraries.keys()), parse)
+
+
 @show.command(name="tools")
 @click.argument("platform")
 @click.pass_context
@@ -191,7 +952,7 @@ def show_tools(ctx, platform):
     if platform not in manager.platforms:
         raise click.BadParameter("Unsupported platform!")
 
-    platform = Platform(manager, platform)
+    platform = manager.get_platform(platform)
 
     def parse(id_):
         # Tools does not have a name
@@ -200,6 +961,38 @@ def show_tools(ctx, platform):
     print_table(platform.tools, parse)
 
 
+@show.command(name="ports")
+@click.argument("platform", required=False)
+@click.pass_context
+def show_ports(ctx, platform):
+    """
+    Show serial ports, and boards matched on specific platform.
+    """
+
+    manager = ctx.obj["manager"]
+
+    if platform is not None:
+        if platform not in manager.platforms:
+            raise click.BadParameter("Unsupported platform!")
+
+        platform = manager.get_platform(platform)
+
+    pool = PortPool()
+
+    def parse(port):
+        details = []
+        if port.vid is not None:
+            details.append("%s:%s" % (port.vid, port.pid))
+        if port.product:
+            details.append(port.product)
+        if platform is not None:
+            details.extend(pool.get_boards(platform, port))
+
+        return port.device, " ".join(details)
+
+    print_table(pool.ports, parse)
+
+
 @show.command(name="version")
 @click.pass_context
 def show_version(ctx):
@@ -233,8 +1026,8 @@ def show_pref(ctx, name):
     """
 
     manager = ctx.obj["manager"]
-    platform = Platform(manager, manager._cfgs["ardumgr.platform"])
-    programmer = Programmer(platform)
+    platform = manager.get_platform(manager._cfgs["ardumgr.platform"])
+    programmer = platform.get_programmer()
 
     try:
         click.echo(programmer._cfgs.get_overrided(name))
@@ -244,21 +1037,39 @@ def show_pref(ctx, name):
 
 @show.command(name="epref")
 @click.argument("name")
+@click.option("--os", "oss", multiple=True,
+              type=click.Choice(list(OS_SUFFIXES) + ["all"]),
+              help="Expand for these OSes instead of the running one, "
+              "could be repeated")
 @click.pass_context
-def show_epref(ctx, name):
+def show_epref(ctx, name, oss):
     """
     Show internal preferences (EXPANDED)
     """
 
-    manager = ctx.obj["manager"]
-    platform = Platform(manager, manager._cfgs["ardumgr.platform"])
-    programmer = Programmer(platform)
+    programmer = get_programmer(ctx)
 
     try:
         overrided = programmer._cfgs.get_overrided(name)
     except KeyError:
         raise click.BadArgumentUsage("Preference '%s' not found!" % name)
 
+    if oss:
+        if "all" in oss:
+            oss = ctx.obj["manager"].oss
+
+        try:
+            expanded = programmer.expand_for_os([name], oss)
+        except KeyError as e:
+            raise click.BadArgumentUsage(
+                "Replacement field %s not found! %s=%s" % (
+                    str(e), name, overrided))
+
+        for anos, values in expanded.items():
+            click.echo("%s: %s" % (anos, values[name]))
+
+        return
+
     try:
         click.echo(programmer._cfgs.get_expanded(name))
     except KeyError as e:
@@ -273,11 +1084,12 @@ def show_prefs(ctx):
     Show all internal preferences (RAW)
     """
 
-    manager = ctx.obj["manager"]
-    platform = Platform(manager, manager._cfgs["ardumgr.platform"])
-    programmer = Programmer(platform)
-    for k, v in programmer._cfgs.items():
-        click.echo("%s=%s" % (k, programmer._cfgs.get_overrided(k)))
+    programmer = get_programmer(ctx)
+    flat = programmer._cfgs.flatten()
+    runtime_os = flat["runtime.os"]
+    click.echo("\n".join(
+        "%s=%s" % (k, flat.get("%s.%s" % (k, runtime_os), v))
+        for k, v in flat.items()))
 
 
 if __name__ == "__main__":
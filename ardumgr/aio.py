@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio counterparts of ArduMgr, Platform and Programmer.
+
+Config loading runs in an executor, uploads run the upload tool through
+asyncio subprocesses, so neither blocks the event loop:
+
+    manager = await aio.create_manager(preferences)
+    platform = await aio.create_platform(manager, "avr")
+    programmer = await aio.AsyncProgrammer.create(
+        platform, semaphore=asyncio.Semaphore(4))
+    exit_code = await programmer.upload_bin("/tmp/build/blink.hex")
+
+Cancelling an upload kills the child upload tool.
+"""
+
+import os
+import time
+import signal
+import asyncio
+from pathlib import Path
+from .ardumgr import ArduMgr
+from .configs import Platform
+from .programmer import Programmer
+from . import profiling
+
+
+try:
+    _get_running_loop = asyncio.get_running_loop
+except AttributeError:
+    # Python < 3.7, returns the running loop when called from a coroutine
+    _get_running_loop = asyncio.get_event_loop
+
+
+def _run_in_executor(executor, func, *args):
+    loop = _get_running_loop()
+    return loop.run_in_executor(executor, func, *args)
+
+
+async def create_manager(preferences, executor=None):
+    return await _run_in_executor(executor, ArduMgr, preferences)
+
+
+async def create_platform(manager, id_, executor=None):
+    return await _run_in_executor(executor, Platform, manager, id_)
+
+
+async def create_programmer(platform, executor=None):
+    return await _run_in_executor(executor, Programmer, platform)
+
+
+class AsyncProgrammer(object):
+    """
+    Wrap a Programmer to upload without blocking the event loop.
+
+    Uploads sharing the same semaphore are limited to its value, so a
+    single semaphore could cap parallel uploads of a whole service.
+    """
+
+    def __init__(self, programmer, semaphore=None):
+        self._programmer = programmer
+        self._semaphore = semaphore
+
+    @classmethod
+    async def create(cls, platform, semaphore=None, executor=None):
+        programmer = await create_programmer(platform, executor)
+        return cls(programmer, semaphore)
+
+    @property
+    def programmer(self):
+        return self._programmer
+
+    async def _call_upload_tool(self, pattern):
+        # Run by a shell like Programmer does, in a new session on POSIX so
+        # that killing its process group stops the upload tool too
+        if os.name == "nt":
+            process = await asyncio.create_subprocess_shell(pattern)
+        else:
+            process = await asyncio.create_subprocess_shell(
+                pattern, start_new_session=True)
+
+        try:
+            return await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                if os.name == "nt":
+                    process.kill()
+                else:
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                await process.wait()
+            raise
+
+    async def _upload(self, build_path, project_name, image_path, retries):
+        programmer = self._programmer
+        if programmer.get_native_uploader() is not None:
+            # Native uploads don't spawn processes, run them in threads
+            if self._semaphore is None:
+                return await _run_in_executor(
+                    None, programmer._upload, build_path, project_name,
+                    image_path, retries)
+
+            async with self._semaphore:
+                return await _run_in_executor(
+                    None, programmer._upload, build_path, project_name,
+                    image_path, retries)
+
+        image = programmer.check_image(image_path)
+        pattern = programmer._generate_upload_pattern(
+            build_path, project_name)
+
+        if retries is None:
+            retries = programmer._get_upload_retries()
+
+        for attempt in range(retries + 1):
+            started = time.monotonic()
+            profiler = profiling.active
+            if profiler is not None:
+                profiler_started = profiler.clock()
+
+            if self._semaphore is None:
+                exit_code = await self._call_upload_tool(pattern)
+            else:
+                async with self._semaphore:
+                    exit_code = await self._call_upload_tool(pattern)
+
+            if profiler is not None:
+                profiler.record(
+                    "programmer.upload.subprocess", profiler_started)
+
+            programmer._record_upload_attempt(attempt, started, exit_code)
+
+            if exit_code == 0:
+                break
+
+        programmer._record_upload_result(exit_code, image)
+        return exit_code
+
+    async def upload(self, build_path=None, project_name=None, retries=None):
+        image_path = self._programmer._find_image(build_path, project_name)
+        return await self._upload(
+            build_path, project_name, image_path, retries)
+
+    async def upload_bin(self, binary_file_path, retries=None):
+        path = Path(binary_file_path)
+        return await self._upload(
+            path.parent, os.path.splitext(path.name)[0], path, retries)
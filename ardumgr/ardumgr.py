@@ -5,12 +5,53 @@
 import re
 import sys
 from pathlib import Path
-from .configs import ConfigsMgr, Platform
+from collections import OrderedDict
+from .configs import ConfigsMgr, Platform, OS_SUFFIXES
+from .export import read_export
+from .cache import LRUCache, DEFAULT_SIZE
+from .exceptions import ArduMgrError
+from . import profiling
+
+
+def version_to_int(version):
+    """
+    Return version as int value
+
+    Samples:
+
+    0022 ->  22
+    0022ubuntu0.1 ->  22
+    0023 ->  23
+    1.0  -> 100
+    1.0.3  -> 103
+    1:1.0.5+dfsg2-2 -> 105
+    1.8.0 -> 10800
+    """
+
+    version = version.split('ubuntu')[0]
+    version = version.split(':')[-1]
+    version = version.split('+')[0]
+
+    if version.startswith('00'):  # <100
+        value = int(version[0:4])
+
+    elif '.' in version:  # >=100
+        parts = version.split('.')
+        parts += [0, 0, 0]
+        value = int(parts[0]) * 10000 + int(parts[1]) * 100 + int(parts[2])
+
+        if value < 10500:  # Version below 1.5.0
+            value = (int(parts[0]) * 100
+                     + int(parts[1]) * 10
+                     + int(parts[2]))
+
+    return value
 
 
 class ArduMgr(object):
 
-    def __init__(self, preferences):
+    @profiling.timed("ardumgr.init")
+    def __init__(self, preferences, file_cache=None):
         """
         Initialize ArduMgr object
 
@@ -19,20 +60,66 @@ class ArduMgr(object):
 
             ardumgr.home_path
 
+        @arg file_cache A ParsedFileCache shared with other managers, see
+        ArduMgrRegistry
         """
 
+        self._preferences = OrderedDict(preferences)
         self._home_path = Path(str(preferences["ardumgr.home_path"]))
+        self._file_cache = file_cache
+        self._version = None
 
         # Check if the specified Arduino installation version is before 1.5.0
+        self._is_old_style_dirs = (self.int_version
+                                   < version_to_int('1.5.0'))
+
+        self._cfgs = ConfigsMgr()
+        self._scanned_dirs = []
+        self._tool_keys = dict()
+        self._platforms = list()
+        self._load()
+        self._platform_cache = LRUCache(self.cache_size)
+
+    @classmethod
+    def from_export(cls, export):
+        """
+        Create a manager from configs exported by
+        ardumgr.export.export_programmer(), nothing is loaded from disk.
+
+        Only the exported platform is listed, use Programmer.from_export()
+        to get the programmer.
+
+        @arg export Path of an export file, or the exported dict
+        """
+
+        if not isinstance(export, dict):
+            export = read_export(export)
+
+        self = cls.__new__(cls)
+        self._cfgs = ConfigsMgr()
+        self._cfgs.update(export["configs"])
+        self._preferences = OrderedDict(
+            (k, v) for k, v in export["configs"].items()
+            if k.startswith("ardumgr."))
+        self._home_path = Path(self._cfgs["runtime.ide.path"])
+        self._file_cache = None
+        # The installation may not exist on this machine
+        self._version = export.get("ide_version")
+        self._is_old_style_dirs = (
+            self.int_version < version_to_int("1.5.0"))
+        self._scanned_dirs = []
+        self._tool_keys = dict()
+        self._platforms = [export["platform"]]
+        self._platform_cache = LRUCache(self.cache_size)
+        return self
+
+    def _load(self):
         version_text = self.version
-        self._is_old_style_dirs = (self._version_to_int(self.version)
-                                   < self._version_to_int('1.5.0'))
 
         # The Arduino installation version is 1.5.0, so there is no IDE
         # run-time configuration available.
-        self._cfgs = ConfigsMgr()
-        self._cfgs.update(preferences)
-        self._cfgs['runtime.ide.version'] = self._version_to_int(version_text)
+        self._cfgs.update(self._preferences)
+        self._cfgs['runtime.ide.version'] = version_to_int(version_text)
 
         # Set default target package if target_package not yet specificed
         key = 'target_package'
@@ -40,8 +127,7 @@ class ArduMgr(object):
             self._cfgs[key] = "arduino"
 
         # Load runtime preferences
-        preferences_path = self.user_dir / "preferences.txt"
-        self._cfgs.load(preferences_path)
+        self._cfgs.load(self.preferences_path, cache=self._file_cache)
 
         # Fixed IDE's settings that lead wrong text expanded to preferences
         # just like "tools.avrdude.upload.pattern", etc.
@@ -59,49 +145,157 @@ class ArduMgr(object):
             self._cfgs[key] = ""
 
         # Analyse runtime tools paths
-        user_tools_dir = self.user_dir / "packages" / "arduino" / "tools"
+        self._load_tools()
+
+        # Add runtime os config
+        key = "runtime.os"
+        self._cfgs[key] = "linux"
+        if sys.platform == "win32":
+            self._cfgs[key] = "windows"
+        elif sys.platform == "darwin":
+            self._cfgs[key] = "macosx"
+
+        # Search platform dirs
+        self._load_platforms()
+
+    def _load_tools(self):
+        user_tools_dir = self.user_tools_dir
+        self._scanned_dirs.append(user_tools_dir)
         try:
             for tool_base_dir in user_tools_dir.iterdir():
                 if not tool_base_dir.is_dir():
                     continue
 
-                # Included multi-versions tool
-                for adir in tool_base_dir.iterdir():
-                    if not adir.is_dir():
-                        continue
+                self._load_tool(tool_base_dir)
+        except FileNotFoundError:
+            # User tools paths not found at pre15 style directories
+            pass
 
-                    value = str(adir)
+    def _load_tool(self, tool_base_dir):
+        self._scanned_dirs.append(tool_base_dir)
+        keys = self._tool_keys.setdefault(tool_base_dir.name, [])
 
-                    key = 'runtime.tools.%s.path' % tool_base_dir.name
-                    self._cfgs[key] = value
+        # Included multi-versions tool
+        for adir in tool_base_dir.iterdir():
+            if not adir.is_dir():
+                continue
 
-                    key = 'runtime.tools.%s-%s.path' % (
-                        tool_base_dir.name, adir.name)
-                    self._cfgs[key] = value
+            value = str(adir)
 
-                    key = 'runtime.tools.arduino-%s-%s.path' % (
-                        tool_base_dir.name, adir.name)
-                    self._cfgs[key] = value
-        except FileNotFoundError:
-            # User tools paths not found at pre15 style directories
-            pass
+            key = 'runtime.tools.%s.path' % tool_base_dir.name
+            self._cfgs[key] = value
+            keys.append(key)
 
-        # Add runtime os config
-        key = "runtime.os"
-        self._cfgs[key] = "linux"
-        if sys.platform == "win32":
-            self._cfgs[key] = "windows"
-        elif sys.platform == "darwin":
-            self._cfgs[key] = "macosx"
+            key = 'runtime.tools.%s-%s.path' % (
+                tool_base_dir.name, adir.name)
+            self._cfgs[key] = value
+            keys.append(key)
 
-        # Search platform dirs
+            key = 'runtime.tools.arduino-%s-%s.path' % (
+                tool_base_dir.name, adir.name)
+            self._cfgs[key] = value
+            keys.append(key)
+
+    def _load_platforms(self):
         self._platforms = list()
         if self._is_old_style_dirs:
             self._platforms.append('avr')
         else:
-            for adir in self._get_platform_base_dir().iterdir():
+            platform_base_dir = self._get_platform_base_dir()
+            self._scanned_dirs.append(platform_base_dir)
+            for adir in platform_base_dir.iterdir():
                 self._platforms.append(adir.name)
 
+    def reload(self):
+        """
+        Reload preferences, tools and platforms from disk.
+
+        Platforms created from this manager keep working, they are based on
+        the same configs object which is refilled in place, and cached ones
+        are reloaded too.
+        """
+
+        self._cfgs.clear()
+        self._scanned_dirs = []
+        self._tool_keys = dict()
+        self._version = None
+        self._load()
+
+        cache_size = self.cache_size
+        self._platform_cache.maxsize = cache_size
+        # Cached platforms still hold the old boards.txt and platform.txt
+        for platform in self._platform_cache.values():
+            if platform.id_ not in self._platforms:
+                self._platform_cache.discard(platform.id_)
+                continue
+
+            platform.programmer_cache.maxsize = cache_size
+            platform.reload()
+
+    def reload_tool(self, name):
+        """
+        Rescan runtime paths of a single tool under user tools directory
+        """
+
+        for key in self._tool_keys.pop(name, []):
+            if key in self._cfgs:
+                del self._cfgs[key]
+
+        tool_base_dir = self.user_tools_dir / name
+        self._scanned_dirs = [
+            adir for adir in self._scanned_dirs if adir != tool_base_dir]
+        if tool_base_dir.is_dir():
+            self._load_tool(tool_base_dir)
+
+        self._clear_programmer_caches()
+
+    def reload_platforms(self):
+        """
+        Rescan the platform list
+        """
+
+        platform_base_dir = self._get_platform_base_dir()
+        self._scanned_dirs = [
+            adir for adir in self._scanned_dirs if adir != platform_base_dir]
+        self._load_platforms()
+
+        for platform in self._platform_cache.values():
+            if platform.id_ not in self._platforms:
+                self._platform_cache.discard(platform.id_)
+
+    def _clear_programmer_caches(self):
+        # Programmers copied configs of the manager while created
+        for platform in self._platform_cache.values():
+            platform.programmer_cache.clear()
+
+    def get_platform(self, id_):
+        """
+        Cached factory of platforms, reloading a platform (for ex: by
+        Watcher) updates the cached one in place.
+        """
+
+        if id_ not in self._platforms:
+            raise ArduMgrError("Unsupported platform \"%s\"!" % id_)
+
+        return self._platform_cache.get(id_, lambda: Platform(self, id_))
+
+    @property
+    def platform_cache(self):
+        return self._platform_cache
+
+    @property
+    def cache_size(self):
+        """
+        Size of platform and programmer caches, could be changed by
+        preference "ardumgr.cache_size"
+        """
+
+        key = "ardumgr.cache_size"
+        if key in self._cfgs and self._cfgs[key]:
+            return int(self._cfgs[key])
+
+        return DEFAULT_SIZE
+
     @property
     def oss(self):
         """
@@ -110,18 +304,63 @@ class ArduMgr(object):
         Reference: https://github.com/arduino/Arduino/wiki/Arduino-IDE-1.5-3rd-party-Hardware-specification#global-predefined-properties
         """
 
-        return ["linux", "windows", "macosx"]
+        return list(OS_SUFFIXES)
 
     @property
     def platforms(self):
         return self._platforms
 
+    @property
+    def home_path(self):
+        return self._home_path
+
+    @property
+    def file_cache(self):
+        return self._file_cache
+
+    @property
+    def preferences_path(self):
+        return self.user_dir / "preferences.txt"
+
+    @property
+    def user_tools_dir(self):
+        return self.user_dir / "packages" / "arduino" / "tools"
+
+    @property
+    def cache_dir(self):
+        """
+        Directory for ardumgr caches, could be changed by preference
+        "ardumgr.cache_path"
+        """
+
+        key = "ardumgr.cache_path"
+        if key in self._cfgs and self._cfgs[key]:
+            return Path(self._cfgs[key])
+
+        return self.user_dir / "ardumgr-cache"
+
+    @property
+    def scanned_dirs(self):
+        """
+        Directories scanned for tools and platforms while loading
+        """
+
+        return list(self._scanned_dirs)
+
     @property
     def version(self):
         """
         Detect Arduino IDE's version, return 1.0.5 if failed.
+
+        The version is detected once, reload() detects it again.
         """
 
+        if self._version is None:
+            self._version = self._detect_version()
+
+        return self._version
+
+    def _detect_version(self):
         version = "1.0.5"  # Default
 
         while True:
@@ -155,7 +394,7 @@ class ArduMgr(object):
         could easily to compare.
         """
 
-        return self._version_to_int(self.version)
+        return version_to_int(self.version)
 
     @property
     def user_dir(self):
@@ -165,47 +404,14 @@ class ArduMgr(object):
         #
         # Reference :
         # https://build.opensuse.org/package/view_file/CrossToolchain:avr/Arduino/Arduino.changes?expand=1
-        version_text = self.version
-        if (self._version_to_int(version_text)
-                >= self._version_to_int('1.6.10')):
+        if self.int_version >= version_to_int('1.6.10'):
             user_dir = Path.home() / ".arduino15"
 
         return user_dir
 
     @staticmethod
     def _version_to_int(version):
-        """
-        Return version as int value
-
-        Samples:
-
-        0022 ->  22
-        0022ubuntu0.1 ->  22
-        0023 ->  23
-        1.0  -> 100
-        1.0.3  -> 103
-        1:1.0.5+dfsg2-2 -> 105
-        1.8.0 -> 10800
-        """
-
-        version = version.split('ubuntu')[0]
-        version = version.split(':')[-1]
-        version = version.split('+')[0]
-
-        if version.startswith('00'):  # <100
-            value = int(version[0:4])
-
-        elif '.' in version:  # >=100
-            parts = version.split('.')
-            parts += [0, 0, 0]
-            value = int(parts[0]) * 10000 + int(parts[1]) * 100 + int(parts[2])
-
-            if value < 10500:  # Version below 1.5.0
-                value = (int(parts[0]) * 100
-                         + int(parts[1]) * 10
-                         + int(parts[2]))
-
-        return value
+        return version_to_int(version)
 
     def _get_compatible_dir(self, path, platform_id):
         path = Path(path)
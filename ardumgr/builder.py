@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build sketches with recipes of the platform.
+
+Builds are incremental, a build state database (ardumgr-build.json) under
+build.path records the expanded recipe command and mtimes and hashes of
+inputs of every output. Inputs of objects are read from the dependency
+files (.d) generated by the compiler. Only translation units with changed
+inputs are recompiled, archiving, linking and objcopy are skipped if
+nothing changed.
+
+Sketch .ino files are converted into sketch/<name>.ino.cpp under build.path
+before compiling, see ardumgr.sketch.
+"""
+
+import os
+import re
+import json
+import hashlib
+import subprocess
+from pathlib import Path
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .configs import ConfigsMgr
+from .exceptions import BuildError
+from .libraries import (LibraryIndex, SOURCE_SUFFIXES, resolve_dependencies,
+                        get_library_sources)
+from .sketch import get_ino_files, preprocess
+
+CompileUnit = namedtuple("CompileUnit", ["group", "source", "object",
+                                         "command"])
+CompileUnit.__doc__ = """
+A translation unit to compile.
+
+group: "sketch", "core", "variant" or "libraries/<name>"
+command: expanded compile recipe
+"""
+
+BuildResult = namedtuple("BuildResult", ["elf", "compiled", "linked"])
+BuildResult.__doc__ = """
+compiled: count of compiled translation units
+linked: False if linking skipped because nothing changed
+"""
+
+STATE_FILE_NAME = "ardumgr-build.json"
+
+_RECIPES = {
+    ".c": "recipe.c.o.pattern",
+    ".cpp": "recipe.cpp.o.pattern",
+    ".cc": "recipe.cpp.o.pattern",
+    ".cxx": "recipe.cpp.o.pattern",
+    ".S": "recipe.S.o.pattern",
+    ".s": "recipe.S.o.pattern",
+}
+
+_OBJCOPY_REGEXP = re.compile(r"^recipe\.objcopy\.([^.]+)\.pattern$")
+
+_DEP_TOKEN_REGEXP = re.compile(r"(?:\\.|[^\s\\])+")
+
+_STATE_VERSION = 1
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as afile:
+        for chunk in iter(lambda: afile.read(65536), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def get_dep_file_path(object_path):
+    """
+    Dependency file generated by "-MMD" for an object
+    """
+
+    object_path = str(object_path)
+    if object_path.endswith(".o"):
+        object_path = object_path[:-2]
+
+    return object_path + ".d"
+
+
+def parse_dep_file(path):
+    """
+    Parse a make style dependency file
+
+    @return A list of prerequisites in order without duplicates
+    """
+
+    with open(str(path)) as dep_file:
+        content = dep_file.read()
+
+    content = content.replace("\\\r\n", " ").replace("\\\n", " ")
+
+    deps = OrderedDict()
+    for line in content.splitlines():
+        # Target may contain a drive letter, split on ": " instead of ":"
+        parts = re.split(r":(?:\s|$)", line, 1)
+        if len(parts) != 2:
+            continue
+
+        for token in _DEP_TOKEN_REGEXP.findall(parts[1]):
+            deps[re.sub(r"\\(.)", r"\1", token)] = None
+
+    return list(deps.keys())
+
+
+class BuildState(object):
+    """
+    Commands and inputs of outputs built previously
+    """
+
+    def __init__(self, path):
+        self._path = str(path)
+        self._entries = dict()
+        self._hashes = dict()
+        self._dirty = False
+
+        try:
+            with open(self._path) as state_file:
+                data = json.load(state_file)
+            if data.get("version") == _STATE_VERSION:
+                self._entries = data["entries"]
+        except (OSError, ValueError):
+            pass
+
+    def _hash(self, path, mtime):
+        key = (path, mtime)
+        digest = self._hashes.get(key)
+        if digest is None:
+            digest = self._hashes[key] = hash_file(path)
+
+        return digest
+
+    def is_up_to_date(self, output, command, check_output=True):
+        """
+        @return True if output exists, was built by the same command, and
+        contents of all its inputs are unchanged.
+        """
+
+        entry = self._entries.get(output)
+        if (entry is None) or (entry["command"] != hash_text(command)):
+            return False
+
+        if check_output and (_mtime(output) is None):
+            return False
+
+        for path, (mtime, digest) in entry["inputs"].items():
+            current = _mtime(path)
+            if current is None:
+                return False
+
+            if current == mtime:
+                continue
+
+            # Touched but maybe not changed
+            if self._hash(path, current) != digest:
+                return False
+
+            entry["inputs"][path] = [current, digest]
+            self._dirty = True
+
+        return True
+
+    def record(self, output, command, inputs):
+        recorded = OrderedDict()
+        for path in inputs:
+            mtime = _mtime(path)
+            if mtime is not None:
+                recorded[path] = [mtime, self._hash(path, mtime)]
+
+        self._entries[output] = {
+            "command": hash_text(command),
+            "inputs": recorded,
+        }
+        self._dirty = True
+
+    def forget(self, output):
+        if self._entries.pop(output, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump({"version": _STATE_VERSION, "entries": self._entries},
+                      state_file)
+        os.replace(temp_path, self._path)
+        self._dirty = False
+
+
+def run_command(command):
+    """
+    Run an expanded recipe through shell
+
+    @return A tuple (exit code, output text)
+    """
+
+    process = subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    output, _ = process.communicate()
+    return process.returncode, output.decode("utf-8", "replace")
+
+
+class LocalCompiler(object):
+    """
+    Compile units by running their commands on this machine
+    """
+
+    def compile(self, unit):
+        return run_command(unit.command)
+
+
+class Builder(object):
+    """
+    Build a sketch for the board configured in a programmer.
+    """
+
+    def __init__(self, programmer, sketch_path, build_path, jobs=None,
+                 library_index=None, compiler=None):
+        self._programmer = programmer
+        self._sketch_path = Path(os.path.abspath(str(sketch_path)))
+        self._build_path = Path(os.path.abspath(str(build_path)))
+        self._jobs = jobs or os.cpu_count() or 1
+        self._library_index = library_index
+        self._compiler = compiler if compiler is not None else LocalCompiler()
+        self._libraries = None
+        self._state = None
+
+        self._cfgs = ConfigsMgr()
+        self._cfgs.base_on(programmer.cfgs)
+        self._setup_properties()
+
+    @property
+    def cfgs(self):
+        return self._cfgs
+
+    @property
+    def build_path(self):
+        return self._build_path
+
+    @property
+    def project_name(self):
+        """
+        "<sketch>.ino" for sketches with .ino files, just like the IDE
+        """
+
+        if self.get_ino_files():
+            return self._sketch_path.name + ".ino"
+
+        return self._sketch_path.name
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._build_path.mkdir(parents=True, exist_ok=True)
+            self._state = BuildState(self._build_path / STATE_FILE_NAME)
+
+        return self._state
+
+    def _setup_properties(self):
+        cfgs = self._cfgs
+        platform = self._programmer.platform
+        platform_path = Path(cfgs["runtime.platform.path"])
+
+        cfgs["build.path"] = str(self._build_path)
+        cfgs["build.project_name"] = self.project_name
+        cfgs["build.arch"] = str(platform.id_).upper()
+        cfgs["build.source.path"] = str(self._sketch_path)
+        cfgs["build.system.path"] = str(platform_path / "system")
+        cfgs["runtime.hardware.path"] = str(platform_path.parent)
+
+        # Core may be referenced from another package by "vendor:core"
+        core = cfgs["build.core"].split(":")[-1]
+        cfgs["build.core.path"] = str(platform_path / "cores" / core)
+
+        if "build.variant" in cfgs:
+            variant = cfgs["build.variant"].split(":")[-1]
+            cfgs["build.variant.path"] = str(
+                platform_path / "variants" / variant)
+        else:
+            cfgs["build.variant.path"] = ""
+
+    @staticmethod
+    def _find_sources(base_dir, recursive=True):
+        base_dir = Path(base_dir)
+        if not base_dir.is_dir():
+            return []
+
+        paths = base_dir.glob("**/*") if recursive else base_dir.iterdir()
+        return sorted(
+            str(apath) for apath in paths
+            if apath.suffix in SOURCE_SUFFIXES and apath.is_file())
+
+    def get_ino_files(self):
+        return get_ino_files(self._sketch_path)
+
+    def get_sketch_sources(self):
+        sources = self._find_sources(self._sketch_path, recursive=False)
+        sources.extend(self._find_sources(self._sketch_path / "src"))
+        return sources
+
+    def preprocess(self):
+        """
+        Convert .ino files into a .cpp file if they changed
+
+        @return Path of the .cpp file, or None if sketch has no .ino files
+        """
+
+        if not self.get_ino_files():
+            return None
+
+        output_path = str(
+            self._build_path / "sketch" / (self.project_name + ".cpp"))
+        preprocess(self._sketch_path, output_path)
+        return output_path
+
+    def get_libraries(self):
+        """
+        Libraries required by sketch sources
+        """
+
+        if self._libraries is None:
+            index = self._library_index
+            if index is None:
+                index = LibraryIndex.for_platform(self._programmer.platform)
+
+            self._libraries, _ = resolve_dependencies(
+                index, self.get_ino_files() + self.get_sketch_sources(),
+                self._jobs)
+
+        return self._libraries
+
+    def _setup_includes(self, groups=None):
+        # Cores and variants alone are compiled without sketch and library
+        # directories (like the IDE), so they could be shared by sketches
+        with_sketch = (groups is None) or ("sketch" in groups) or (
+            "libraries" in groups)
+
+        dirs = [self._cfgs["build.core.path"]]
+        if with_sketch and self.get_ino_files():
+            # Converted .ino file lives in build.path, local headers must be
+            # found in sketch directory
+            dirs.insert(0, str(self._sketch_path))
+
+        if self._cfgs["build.variant.path"]:
+            dirs.append(self._cfgs["build.variant.path"])
+
+        if with_sketch:
+            for library in self.get_libraries():
+                dirs.append(library.src_dir)
+
+        self._cfgs["includes"] = " ".join('"-I%s"' % adir for adir in dirs)
+
+    def _make_unit(self, group, source, base_dir):
+        suffix = os.path.splitext(source)[1]
+        relative_path = os.path.relpath(source, str(base_dir))
+        object_path = str(self._build_path / group / (relative_path + ".o"))
+
+        cfgs = ConfigsMgr()
+        cfgs.base_on(self._cfgs)
+        cfgs["source_file"] = source
+        cfgs["object_file"] = object_path
+        command = cfgs.get_expanded(_RECIPES[suffix])
+
+        return CompileUnit(group, source, object_path, command)
+
+    def get_compile_units(self, groups=None):
+        """
+        @arg groups Only generate units of these groups ("sketch", "core",
+        "variant", "libraries"), None for all groups
+        @return A list of CompileUnit
+        """
+
+        self._setup_includes(groups)
+
+        sources = []
+        if (groups is None) or ("sketch" in groups):
+            converted = self.preprocess()
+            if converted is not None:
+                sources.append(
+                    ("sketch", converted, self._build_path / "sketch"))
+
+            sources.extend(
+                ("sketch", source, self._sketch_path)
+                for source in self.get_sketch_sources())
+
+        if (groups is None) or ("core" in groups):
+            core_path = self._cfgs["build.core.path"]
+            sources.extend(
+                ("core", source, core_path)
+                for source in self._find_sources(core_path))
+
+        variant_path = self._cfgs["build.variant.path"]
+        if variant_path and ((groups is None) or ("variant" in groups)):
+            sources.extend(
+                ("variant", source, variant_path)
+                for source in self._find_sources(variant_path))
+
+        if (groups is None) or ("libraries" in groups):
+            for library in self.get_libraries():
+                group = "libraries/%s" % library.name
+                sources.extend(
+                    (group, source, library.src_dir)
+                    for source in get_library_sources(library))
+
+        return [self._make_unit(*source) for source in sources]
+
+    def get_pending_units(self, units):
+        """
+        @return Units which inputs changed since last build
+        """
+
+        state = self.state
+        return [
+            unit for unit in units
+            if not state.is_up_to_date(unit.object, unit.command)]
+
+    def compile_unit(self, unit):
+        """
+        Run the compiler of a unit, could be called from any thread
+
+        @return A tuple (exit code, output text)
+        """
+
+        os.makedirs(os.path.dirname(unit.object), exist_ok=True)
+        return self._compiler.compile(unit)
+
+    def record_unit(self, unit, exit_code, output):
+        """
+        Record result of compile_unit() into build state, call it from one
+        thread only
+
+        @return Error text if compile failed, otherwise None
+        """
+
+        state = self.state
+        if exit_code != 0:
+            state.forget(unit.object)
+            return "%s\n%s" % (unit.command, output)
+
+        dep_path = get_dep_file_path(unit.object)
+        if os.path.exists(dep_path):
+            inputs = parse_dep_file(dep_path)
+        else:
+            inputs = [unit.source]
+
+        state.record(unit.object, unit.command, inputs)
+        return None
+
+    def compile(self, units):
+        """
+        Compile units which inputs changed since last build
+
+        @return A list of compiled units
+        """
+
+        pending = self.get_pending_units(units)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            results = executor.map(self.compile_unit, pending)
+            for unit, (exit_code, output) in zip(pending, results):
+                error = self.record_unit(unit, exit_code, output)
+                if error is not None:
+                    errors.append(error)
+
+        self.state.save()
+
+        if errors:
+            raise BuildError("Compile failed!\n%s" % "\n".join(errors))
+
+        return pending
+
+    def _run_step(self, output, command, inputs, check_output=True):
+        """
+        Run a command unless it's up to date
+
+        @return True if the command executed
+        """
+
+        state = self.state
+        if state.is_up_to_date(output, command, check_output):
+            return False
+
+        exit_code, text = run_command(command)
+        if exit_code != 0:
+            state.forget(output)
+            state.save()
+            raise BuildError("%s\n%s" % (command, text))
+
+        state.record(output, command, inputs)
+        state.save()
+        return True
+
+    def archive_core(self, units):
+        """
+        Archive core objects into core/core.a
+
+        @return True if the archive rebuilt
+        """
+
+        archive_file = "core/core.a"
+        archive_path = str(self._build_path / archive_file)
+        self._cfgs["archive_file"] = archive_file
+        self._cfgs["archive_file_path"] = archive_path
+
+        commands = []
+        for unit in units:
+            cfgs = ConfigsMgr()
+            cfgs.base_on(self._cfgs)
+            cfgs["object_file"] = unit.object
+            commands.append(cfgs.get_expanded("recipe.ar.pattern"))
+
+        objects = [unit.object for unit in units]
+        state = self.state
+        if state.is_up_to_date(archive_path, "\n".join(commands)):
+            return False
+
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        for command in commands:
+            exit_code, text = run_command(command)
+            if exit_code != 0:
+                state.forget(archive_path)
+                state.save()
+                raise BuildError("%s\n%s" % (command, text))
+
+        state.record(archive_path, "\n".join(commands), objects)
+        state.save()
+        return True
+
+    def use_core(self, archive_path):
+        """
+        Link with a core archive built by another builder (for ex: shared by
+        sketches of a build matrix) instead of archive_core()
+        """
+
+        archive_path = os.path.abspath(str(archive_path))
+        # Recipes refer to it as "{build.path}/{archive_file}"
+        self._cfgs["archive_file"] = os.path.relpath(
+            archive_path, str(self._build_path))
+        self._cfgs["archive_file_path"] = archive_path
+
+    def link(self, units):
+        """
+        Link non-core objects with the core archive
+
+        @return True if linked
+        """
+
+        objects = [unit.object for unit in units if unit.group != "core"]
+        self._cfgs["object_files"] = " ".join('"%s"' % obj for obj in objects)
+
+        output = str(self._build_path / (self.project_name + ".elf"))
+        command = self._cfgs.get_expanded("recipe.c.combine.pattern")
+        return self._run_step(
+            output, command, objects + [self._cfgs["archive_file_path"]])
+
+    def objcopy(self):
+        """
+        Run all recipe.objcopy.*.pattern recipes
+        """
+
+        elf = str(self._build_path / (self.project_name + ".elf"))
+        keys = [
+            akey for akey in self._cfgs.keys() if _OBJCOPY_REGEXP.match(akey)]
+        for akey in sorted(set(keys)):
+            command = self._cfgs.get_expanded(akey)
+
+            # Recipes write "{build.path}/{build.project_name}.<ext>" where
+            # <ext> is the recipe name (hex, eep, bin ...)
+            suffix = _OBJCOPY_REGEXP.match(akey).group(1)
+            output = self._cfgs.expand(
+                "{build.path}/{build.project_name}.%s" % suffix)
+            if output in command:
+                self._run_step(output, command, [elf])
+            else:
+                # Output name unknown, only inputs are checked
+                self._run_step(akey, command, [elf], check_output=False)
+
+    def build(self):
+        """
+        Compile, archive core, link and objcopy.
+
+        @return A BuildResult
+        """
+
+        units = self.get_compile_units()
+        compiled = self.compile(units)
+
+        self.archive_core([unit for unit in units if unit.group == "core"])
+        linked = self.link(units)
+        self.objcopy()
+
+        elf = str(self._build_path / (self.project_name + ".elf"))
+        return BuildResult(elf, len(compiled), linked)
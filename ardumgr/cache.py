@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+A thread safe least recently used cache with hit/miss statistics.
+"""
+
+import threading
+from collections import namedtuple, OrderedDict
+
+DEFAULT_SIZE = 32
+
+CacheStats = namedtuple("CacheStats", ["hits", "misses", "size", "maxsize"])
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        """
+        @arg maxsize Count of entries kept, 0 disables caching
+        """
+
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value):
+        with self._lock:
+            self._maxsize = value
+            self._evict()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return CacheStats(
+                self._hits, self._misses, len(self._entries), self._maxsize)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key, factory):
+        """
+        @arg factory Called without arguments to create the value on miss,
+        outside the lock, so slow factories don't block other keys
+        @return The cached value of key
+        """
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return value
+
+            self._misses += 1
+
+        value = factory()
+
+        with self._lock:
+            # Created by another thread meanwhile, keep the first one
+            existing = self._entries.get(key)
+            if existing is not None:
+                self._entries.move_to_end(key)
+                return existing
+
+            self._entries[key] = value
+            self._evict()
+
+        return value
+
+    def values(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop all entries, statistics are kept
+        """
+
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+Validate all expandable patterns of a platform.
+
+Every "*.pattern" and "recipe.*" key is resolved and expanded for every
+board menu option and programmer, with every OS in runtime.os. Boards are
+checked in parallel by a process pool.
+"""
+
+import string
+import itertools
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from .ardumgr import ArduMgr
+from .configs import Platform
+from .programmer import Programmer
+from .exceptions import ArduMgrError
+
+Issue = namedtuple(
+    "Issue", ["kind", "board", "menus", "programmer", "key", "detail"])
+Issue.__doc__ = """
+A problem found while checking a platform.
+
+kind: "missing" field not found on any OS, "os-gap" field only found on
+      some OSs, "cycle" field references itself, "invalid" board or
+      programmer could not be resolved
+menus: selected menu options, for ex: "cpu=atmega2560"
+programmer: programmer id, "*" if the issue exists with all programmers
+"""
+
+# Properties provided by the IDE while building or uploading, they are not
+# defined in any configs file.
+RUNTIME_FIELDS = (
+    "build.path",
+    "build.project_name",
+    "build.arch",
+    "build.core.path",
+    "build.system.path",
+    "build.variant.path",
+    "build.source.path",
+    "build.fqbn",
+    "includes",
+    "source_file",
+    "object_file",
+    "object_files",
+    "archive_file",
+    "archive_file_path",
+    "serial.port",
+    "serial.port.file",
+    "runtime.hardware.path",
+    "extra.time.utc",
+    "extra.time.local",
+    "extra.time.zone",
+    "extra.time.dst",
+)
+
+_IGNORED_PREFIXES = ("boards.", "programmers.", "tools.", "ardumgr.")
+
+
+def _is_pattern_key(key, oss):
+    if key.startswith(_IGNORED_PREFIXES):
+        return False
+
+    parts = key.rsplit(".", 1)
+    if (len(parts) == 2) and (parts[1] in oss):
+        # OS specific override, checked through its base key
+        return False
+
+    return key.endswith(".pattern") or key.startswith("recipe.")
+
+
+class _Resolver(object):
+    """
+    Expand fields recursively for a specific OS, collecting missing fields
+    and reference cycles instead of raising.
+    """
+
+    def __init__(self, cfgs, runtime_os):
+        self._cfgs = cfgs
+        self._os = runtime_os
+        self._formatter = string.Formatter()
+        self._resolved = dict()
+        self._stack = []
+        self.missing = set()
+        self.cycles = set()
+
+    def _lookup(self, key):
+        try:
+            return self._cfgs["%s.%s" % (key, self._os)]
+        except KeyError:
+            return self._cfgs[key]
+
+    def resolve(self, key):
+        if key in self._resolved:
+            return self._resolved[key]
+
+        if key in self._stack:
+            cycle = self._stack[self._stack.index(key):] + [key]
+            self.cycles.add(" -> ".join(cycle))
+            return ""
+
+        try:
+            text = self._lookup(key)
+        except KeyError:
+            self.missing.add(key)
+            return ""
+
+        self._stack.append(key)
+        try:
+            snippets = []
+            for literal_text, field_name, _, _ in self._formatter.parse(text):
+                if literal_text:
+                    snippets.append(literal_text)
+
+                if field_name:
+                    snippets.append(self.resolve(field_name))
+        except ValueError:
+            # Unbalanced braces, keep the raw text
+            snippets = [text]
+        finally:
+            self._stack.pop()
+
+        value = "".join(snippets)
+        self._resolved[key] = value
+        return value
+
+
+def _check_programmer(programmer, oss):
+    """
+    @return A set of (kind, key, detail) found in programmer's configs
+    """
+
+    cfgs = programmer.cfgs
+    keys = [akey for akey in cfgs.keys() if _is_pattern_key(akey, oss)]
+
+    found = set()
+    missing_oss = OrderedDict()
+    for runtime_os in oss:
+        for akey in keys:
+            resolver = _Resolver(cfgs, runtime_os)
+            resolver.resolve(akey)
+
+            for field in resolver.missing:
+                missing_oss.setdefault((akey, field), []).append(runtime_os)
+
+            for cycle in resolver.cycles:
+                found.add(("cycle", akey, cycle))
+
+    for (akey, field), missing_in in missing_oss.items():
+        if len(missing_in) == len(oss):
+            found.add(("missing", akey, field))
+        else:
+            found.add(("os-gap", akey, "%s (%s)" % (
+                field, ", ".join(missing_in))))
+
+    return found
+
+
+def _get_menu_combinations(platform, board):
+    """
+    Every cpu option combined with each option of other menus in turn, the
+    rest menus use their first option.
+    """
+
+    menus = platform.get_board_menus(board)
+    cpus = list(menus.pop("cpu", OrderedDict()).keys()) or [None]
+    defaults = OrderedDict(
+        (menu, next(iter(options.keys()))) for menu, options in menus.items())
+
+    variants = [defaults]
+    for menu, options in menus.items():
+        for option in list(options.keys())[1:]:
+            variant = OrderedDict(defaults)
+            variant[menu] = option
+            variants.append(variant)
+
+    for cpu, variant in itertools.product(cpus, variants):
+        combination = OrderedDict()
+        if cpu is not None:
+            combination["cpu"] = cpu
+        combination.update(variant)
+        yield combination
+
+
+# Platforms loaded by current worker process, keyed by platform id
+_worker_platforms = dict()
+
+
+def _get_worker_platform(preferences, platform_id):
+    platform = _worker_platforms.get(platform_id)
+    if platform is None:
+        preferences = OrderedDict(
+            (k, v) for k, v in preferences.items()
+            if not (k.startswith("ardumgr.menu.")
+                    or k in ("ardumgr.board", "ardumgr.cpu")))
+        for key in RUNTIME_FIELDS:
+            preferences.setdefault(key, "<%s>" % key)
+        preferences.setdefault("ardumgr.serial_port", "<serial.port>")
+
+        platform = Platform(ArduMgr(preferences), platform_id)
+        _worker_platforms[platform_id] = platform
+
+    return platform
+
+
+def check_board(preferences, platform_id, board):
+    """
+    Check all menu options and programmers of a single board
+
+    @return A list of Issue
+    """
+
+    platform = _get_worker_platform(preferences, platform_id)
+    oss = platform._manager.oss
+    programmers = sorted(platform.programmers)
+
+    issues = []
+    for combination in _get_menu_combinations(platform, board):
+        menus_text = ",".join(
+            "%s=%s" % (menu, option) for menu, option in combination.items())
+
+        board_preferences = OrderedDict([
+            ("ardumgr.board", board),
+            ("ardumgr.cpu", combination.get("cpu", "")),
+        ])
+        for menu, option in combination.items():
+            board_preferences["ardumgr.menu.%s" % menu] = option
+
+        found = OrderedDict()
+        for programmer_id in programmers:
+            programmer_preferences = OrderedDict(board_preferences)
+            programmer_preferences["ardumgr.programmer"] = programmer_id
+
+            try:
+                programmer = Programmer(platform, programmer_preferences)
+                results = _check_programmer(programmer, oss)
+            except (ArduMgrError, KeyError) as e:
+                results = set([("invalid", "", str(e))])
+
+            for result in sorted(results):
+                found.setdefault(result, []).append(programmer_id)
+
+        for (kind, key, detail), found_in in found.items():
+            if len(found_in) == len(programmers):
+                found_in = ["*"]
+
+            for programmer_id in found_in:
+                issues.append(Issue(
+                    kind, board, menus_text, programmer_id, key, detail))
+
+    return issues
+
+
+def check_platform(manager, platform_id, jobs=None):
+    """
+    Check all boards of a platform
+
+    @arg jobs Count of worker processes, None for CPU count, 1 to check in
+    current process
+    @return A list of Issue sorted by board
+    """
+
+    preferences = manager._preferences
+    boards = sorted(Platform(manager, platform_id).boards)
+
+    issues = []
+    if jobs == 1:
+        for board in boards:
+            issues.extend(check_board(preferences, platform_id, board))
+        _worker_platforms.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                check_board,
+                itertools.repeat(preferences),
+                itertools.repeat(platform_id),
+                boards)
+            for board_issues in results:
+                issues.extend(board_issues)
+
+    return issues
@@ -1,9 +1,17 @@
+import io
 import re
 import string
+import hashlib
+import threading
 from contextlib import contextmanager
 from pathlib import Path
 from rabird.core.configparser import ConfigParser
-from collections import KeysView, ItemsView, ValuesView, OrderedDict
+from collections import (
+    KeysView, ItemsView, ValuesView, OrderedDict, namedtuple)
+from .cache import LRUCache
+from .exceptions import ArduMgrError
+from .export import expand_flat
+from . import profiling
 
 
 class ConfigsMgrKeys(KeysView):
@@ -18,16 +26,199 @@ class ConfigsMgrValues(ValuesView):
     pass
 
 
+def parse_items(fp):
+    """
+    Parse a config file
+
+    @return A list of (option, value) without empty and comment options
+    """
+
+    cfgparser = ConfigParser()
+    cfgparser.readfp(fp)
+
+    items = []
+    for option, value in cfgparser.items(cfgparser.UNNAMED_SECTION):
+        # Filter all empty/comment options away
+        if (option.startswith(cfgparser._EMPTY_OPTION)
+                or option.startswith(cfgparser._COMMENT_OPTION)):
+            continue
+
+        items.append((option, value))
+
+    return items
+
+
+class ParsedFileCache(object):
+    """
+    Parsed options of config files keyed by content hash, shared by
+    managers of different installations, so identical files (for ex: the
+    same AVR core in two IDE versions) are only parsed once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_items(self, path):
+        with Path(path).open("rb") as afile:
+            content = afile.read()
+
+        digest = hashlib.sha1(content).hexdigest()
+        with self._lock:
+            items = self._items.get(digest)
+            if items is not None:
+                self.hits += 1
+                return items
+
+        items = parse_items(io.StringIO(content.decode("utf-8")))
+        with self._lock:
+            self.misses += 1
+            self._items[digest] = items
+
+        return items
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# Suffixes of OS specific keys, for ex: "tools.avrdude.cmd.path.windows"
+OS_SUFFIXES = ("linux", "windows", "macosx")
+
+_MISSING = object()
+
+
+def _get_key_head(key):
+    """
+    @return First two parts of a key, for ex: "boards.uno"
+    """
+
+    first = key.find(".")
+    second = key.find(".", first + 1) if first >= 0 else -1
+    return key if second < 0 else key[:second]
+
+
+# Keys left out when comparing configs of boards, their subtrees are
+# already resolved into plain keys of each board
+DIFF_EXCLUDED_PREFIXES = (
+    "ardumgr.", "boards.", "menu.", "programmers.", "tools.")
+
+# Keys of install roots, differ between installations at different places
+_INSTALL_ROOT_REGEXP = re.compile(
+    r"^runtime\.(?:ide|platform|tools\..+)\.path$")
+
+ConfigChange = namedtuple("ConfigChange", ["key", "old", "new"])
+ConfigChange.__doc__ = """
+A difference between two configs.
+
+old: None if the key added
+new: None if the key removed
+"""
+
+
+def diff_items(old_items, new_items):
+    """
+    Merge-walk two sequences of (key, value) both sorted by key
+
+    @return A list of ConfigChange in key order
+    """
+
+    changes = []
+    old_iter = iter(old_items)
+    new_iter = iter(new_items)
+    old = next(old_iter, None)
+    new = next(new_iter, None)
+    while (old is not None) or (new is not None):
+        if (new is None) or ((old is not None) and (old[0] < new[0])):
+            changes.append(ConfigChange(old[0], old[1], None))
+            old = next(old_iter, None)
+        elif (old is None) or (new[0] < old[0]):
+            changes.append(ConfigChange(new[0], None, new[1]))
+            new = next(new_iter, None)
+        else:
+            if old[1] != new[1]:
+                changes.append(ConfigChange(old[0], old[1], new[1]))
+
+            old = next(old_iter, None)
+            new = next(new_iter, None)
+
+    return changes
+
+
+def replace_install_roots(items):
+    """
+    Replace install roots (runtime.ide.path, runtime.platform.path and
+    runtime.tools.*.path) in values with their keys as fields, for ex:
+    "/opt/arduino/hardware" to "{runtime.ide.path}/hardware"
+
+    @arg items A list of (key, value)
+    @return A list of (key, value) in the same order
+    """
+
+    placeholders = dict()
+    for akey, value in items:
+        if value and _INSTALL_ROOT_REGEXP.match(akey):
+            placeholders.setdefault(value, "{%s}" % akey)
+
+    if not placeholders:
+        return items
+
+    # Longer roots first, a platform is usually under the IDE
+    roots = sorted(placeholders, key=len, reverse=True)
+    regexp = re.compile(r"(?:%s)(?=$|[/\\\s\"'])" % "|".join(
+        re.escape(root) for root in roots))
+    return [(akey, regexp.sub(lambda m: placeholders[m.group(0)], value))
+            for akey, value in items]
+
+
 class ConfigsMgr(OrderedDict):
+    """
+    Configs with a chain of base configs.
+
+    Each layer keeps OS specific keys folded onto their base keys (per OS),
+    so get_overrided() resolves a key without raising and catching
+    KeyError through the chain.
+    """
 
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        # Used by __setitem__() while initializing items
         self._base = None
+        self._sources = []
+        # os -> {base key -> value}
+        self._os_overrides = dict()
+        # First two parts of keys -> keys, see _get_head_index()
+        self._head_index = None
+        super().__init__(*args, **kwargs)
 
     def base_on(self, other_mgr):
         self._base = other_mgr
 
-    def load(self, fp, base_key=None):
+    @property
+    def sources(self):
+        """
+        Config files requested through load(), in loading order
+        """
+
+        return list(self._sources)
+
+    def clear(self):
+        super().clear()
+        self._sources = []
+        self._os_overrides = dict()
+        self._head_index = None
+
+    @profiling.timed("configs.load")
+    def load(self, fp, base_key=None, cache=None):
+        """
+        Load options of a config file
+
+        @arg fp Path or file object
+        @arg cache A ParsedFileCache, files with the same content are only
+        parsed once
+        """
+
         @contextmanager
         def fp_close(fp_tuple):
             try:
@@ -39,31 +230,44 @@ class ConfigsMgr(OrderedDict):
         is_open_by_us = False
         if isinstance(fp, str) or isinstance(fp, Path):
             fp = Path(fp)
+            self._sources.append(fp)
             if not fp.exists():
                 return OrderedDict()
 
-            fp = fp.open()
-            is_open_by_us = True
+            profiler = profiling.active
+            if profiler is not None:
+                profiler.count("configs.load.bytes", fp.stat().st_size)
+
+            if cache is None:
+                fp = fp.open()
+                is_open_by_us = True
 
         if base_key is None:
             base_key = ""
         else:
             base_key = base_key + "."
 
-        with fp_close((fp, is_open_by_us)) as fp:
-            cfgparser = ConfigParser()
-            cfgparser.readfp(fp)
+        if isinstance(fp, Path):
+            items = cache.get_items(fp)
+        else:
+            with fp_close((fp, is_open_by_us)) as fp:
+                items = parse_items(fp)
 
-            items = cfgparser.items(cfgparser.UNNAMED_SECTION)
-            for option, value in items:
-                # Filter all empty/comment options away
-                if (option.startswith(cfgparser._EMPTY_OPTION)
-                        or option.startswith(cfgparser._COMMENT_OPTION)):
-                    continue
+        for option, value in items:
+            self["%s%s" % (base_key, option)] = value
 
-                self["%s%s" % (base_key, option)] = value
+        profiler = profiling.active
+        if profiler is not None:
+            profiler.count("configs.load.files")
+            profiler.count("configs.load.keys", len(items))
 
     def expand(self, text):
+        profiler = profiling.active
+        if profiler is not None:
+            started = profiler.clock()
+            passes = 0
+            fields = 0
+
         while True:
             formatter = string.Formatter()
             has_field = False
@@ -76,39 +280,283 @@ class ConfigsMgr(OrderedDict):
                     snippets.append(self.get_overrided(field_name))
                     has_field = True
 
+                    if profiler is not None:
+                        fields += 1
+
+            if profiler is not None:
+                passes += 1
+
             if not has_field:
-                return text
+                break
 
             text = "".join(snippets)
 
+        if profiler is not None:
+            profiler.count("configs.expand.passes", passes)
+            profiler.count("configs.expand.fields", fields)
+            profiler.record("configs.expand", started)
+
+        return text
+
+    def _lookup(self, name):
+        """
+        @return Value of name in this layer or its bases, _MISSING if not
+        found
+        """
+
+        mgr = self
+        while mgr is not None:
+            value = dict.get(mgr, name, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            mgr = mgr._base
+
+        return _MISSING
+
     def get_overrided(self, key):
-        runtime_os = self["runtime.os"]
-        runtime_os_specific_key = "%s.%s" % (key, runtime_os)
+        """
+        Value of "<key>.<runtime.os>" if it's defined in any layer,
+        otherwise value of key
+        """
+
+        return self._get_overrided_for(key, self["runtime.os"])
+
+    def _get_overrided_for(self, key, runtime_os):
+        mgr = self
+        while mgr is not None:
+            overrides = mgr._os_overrides.get(runtime_os)
+            if overrides is not None:
+                value = overrides.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+
+            mgr = mgr._base
+
+        return self[key]
+
+    def _has_os_override(self, key, oss):
+        mgr = self
+        while mgr is not None:
+            for runtime_os in oss:
+                if key in mgr._os_overrides.get(runtime_os, ()):
+                    return True
+
+            mgr = mgr._base
+
+        return False
+
+    @profiling.timed("configs.expand_for_os")
+    def expand_for_os(self, keys, oss=OS_SUFFIXES):
+        """
+        Expand keys for several OSes at once. Only fields with OS overrides,
+        directly or through the fields they refer to, are expanded per OS,
+        other fields are expanded once and shared.
+
+        @arg oss OS names, "runtime.os" is resolved to each of them
+        @return An OrderedDict of OS -> OrderedDict of key -> expanded value
+        """
+
+        oss = list(oss)
+        formatter = string.Formatter()
+        # field -> expanded text, or an OrderedDict of OS -> expanded text
+        resolved = {"runtime.os": OrderedDict((anos, anos) for anos in oss)}
+        resolving = set()
+
+        def expand_text(text, runtime_os=None):
+            snippets = []
+            os_specific = False
+            for literal_text, field_name, _, _ in formatter.parse(text):
+                if literal_text:
+                    snippets.append(literal_text)
+
+                if field_name:
+                    value = resolve(field_name)
+                    if isinstance(value, dict):
+                        if runtime_os is None:
+                            os_specific = True
+                        else:
+                            value = value[runtime_os]
+
+                    snippets.append(value)
+
+            if not os_specific:
+                return "".join(snippets)
+
+            return OrderedDict(
+                (anos, "".join(
+                    snippet if isinstance(snippet, str) else snippet[anos]
+                    for snippet in snippets))
+                for anos in oss)
+
+        def resolve(name):
+            value = resolved.get(name)
+            if value is not None:
+                return value
+
+            if name in resolving:
+                raise ArduMgrError("Preference '%s' refers to itself!" % name)
+
+            resolving.add(name)
+            if self._has_os_override(name, oss):
+                value = OrderedDict(
+                    (anos, expand_text(self._get_overrided_for(name, anos),
+                                       anos))
+                    for anos in oss)
+            else:
+                value = expand_text(self[name])
+
+            resolving.discard(name)
+            resolved[name] = value
+            return value
+
+        values = [(key, resolve(key)) for key in keys]
+        return OrderedDict(
+            (anos, OrderedDict(
+                (key, value[anos] if isinstance(value, dict) else value)
+                for key, value in values))
+            for anos in oss)
+
+    def flatten(self):
+        """
+        Merge all layers of the base chain into a plain OrderedDict, keys of
+        upper layers override keys of their bases.
+        """
 
-        try:
-            return self[runtime_os_specific_key]
-        except:
-            return self[key]
+        layers = []
+        mgr = self
+        while mgr is not None:
+            layers.append(mgr)
+            mgr = mgr._base
+
+        flat = OrderedDict()
+        for layer in reversed(layers):
+            flat.update(OrderedDict.items(layer))
+
+        return flat
 
     def get_expanded(self, key):
         return self.expand(self.get_overrided(key))
 
+    def get_sorted_items(self, expand=False, exclude=()):
+        """
+        Flattened configs sorted by key
+
+        @arg expand Expand values for current OS and drop OS specific keys,
+        unknown fields are kept, see export.expand_flat()
+        @arg exclude Prefixes of keys left out, for ex: "boards."
+        @return A list of (key, value)
+        """
+
+        exclude = tuple(exclude)
+        layers = []
+        keys = set()
+        mgr = self
+        while mgr is not None:
+            layers.append(mgr)
+            for head, head_keys in mgr._get_head_index().items():
+                if not exclude:
+                    keys.update(head_keys)
+                elif not (head + ".").startswith(exclude):
+                    # Whole groups like "boards.uno" skipped at once
+                    keys.update(akey for akey in head_keys
+                                if not akey.startswith(exclude))
+
+            mgr = mgr._base
+
+        # Order doesn't matter here, plain dicts merge much faster
+        flat = dict()
+        for layer in reversed(layers):
+            flat.update(dict.items(layer))
+
+        keys = sorted(keys)
+        if expand:
+            return list(expand_flat(flat, OS_SUFFIXES, keys).items())
+
+        return [(akey, flat[akey]) for akey in keys]
+
+    @profiling.timed("configs.diff")
+    def diff(self, other, expand=False, exclude=(), roots=False):
+        """
+        Compare these (old) configs with other (new) configs, both walked
+        once in key order
+
+        @arg expand, exclude See get_sorted_items()
+        @arg roots Replace install roots of each side before comparing,
+        see replace_install_roots()
+        @return A list of ConfigChange sorted by key
+        """
+
+        old_items = self.get_sorted_items(expand, exclude)
+        new_items = other.get_sorted_items(expand, exclude)
+        if roots:
+            old_items = replace_install_roots(old_items)
+            new_items = replace_install_roots(new_items)
+
+        return diff_items(old_items, new_items)
+
+    def _get_head_index(self):
+        """
+        @return A dict of first two parts of keys to keys of this layer
+        """
+
+        index = self._head_index
+        if index is None:
+            index = dict()
+            for akey in OrderedDict.keys(self):
+                index.setdefault(_get_key_head(akey), []).append(akey)
+
+            self._head_index = index
+
+        return index
+
+    def _iter_head_items(self, head):
+        """
+        Items of all layers whose keys start with head (first two parts of
+        keys, for ex: "boards.uno"), upper layers first
+        """
+
+        seen = set()
+        mgr = self
+        while mgr is not None:
+            for akey in mgr._get_head_index().get(head, ()):
+                if akey not in seen:
+                    seen.add(akey)
+                    yield akey, dict.__getitem__(mgr, akey)
+
+            mgr = mgr._base
+
     def get_subtree(self, key_prefix):
+        profiler = profiling.active
+        if profiler is not None:
+            started = profiler.clock()
+
         subtree = OrderedDict()
-        key_prefix = key_prefix.replace(".", r"\.")
-        pattern = r"%s\.(.*)" % key_prefix
-        regexp = re.compile(pattern)
+        prefix = key_prefix + "."
+        if "." in key_prefix:
+            # Only keys under the same two parts are scanned, for ex:
+            # "boards.uno" of "boards.uno.menu.cpu.atmega328"
+            items = self._iter_head_items(_get_key_head(key_prefix))
+        else:
+            items = self.items()
 
-        for akey, value in self.items():
-            matched = regexp.match(akey)
-            if matched is None:
+        if profiler is not None:
+            # Counted up front, the loop stays free of profiling
+            items = list(items)
+            profiler.count("configs.get_subtree.keys_scanned", len(items))
+
+        for akey, value in items:
+            if not akey.startswith(prefix):
                 continue
 
-            if ((matched.group(1) == "name")
-                    or (matched.group(1).startswith("menu."))):
+            child = akey[len(prefix):]
+            if (child == "name") or child.startswith("menu."):
                 continue
 
-            subtree[matched.group(1)] = value
+            subtree[child] = value
+
+        if profiler is not None:
+            profiler.record("configs.get_subtree", started)
 
         return subtree
 
@@ -126,14 +574,24 @@ class ConfigsMgr(OrderedDict):
         return subtree
 
     def get_children(self, key_prefix):
+        profiler = profiling.active
+        if profiler is not None:
+            started = profiler.clock()
+
         names = []
         key_prefix = key_prefix.replace(".", r"\.")
         pattern = r"%s\.(\w+)" % key_prefix
         regexp = re.compile(pattern)
 
-        for akey in self.keys():
-            if akey == "boards.menu.cpu":
-                # Removed unused child item from boards.txt
+        keys = self.keys()
+        if profiler is not None:
+            keys = list(keys)
+            profiler.count("configs.get_children.keys_scanned", len(keys))
+
+        for akey in keys:
+            if akey.startswith("boards.menu."):
+                # Removed menu declarations (menu.<id>=<label>) of
+                # boards.txt, they are not boards
                 continue
 
             matched = regexp.match(akey)
@@ -142,6 +600,9 @@ class ConfigsMgr(OrderedDict):
 
             names.append(matched.group(1))
 
+        if profiler is not None:
+            profiler.record("configs.get_children", started)
+
         return list(set(names))
 
     def keys(self):
@@ -154,13 +615,11 @@ class ConfigsMgr(OrderedDict):
         return ConfigsMgrValues(self)
 
     def __getitem__(self, name):
-        if self._base:
-            try:
-                return super().__getitem__(name)
-            except:
-                return self._base[name]
-        else:
-            return super().__getitem__(name)
+        value = self._lookup(name)
+        if value is _MISSING:
+            raise KeyError(name)
+
+        return value
 
     def __setitem__(self, key, value):
         # We only support str type value!
@@ -192,18 +651,25 @@ class ConfigsMgr(OrderedDict):
                 super().__setitem__("serial.port", value)
 
         super().__setitem__(key, value)
+        self._head_index = None
 
-    def __contains__(self, item):
-        if self._base:
-            if not super().__contains__(item):
-                return item in self._base
+        base_key, _, suffix = key.rpartition(".")
+        if base_key and (suffix in OS_SUFFIXES):
+            self._os_overrides.setdefault(suffix, dict())[base_key] = value
 
-            return False
-        else:
-            return super().__contains__(item)
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._head_index = None
+
+        base_key, _, suffix = key.rpartition(".")
+        if base_key and (suffix in OS_SUFFIXES):
+            self._os_overrides.get(suffix, dict()).pop(base_key, None)
+
+    def __contains__(self, item):
+        return self._lookup(item) is not _MISSING
 
     def __iter__(self):
-        if self._base:
+        if self._base is not None:
             def mixin_iter(self_keys, self_iter, base_iter):
                 current_it = self_iter
                 for akey in current_it:
@@ -228,11 +694,19 @@ class Platform(object):
     platform.
     """
 
+    @profiling.timed("platform.init")
     def __init__(self, manager, id_):
         self._manager = manager
-        self._id = id
+        self._id = id_
+        self._menu_index = None
         self._cfgs = ConfigsMgr()
         self._cfgs.base_on(manager._cfgs)
+        self._programmer_cache = LRUCache(manager.cache_size)
+        self._load()
+
+    def _load(self):
+        manager = self._manager
+        id_ = self._id
 
         self._cfgs["runtime.platform.path"] = str(
             manager._get_platform_dir(id_))
@@ -245,10 +719,92 @@ class Platform(object):
 
         for file_name, key in cfg_file_base_keys:
             apath = (manager._get_platform_dir(id_) / file_name)
-            self._cfgs.load(apath, key)
+            self._cfgs.load(apath, key, manager.file_cache)
 
         self._cfgs["target_platform"] = str(id_)
 
+    def reload(self):
+        """
+        Reload platform.txt, boards.txt and programmers.txt from disk
+        """
+
+        self._cfgs.clear()
+        self._menu_index = None
+        self._programmer_cache.clear()
+        self._load()
+
+    def get_programmer(self, board=None, cpu=None, programmer=None,
+                       port=None, menus=None):
+        """
+        Cached factory of programmers, arguments left None use preferences
+        of the manager (for ex: "ardumgr.board").
+
+        Programmers are shared between callers, don't change their configs.
+        Reloading the platform or its manager drops cached programmers.
+
+        @arg menus A dict of menu id to option id
+        """
+
+        from .programmer import Programmer
+
+        preferences = OrderedDict()
+        for key, value in (("ardumgr.board", board), ("ardumgr.cpu", cpu),
+                           ("ardumgr.programmer", programmer),
+                           ("ardumgr.serial_port", port)):
+            if value is not None:
+                preferences[key] = value
+
+        menus = sorted((menus or dict()).items())
+        for menu, option in menus:
+            preferences["ardumgr.menu.%s" % menu] = option
+
+        key = (board, cpu, programmer, port, tuple(menus))
+        return self._programmer_cache.get(
+            key, lambda: Programmer(self, preferences))
+
+    def _get_default_programmer(self, board):
+        """
+        Programmer of a board with its first cpu, for comparing boards
+        """
+
+        cpus = self.get_board_supported_cpus(board)
+        # Not compared, but required by Programmer
+        programmer = None if "ardumgr.programmer" in self._cfgs else ""
+        port = None if "ardumgr.serial_port" in self._cfgs else ""
+        return self.get_programmer(
+            board, cpus[0] if cpus else "", programmer, port)
+
+    def diff(self, other, expand=False):
+        """
+        Compare resolved configs of boards exist in both platforms (for ex:
+        two versions of a core), boards use their first cpu and default menu
+        options. Compare boards properties for added or removed boards.
+        Install roots are replaced, so installations at different places
+        only differ in their contents.
+
+        @arg expand See ConfigsMgr.get_sorted_items()
+        @return An OrderedDict of board id to a list of ConfigChange sorted
+        by board id, boards without changes are left out
+        """
+
+        other_boards = set(other.boards)
+        diffs = OrderedDict()
+        for board in sorted(self.boards):
+            if board not in other_boards:
+                continue
+
+            changes = self._get_default_programmer(board).cfgs.diff(
+                other._get_default_programmer(board).cfgs, expand,
+                DIFF_EXCLUDED_PREFIXES, True)
+            if changes:
+                diffs[board] = changes
+
+        return diffs
+
+    @property
+    def programmer_cache(self):
+        return self._programmer_cache
+
     @property
     def id_(self):
         return self._id
@@ -257,6 +813,10 @@ class Platform(object):
     def cfgs(self):
         return self._cfgs
 
+    @property
+    def sources(self):
+        return self._cfgs.sources
+
     @property
     def boards(self):
         return self._cfgs.get_children("boards")
@@ -269,10 +829,69 @@ class Platform(object):
     def tools(self):
         return self._cfgs.get_children("tools")
 
+    def _get_menu_index(self):
+        """
+        Index menu declarations and board menu options with a single scan
+        of boards configs.
+
+        @return A tuple (menus, boards), menus maps menu id to its label in
+        declaration order, boards maps board id to menu id to option id to
+        option label.
+        """
+
+        if self._menu_index is not None:
+            return self._menu_index
+
+        menus = OrderedDict()
+        boards = OrderedDict()
+        for akey, value in self._cfgs.items():
+            if not akey.startswith("boards."):
+                continue
+
+            parts = akey.split(".")
+            if parts[1] == "menu":
+                if len(parts) == 3:
+                    menus[parts[2]] = value
+            elif (len(parts) == 5) and (parts[2] == "menu"):
+                board_menus = boards.setdefault(parts[1], OrderedDict())
+                options = board_menus.setdefault(parts[3], OrderedDict())
+                options[parts[4]] = value
+
+        # Sort board menus by declaration order, undeclared menus last
+        order = dict((menu, i) for i, menu in enumerate(menus.keys()))
+        for board, board_menus in boards.items():
+            boards[board] = OrderedDict(sorted(
+                board_menus.items(),
+                key=lambda item: order.get(item[0], len(order))))
+
+        self._menu_index = (menus, boards)
+        return self._menu_index
+
+    @property
+    def menus(self):
+        """
+        @return A dict of menu id to menu label in declaration order
+        """
+
+        return OrderedDict(self._get_menu_index()[0])
+
+    def get_board_menus(self, board):
+        """
+        @return A dict of menu id to a dict of option id to option label,
+        menus are in declaration order. Boards without any menu return an
+        empty dict.
+        """
+
+        board_menus = self._get_menu_index()[1].get(board, OrderedDict())
+        return OrderedDict(
+            (menu, OrderedDict(options))
+            for menu, options in board_menus.items())
+
     def get_board_supported_cpus(self, board):
         """
         @return A list of supported cpu id will be return. If empty list
         returned, it means there have a default cpu and without any other
         options.
         """
-        return self._cfgs.get_children("boards.%s.menu.cpu" % board)
+        options = self.get_board_menus(board).get("cpu", OrderedDict())
+        return list(options.keys())
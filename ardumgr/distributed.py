@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+
+"""
+Distributed compiling over a simple socket protocol.
+
+Sources are preprocessed locally, then compiled by workers which return the
+object files. Each message is a 4 bytes big-endian header length, a JSON
+header and a payload of header["size"] bytes:
+
+    handshake:       {"type": "hello", "token": secret}
+                     answered by {"type": "ready"}
+    compile request: {"type": "compile", "command": [...],
+                      "toolchain": identity, "source_name": name}
+                     + preprocessed source
+    compile result:  {"type": "result", "exit_code": 0, "output": text}
+                     + object file
+    error:           {"type": "error", "message": text}
+
+Every connection starts with the handshake, workers started with a token
+refuse connections without it. Workers close connections sending
+oversized or malformed messages, or idle for too long.
+
+In "command", "@SOURCE@" and "@OBJECT@" are replaced by paths on worker, the
+first item is replaced by the worker's compiler which has the same
+toolchain identity. Workers only accept code generation options (see
+check_compile_args()), so clients can't make them run other programs or
+write other files.
+"""
+
+import os
+import re
+import hmac
+import json
+import queue
+import shlex
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+import subprocess
+import socketserver
+from .builder import run_command, get_dep_file_path
+from .exceptions import ArduMgrError
+
+SOURCE_PLACEHOLDER = "@SOURCE@"
+OBJECT_PLACEHOLDER = "@OBJECT@"
+
+_HEADER_SIZE = struct.Struct(">I")
+
+# Limits of received messages, larger ones are refused before buffering
+_MAX_HEADER_SIZE = 64 << 10
+_MAX_PAYLOAD_SIZE = 64 << 20
+
+# Seconds a worker waits for the next message of a client
+_IDLE_TIMEOUT = 300
+
+# Suffix of preprocessed sources by original suffix
+_PREPROCESSED_SUFFIXES = {
+    ".c": ".i",
+    ".S": ".s",
+    ".s": ".s",
+}
+
+# Options accepted by workers, besides "-c", "-o @OBJECT@" and "@SOURCE@"
+_ALLOWED_ARG_REGEXP = re.compile(
+    r"^-(O\w*|m[\w=.,+-]+|f[\w=.,+-]+|g\w*|std=[\w+]+|W[\w=+-]*|w|D.+)$")
+
+# Options of the allowed ones which load code or read and write files
+_DENIED_ARG_REGEXP = re.compile(
+    r"^-(fplugin|fprofile|fauto-profile|fdump|W[apl],)")
+
+# Languages of "-x"
+_ALLOWED_LANGUAGES = (
+    "c", "c++", "cpp-output", "c++-cpp-output", "assembler",
+    "assembler-with-cpp")
+
+_LOOPBACK_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+_identities = dict()
+_identities_lock = threading.Lock()
+
+
+class WorkerError(ArduMgrError):
+    """
+    A worker refused a request
+    """
+
+
+class ToolchainMismatch(WorkerError):
+    pass
+
+
+def get_toolchain_identity(compiler):
+    """
+    Identity of a compiler: its name, version and target machine
+    """
+
+    with _identities_lock:
+        identity = _identities.get(compiler)
+        if identity is not None:
+            return identity
+
+    digest = hashlib.sha1(os.path.basename(compiler).encode("utf-8"))
+    for option in ("--version", "-dumpmachine"):
+        try:
+            output = subprocess.check_output(
+                [compiler, option], stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            output = b""
+        digest.update(output)
+
+    identity = digest.hexdigest()
+    with _identities_lock:
+        _identities[compiler] = identity
+
+    return identity
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def send_message(sock, header, payload=b""):
+    header = dict(header)
+    header["size"] = len(payload)
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_HEADER_SIZE.pack(len(data)) + data + payload)
+
+
+def recv_message(sock, max_size=_MAX_PAYLOAD_SIZE):
+    """
+    @arg max_size Largest payload accepted
+    @return A tuple (header, payload)
+    @raise ValueError If the message is malformed or too large
+    """
+
+    size, = _HEADER_SIZE.unpack(_recv_exactly(sock, _HEADER_SIZE.size))
+    if size > _MAX_HEADER_SIZE:
+        raise ValueError("Message header too large")
+
+    header = json.loads(_recv_exactly(sock, size).decode("utf-8"))
+    if not isinstance(header, dict):
+        raise ValueError("Wrong message header")
+
+    size = header.get("size", 0)
+    if (not isinstance(size, int)) or isinstance(size, bool) or (
+            not 0 <= size <= max_size):
+        raise ValueError("Wrong message size")
+
+    payload = _recv_exactly(sock, size)
+    return header, payload
+
+
+def split_compile_command(unit):
+    """
+    Split a compile unit into a local preprocess command and a remote
+    compile command template.
+
+    @return A tuple (preprocess arguments, compile arguments, suffix of
+    preprocessed source)
+    """
+
+    tokens = shlex.split(unit.command)
+    if ("-c" not in tokens) or (unit.source not in tokens):
+        raise ArduMgrError("Unsupported compile command: %s" % unit.command)
+
+    preprocess = []
+    compile_ = []
+    skip = False
+    for i, token in enumerate(tokens):
+        if skip:
+            skip = False
+            continue
+
+        if token == "-o":
+            skip = True
+            compile_.extend(["-o", OBJECT_PLACEHOLDER])
+        elif token == "-c":
+            preprocess.append("-E")
+            compile_.append(token)
+        elif token == unit.source:
+            preprocess.append(token)
+            compile_.append(SOURCE_PLACEHOLDER)
+        elif token in ("-MMD", "-MD"):
+            # Dependencies are generated while preprocessing
+            preprocess.extend([
+                token, "-MF", get_dep_file_path(unit.object),
+                "-MT", unit.object])
+        elif token.startswith(("-I", "-D", "-U")):
+            # Only needed while preprocessing
+            preprocess.append(token)
+        else:
+            preprocess.append(token)
+            compile_.append(token)
+
+    suffix = _PREPROCESSED_SUFFIXES.get(
+        os.path.splitext(unit.source)[1], ".ii")
+    return preprocess, compile_, suffix
+
+
+def check_compile_args(args):
+    """
+    Check arguments of a compile command template (compiler excluded)
+
+    @return A list of checked arguments
+    @raise WorkerError If an argument is not allowed
+    """
+
+    if not isinstance(args, list):
+        raise WorkerError("Wrong command")
+
+    checked = []
+    outputs = 0
+    sources = 0
+    args = iter(args)
+    for arg in args:
+        if not isinstance(arg, str):
+            raise WorkerError("Wrong command")
+
+        if arg == "-o":
+            if next(args, None) != OBJECT_PLACEHOLDER:
+                raise WorkerError("Output must be %s" % OBJECT_PLACEHOLDER)
+            outputs += 1
+            checked.extend(["-o", OBJECT_PLACEHOLDER])
+        elif arg == "-x":
+            language = next(args, None)
+            if language not in _ALLOWED_LANGUAGES:
+                raise WorkerError("Language not allowed: %s" % language)
+            checked.extend([arg, language])
+        elif arg == SOURCE_PLACEHOLDER:
+            sources += 1
+            checked.append(arg)
+        elif (arg == "-c") or (_ALLOWED_ARG_REGEXP.match(arg) and
+                               not _DENIED_ARG_REGEXP.match(arg)):
+            checked.append(arg)
+        else:
+            raise WorkerError("Option not allowed: %s" % arg)
+
+    if (outputs != 1) or (sources != 1) or ("-c" not in checked):
+        raise WorkerError(
+            "Command must compile %s into %s" % (
+                SOURCE_PLACEHOLDER, OBJECT_PLACEHOLDER))
+
+    return checked
+
+
+def _error(message):
+    return {"type": "error", "message": message}, b""
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        # Idle or stalled clients don't hold a thread forever
+        self.request.settimeout(self.server.idle_timeout)
+        try:
+            header, _ = recv_message(self.request, 0)
+        except (ConnectionError, OSError, ValueError):
+            return
+
+        if (header.get("type") != "hello") or not self.server.check_token(
+                header.get("token")):
+            send_message(self.request, *_error("Handshake failed"))
+            return
+
+        send_message(self.request, {"type": "ready"})
+
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            if header.get("type") != "compile":
+                send_message(self.request, *_error(
+                    "Unknown request: %s" % header.get("type")))
+                continue
+
+            with self.server.semaphore:
+                response, result = self.server.compile(header, payload)
+            send_message(self.request, response, result)
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Accept compile jobs and return object files.
+
+    @arg toolchains Paths of compilers this worker provides
+    @arg token Secret clients must present, None to accept any client
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    idle_timeout = _IDLE_TIMEOUT
+
+    def __init__(self, address, toolchains, jobs=None, token=None):
+        socketserver.TCPServer.__init__(self, address, WorkerHandler)
+        self.semaphore = threading.BoundedSemaphore(jobs or os.cpu_count())
+        self.token = token
+        self.toolchains = dict(
+            (get_toolchain_identity(compiler), compiler)
+            for compiler in toolchains)
+
+    def check_token(self, token):
+        if self.token is None:
+            return True
+
+        return isinstance(token, str) and hmac.compare_digest(
+            token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def compile(self, header, source):
+        try:
+            toolchain = header["toolchain"]
+            command = header["command"]
+            source_name = header["source_name"]
+        except KeyError as e:
+            return _error("Missing field: %s" % e.args[0])
+
+        compiler = self.toolchains.get(toolchain)
+        if compiler is None:
+            return _error("Toolchain not found")
+
+        # Only the suffix of the name is used, it selects the language
+        suffix = os.path.splitext(str(source_name))[1]
+        if suffix not in (".i", ".ii", ".s"):
+            return _error("Unsupported source: %s" % source_name)
+
+        if not (isinstance(command, list) and command):
+            return _error("Wrong command")
+
+        try:
+            args = check_compile_args(command[1:])
+        except WorkerError as e:
+            return _error(str(e))
+
+        with tempfile.TemporaryDirectory(prefix="ardumgr-worker-") as adir:
+            source_path = os.path.join(adir, "source" + suffix)
+            object_path = os.path.join(adir, "object.o")
+            with open(source_path, "wb") as source_file:
+                source_file.write(source)
+
+            command = [compiler] + [
+                source_path if arg == SOURCE_PLACEHOLDER else
+                object_path if arg == OBJECT_PLACEHOLDER else arg
+                for arg in args]
+            try:
+                process = subprocess.Popen(
+                    command, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, cwd=adir)
+                output, _ = process.communicate()
+
+                result = b""
+                if process.returncode == 0:
+                    with open(object_path, "rb") as object_file:
+                        result = object_file.read()
+            except OSError as e:
+                return _error("Compile failed: %s" % e)
+
+        return {
+            "type": "result",
+            "exit_code": process.returncode,
+            "output": output.decode("utf-8", "replace"),
+        }, result
+
+
+def serve(host, port, toolchains, jobs=None, token=None):
+    """
+    @raise ArduMgrError If no token given for a non-loopback address
+    """
+
+    if (token is None) and (host not in _LOOPBACK_HOSTS) and (
+            not host.startswith("127.")):
+        raise ArduMgrError(
+            "A token is required to accept connections from other hosts!")
+
+    server = WorkerServer((host, port), toolchains, jobs, token)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class _Worker(object):
+
+    def __init__(self, address, slots):
+        self.address = address
+        self.slots = slots
+        self.alive = True
+
+
+class DistributedCompiler(object):
+    """
+    Spread compile units to workers and local slots.
+
+    Units are preprocessed locally, remote failures (connection errors,
+    missing toolchain) fall back to compiling locally, and the failed
+    worker won't be used any more.
+
+    @arg workers A list of (host, port) or (host, port, slots)
+    @arg local_jobs Count of units compiled locally at the same time
+    @arg token Secret of workers
+    """
+
+    def __init__(self, workers, local_jobs=1, timeout=300, token=None):
+        self._timeout = timeout
+        self._token = token
+        self._workers = []
+        self._slots = queue.Queue()
+
+        for _ in range(local_jobs):
+            self._slots.put((None, None))
+
+        for worker in workers:
+            host, port = worker[0], int(worker[1])
+            slots = int(worker[2]) if len(worker) > 2 else 1
+            worker = _Worker((host, port), slots)
+            self._workers.append(worker)
+            for _ in range(slots):
+                self._slots.put((worker, None))
+
+    @property
+    def jobs(self):
+        """
+        Total count of local and remote slots, for the builder's pool
+        """
+
+        return self._slots.qsize()
+
+    def compile(self, unit):
+        worker, sock = self._slots.get()
+        try:
+            if (worker is None) or (not worker.alive):
+                return run_command(unit.command)
+
+            try:
+                commands = split_compile_command(unit)
+            except ArduMgrError:
+                return run_command(unit.command)
+
+            try:
+                if sock is None:
+                    sock = self._connect(worker)
+                return self._compile_remote(sock, unit, *commands)
+            except (OSError, ValueError, WorkerError):
+                worker.alive = False
+                return run_command(unit.command)
+        finally:
+            if (worker is None) or worker.alive:
+                self._slots.put((worker, sock))
+            else:
+                # Failed worker's slots become local slots
+                if sock is not None:
+                    sock.close()
+                self._slots.put((None, None))
+
+    def _connect(self, worker):
+        sock = socket.create_connection(worker.address, self._timeout)
+        try:
+            send_message(sock, {"type": "hello", "token": self._token})
+            response, _ = recv_message(sock)
+            if response.get("type") != "ready":
+                raise WorkerError(response.get("message", ""))
+        except BaseException:
+            sock.close()
+            raise
+
+        return sock
+
+    def _compile_remote(self, sock, unit, preprocess, compile_, suffix):
+        process = subprocess.Popen(
+            preprocess, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        source, errors = process.communicate()
+        if process.returncode != 0:
+            return process.returncode, errors.decode("utf-8", "replace")
+
+        header = {
+            "type": "compile",
+            "command": compile_,
+            "toolchain": get_toolchain_identity(compile_[0]),
+            "source_name": os.path.basename(unit.source) + suffix,
+        }
+        send_message(sock, header, source)
+        response, result = recv_message(sock)
+
+        if response.get("type") != "result":
+            raise ToolchainMismatch(response.get("message", ""))
+
+        if response["exit_code"] == 0:
+            with open(unit.object, "wb") as object_file:
+                object_file.write(result)
+
+        return response["exit_code"], response["output"]
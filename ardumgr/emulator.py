@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+Emulated STK500v1 (optiboot) bootloaders on pseudo-terminals.
+
+Each emulator opens a pty and answers the subset of STK500v1 that optiboot
+implements, so uploads could run end to end without boards, for ex: in CI
+or to benchmark concurrent uploads:
+
+    with emulate(4) as emulators:
+        for emulator in emulators:
+            Programmer(platform, {"ardumgr.serial_port": emulator.port})
+            ...
+        for emulator in emulators:
+            print(emulator.report())
+
+A session lasts from the first command to STK_LEAVE_PROGMODE, its report
+has bytes/s and the time spent in each stage (sync, setup, write, verify,
+leave).
+"""
+
+import os
+import tty
+import time
+import select
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from .image import Image
+from .stk500 import (
+    STK_OK, STK_INSYNC, STK_NOSYNC, CRC_EOP, STK_GET_SYNC, STK_GET_PARAMETER,
+    STK_SET_DEVICE, STK_SET_DEVICE_EXT, STK_ENTER_PROGMODE, STK_LEAVE_PROGMODE,
+    STK_CHIP_ERASE, STK_LOAD_ADDRESS, STK_UNIVERSAL, STK_PROG_PAGE,
+    STK_READ_PAGE, STK_READ_SIGN, STK_SW_MAJOR, STK_SW_MINOR)
+
+OPTIBOOT_VERSION = (4, 4)
+
+# Count of bytes follow the command byte, EOP excluded
+_ARGUMENTS = {
+    STK_GET_PARAMETER: 1,
+    STK_SET_DEVICE: 20,
+    STK_SET_DEVICE_EXT: 5,
+    STK_LOAD_ADDRESS: 2,
+    STK_UNIVERSAL: 4,
+    STK_READ_PAGE: 3,
+}
+
+_STAGES = {
+    STK_GET_SYNC: "sync",
+    STK_GET_PARAMETER: "setup",
+    STK_SET_DEVICE: "setup",
+    STK_SET_DEVICE_EXT: "setup",
+    STK_ENTER_PROGMODE: "setup",
+    STK_CHIP_ERASE: "setup",
+    STK_UNIVERSAL: "setup",
+    STK_READ_SIGN: "setup",
+    STK_PROG_PAGE: "write",
+    STK_READ_PAGE: "verify",
+    STK_LEAVE_PROGMODE: "leave",
+}
+
+# Bits of a byte on a 8N1 line
+_BITS_PER_BYTE = 10
+
+
+class Session(object):
+    """
+    Statistics of an upload session.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.finished = None
+        self.pages_written = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        # stage -> [commands, first started, last finished]
+        self._stages = OrderedDict()
+
+    def record(self, stage, started, finished):
+        timing = self._stages.get(stage)
+        if timing is None:
+            self._stages[stage] = [1, started, finished]
+        else:
+            timing[0] += 1
+            timing[2] = finished
+
+    @property
+    def duration(self):
+        end = self.finished
+        if end is None:
+            end = max([self.started] + [
+                timing[2] for timing in self._stages.values()])
+
+        return end - self.started
+
+    def get_stage_seconds(self, stage):
+        timing = self._stages.get(stage)
+        return 0.0 if timing is None else timing[2] - timing[1]
+
+    def to_dict(self):
+        duration = self.duration
+        write_seconds = self.get_stage_seconds("write")
+
+        stages = OrderedDict()
+        for stage, (commands, first, last) in self._stages.items():
+            stages[stage] = OrderedDict([
+                ("commands", commands),
+                ("seconds", last - first),
+                ("latency", (last - first) / commands),
+            ])
+
+        return OrderedDict([
+            ("duration", duration),
+            ("pages_written", self.pages_written),
+            ("bytes_written", self.bytes_written),
+            ("bytes_read", self.bytes_read),
+            ("bytes_per_second",
+             self.bytes_written / duration if duration else 0.0),
+            ("write_bytes_per_second",
+             self.bytes_written / write_seconds if write_seconds else 0.0),
+            ("stages", stages),
+        ])
+
+
+class Stk500Emulator(object):
+    """
+    An optiboot bootloader behind a pseudo-terminal.
+    """
+
+    def __init__(self, signature=b"\x1e\x95\x0f", flash_size=32768,
+                 eeprom_size=1024, baudrate=None):
+        """
+        @arg signature Device signature, defaults to ATmega328P
+        @arg baudrate Emulate transfer time of a serial line, None to answer
+        as fast as possible
+        """
+
+        self.signature = bytes(signature)
+        self.flash = bytearray(b"\xff") * flash_size
+        self.eeprom = bytearray(b"\xff") * eeprom_size
+        self.baudrate = baudrate
+        # Bytes written by STK_PROG_PAGE to flash
+        self.written = Image()
+        self.sessions = []
+        self._session = None
+        self._address = 0
+        self._loaded = None
+        self._buffer = bytearray()
+        self._command_started = None
+        self._master_fd = None
+        self._slave_fd = None
+        self._port = None
+        self._thread = None
+        self._stopping = False
+        self._condition = threading.Condition()
+
+    @property
+    def port(self):
+        """
+        Device path of the pty, pass it as serial port of uploads
+        """
+
+        return self._port
+
+    def start(self):
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        tty.setraw(self._master_fd)
+        self._port = os.ttyname(self._slave_fd)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stopping = True
+        self._thread.join()
+        self._thread = None
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def wait_sessions(self, count, timeout=None):
+        """
+        Wait until count sessions finished
+
+        @return True if finished in time
+        """
+
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: len(self.finished_sessions) >= count, timeout)
+
+    @property
+    def finished_sessions(self):
+        return [
+            session for session in self.sessions
+            if session.finished is not None]
+
+    def report(self):
+        """
+        @return A list of dict, one per session
+        """
+
+        with self._condition:
+            return [session.to_dict() for session in self.sessions]
+
+    def _serve(self):
+        while not self._stopping:
+            readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+            if not readable:
+                continue
+
+            try:
+                data = os.read(self._master_fd, 4096)
+            except OSError:
+                continue
+
+            if not self._buffer:
+                self._command_started = time.monotonic()
+
+            self._buffer += data
+            while self._buffer:
+                length = self._get_command_length()
+                if (length is None) or (len(self._buffer) < length):
+                    break
+
+                command = bytes(self._buffer[:length])
+                del self._buffer[:length]
+                self._handle(command, self._command_started)
+                self._command_started = time.monotonic()
+
+    def _get_command_length(self):
+        command = self._buffer[0]
+        if command == STK_PROG_PAGE:
+            if len(self._buffer) < 4:
+                return None
+
+            size = (self._buffer[1] << 8) | self._buffer[2]
+            return 4 + size + 1
+
+        return 1 + _ARGUMENTS.get(command, 0) + 1
+
+    def _delay(self, transferred):
+        if self.baudrate:
+            time.sleep(transferred * _BITS_PER_BYTE / float(self.baudrate))
+
+    def _reply(self, command, started, payload=b""):
+        response = bytes((STK_INSYNC,)) + payload + bytes((STK_OK,))
+        self._delay(len(command) + len(response))
+        os.write(self._master_fd, response)
+
+        code = command[0]
+        finished = time.monotonic()
+        if code == STK_LOAD_ADDRESS:
+            # Addresses are loaded before every page written or read, they
+            # belong to the stage of that page
+            self._loaded = (started, finished)
+            return
+
+        stage = _STAGES.get(code, "setup")
+        with self._condition:
+            if self._loaded is not None:
+                self._session.record(
+                    stage if code in (STK_PROG_PAGE, STK_READ_PAGE)
+                    else "setup", *self._loaded)
+                self._loaded = None
+
+            self._session.record(stage, started, finished)
+            if code == STK_LEAVE_PROGMODE:
+                self._session.finished = finished
+                self._session = None
+                self._condition.notify_all()
+
+    def _handle(self, command, started):
+        if command[-1] != CRC_EOP:
+            # Out of sync, hosts retry STK_GET_SYNC
+            os.write(self._master_fd, bytes((STK_NOSYNC,)))
+            return
+
+        if self._session is None:
+            with self._condition:
+                self._session = Session(started)
+                self.sessions.append(self._session)
+
+        code = command[0]
+        payload = b""
+        if code == STK_GET_PARAMETER:
+            payload = bytes((self._get_parameter(command[1]),))
+        elif code == STK_LOAD_ADDRESS:
+            self._address = command[1] | (command[2] << 8)
+        elif code == STK_UNIVERSAL:
+            payload = b"\x00"
+        elif code == STK_READ_SIGN:
+            payload = self.signature
+        elif code == STK_PROG_PAGE:
+            self._program_page(command[3], command[4:-1])
+        elif code == STK_READ_PAGE:
+            size = (command[1] << 8) | command[2]
+            payload = self._read_page(command[3], size)
+
+        self._reply(command, started, payload)
+
+    @staticmethod
+    def _get_parameter(parameter):
+        if parameter == STK_SW_MAJOR:
+            return OPTIBOOT_VERSION[0]
+
+        if parameter == STK_SW_MINOR:
+            return OPTIBOOT_VERSION[1]
+
+        # Optiboot answers 3 to everything else
+        return 0x03
+
+    def _program_page(self, memory_type, data):
+        if memory_type == ord("E"):
+            address = self._address
+            self.eeprom[address:address + len(data)] = data
+        else:
+            # Flash addresses are in words
+            address = self._address * 2
+            self.flash[address:address + len(data)] = data
+            self.written.write(address, data)
+            self._session.pages_written += 1
+
+        self._session.bytes_written += len(data)
+
+    def _read_page(self, memory_type, size):
+        if memory_type == ord("E"):
+            memory = self.eeprom
+            address = self._address
+        else:
+            memory = self.flash
+            address = self._address * 2
+
+        self._session.bytes_read += size
+        return bytes(memory[address:address + size])
+
+
+@contextmanager
+def emulate(count, **kwargs):
+    """
+    Run count emulators, keyword arguments are passed to Stk500Emulator
+
+    @return A list of started emulators
+    """
+
+    emulators = []
+    try:
+        for _ in range(count):
+            emulators.append(Stk500Emulator(**kwargs).start())
+
+        yield emulators
+    finally:
+        for emulator in emulators:
+            emulator.stop()
@@ -3,3 +3,7 @@
 
 class ArduMgrError(Exception):
     pass
+
+
+class BuildError(ArduMgrError):
+    pass
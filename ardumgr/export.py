@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Export resolved configs of a programmer, so that upload commands could be
+generated on hosts without an Arduino installation:
+
+    ardumgr export mega.json
+    ardumgr --from-export mega.json upload Blink /tmp/build
+
+Exports are JSON, or msgpack if the msgpack package installed and the file
+name ends with ".msgpack".
+"""
+
+import re
+import json
+from collections import OrderedDict
+from .exceptions import ArduMgrError
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ("json", "msgpack")
+
+EXPORT_VERSION = 1
+
+_FIELD_REGEXP = re.compile(r"\{([^{}]+)\}")
+
+_MAX_EXPAND_PASSES = 32
+
+# Fields kept while expanding, so they could still be overridden by
+# preferences when importing
+KEPT_FIELDS = frozenset(["serial.port", "serial.port.file"])
+
+
+def _expand_partial(flat, runtime_os, text):
+    """
+    Expand fields found in flat, keep unknown fields (for ex:
+    "{build.path}") as is.
+    """
+
+    def replace(match):
+        field_name = match.group(1)
+        if field_name in KEPT_FIELDS:
+            return match.group()
+
+        value = flat.get("%s.%s" % (field_name, runtime_os))
+        if value is None:
+            value = flat.get(field_name)
+
+        return match.group() if value is None else value
+
+    # Limited passes in case of reference cycles
+    for _ in range(_MAX_EXPAND_PASSES):
+        expanded = _FIELD_REGEXP.sub(replace, text)
+        if expanded == text:
+            break
+
+        text = expanded
+
+    return text
+
+
+def expand_flat(flat, oss, keys=None):
+    """
+    Resolve values of flattened configs for current OS and expand them,
+    fields only known while building or uploading and KEPT_FIELDS are kept
+
+    @arg oss OS suffixes, OS specific keys are dropped
+    @arg keys Keys to expand, defaults to all keys of flat
+    @return An OrderedDict of expanded values
+    """
+
+    runtime_os = flat["runtime.os"]
+    if keys is None:
+        keys = flat.keys()
+
+    expanded = OrderedDict()
+    for key in keys:
+        parts = key.rsplit(".", 1)
+        if (len(parts) == 2) and (parts[1] in oss):
+            continue
+
+        value = flat.get("%s.%s" % (key, runtime_os), flat[key])
+        expanded[key] = _expand_partial(flat, runtime_os, value)
+
+    return expanded
+
+
+def export_programmer(programmer, expand=False):
+    """
+    Collect configs of a programmer and its bases into a dict
+
+    @arg expand Expand all values for current OS, fields only known while
+    building or uploading (for ex: "{build.path}") and KEPT_FIELDS are kept
+    @return An OrderedDict that could be written by write_export()
+    """
+
+    if programmer.platform is None:
+        raise ArduMgrError("Programmer created from an export can't be "
+                           "exported again!")
+
+    flat = programmer.cfgs.flatten()
+    if expand:
+        flat = expand_flat(flat, programmer.platform._manager.oss)
+
+    board, cpu, programmer_id, serial_port = programmer.metric_labels
+    return OrderedDict([
+        ("version", EXPORT_VERSION),
+        ("expanded", bool(expand)),
+        ("ide_version", programmer.platform._manager.version),
+        ("platform", str(programmer.platform.id_)),
+        ("board", board),
+        ("cpu", cpu),
+        ("programmer", programmer_id),
+        ("menus", programmer.menus),
+        ("configs", flat),
+    ])
+
+
+def _get_format(path, format_):
+    if format_ is None:
+        format_ = "msgpack" if str(path).endswith(".msgpack") else "json"
+
+    if format_ not in FORMATS:
+        raise ArduMgrError("Unsupported export format: %s" % format_)
+
+    if (format_ == "msgpack") and (msgpack is None):
+        raise ArduMgrError("msgpack format requires msgpack package!")
+
+    return format_
+
+
+def write_export(data, path, format_=None):
+    format_ = _get_format(path, format_)
+    if format_ == "msgpack":
+        with open(str(path), "wb") as afile:
+            afile.write(msgpack.packb(data, use_bin_type=True))
+    else:
+        with open(str(path), "w") as afile:
+            json.dump(data, afile, separators=(",", ":"))
+
+
+def read_export(path):
+    """
+    Read an export written by write_export(), the format is detected from
+    file content.
+    """
+
+    with open(str(path), "rb") as afile:
+        content = afile.read()
+
+    if content.lstrip()[:1] == b"{":
+        data = json.loads(
+            content.decode("utf-8"), object_pairs_hook=OrderedDict)
+    elif msgpack is not None:
+        data = msgpack.unpackb(
+            content, raw=False, object_pairs_hook=OrderedDict)
+    else:
+        raise ArduMgrError("msgpack format requires msgpack package!")
+
+    if (not isinstance(data, dict)) or (
+            data.get("version") != EXPORT_VERSION):
+        raise ArduMgrError("Unsupported export file: %s" % path)
+
+    return data
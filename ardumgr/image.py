@@ -0,0 +1,664 @@
+# -*- coding: utf-8 -*-
+
+"""
+Intel HEX and raw binary images.
+
+An Image is a sparse map of address to bytes, kept as a sorted list of
+non-overlapping bytearray segments. Intel HEX files are parsed in one
+streaming pass: runs of consecutive data records are decoded, checked and
+copied column by column with slicing, so no Python object is created per
+byte or per regular record:
+
+    image = Image.from_hex("Blink.hex")
+    image.merge(Image.from_hex("optiboot.hex"))
+    image.check_size(32256)
+    image.write_hex("Blink.with_bootloader.hex")
+"""
+
+import os
+import sys
+import zlib
+import hashlib
+import binascii
+from array import array
+from contextlib import contextmanager
+from .exceptions import ArduMgrError
+
+DATA = 0x00
+END_OF_FILE = 0x01
+EXTENDED_SEGMENT_ADDRESS = 0x02
+START_SEGMENT_ADDRESS = 0x03
+EXTENDED_LINEAR_ADDRESS = 0x04
+START_LINEAR_ADDRESS = 0x05
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Separators removed before decoding a chunk of Intel HEX text
+_SEPARATORS = b":\r\n \t"
+
+# Two's complement of each byte, turns sums of records into checksums
+_NEGATE = bytes((-i) & 0xFF for i in range(256))
+
+_WINDOW_SIZE = 0x10000
+
+
+@contextmanager
+def _open(source, mode):
+    if hasattr(source, "read") or hasattr(source, "write"):
+        yield source
+        return
+
+    with open(str(source), mode) as afile:
+        yield afile
+
+
+def _address_column(address, step, count):
+    """
+    @return Big endian 16 bits addresses of count records start from address
+    """
+
+    addresses = array("H", range(address, address + step * count, step))
+    if sys.byteorder == "little":
+        addresses.byteswap()
+
+    return addresses.tobytes()
+
+
+def _column_sums(blob, offset, length, count):
+    """
+    Sum bytes of count records of length bytes each, all at once: every
+    column of records is spread into 24 bits lanes of a big integer, so
+    the additions run in C.
+
+    @return Lowest byte of sum of each record
+    """
+
+    stop = offset + length * count
+    lanes = bytearray(3 * count)
+    total = 0
+    for k in range(length):
+        lanes[2::3] = blob[offset + k:stop:length]
+        total += int.from_bytes(lanes, "big")
+
+    return total.to_bytes(3 * count, "big")[2::3]
+
+
+def _encode_run(data, address, count, n):
+    """
+    Encode n data records of count bytes each to Intel HEX lines
+    """
+
+    length = count + 5
+    blob = bytearray(length * n)
+    blob[0::length] = bytes((count,)) * n
+    addresses = _address_column(address, count, n)
+    blob[1::length] = addresses[0::2]
+    blob[2::length] = addresses[1::2]
+    for k in range(count):
+        blob[4 + k::length] = data[k::count]
+
+    blob[length - 1::length] = _column_sums(
+        blob, 0, length, n).translate(_NEGATE)
+
+    text = binascii.hexlify(blob).upper()
+    width = 2 * length + 2
+    lines = bytearray(width * n)
+    lines[0::width] = b":" * n
+    lines[width - 1::width] = b"\n" * n
+    for j in range(2 * length):
+        lines[1 + j::width] = text[j::2 * length]
+
+    return lines
+
+
+def _encode_record(record_type, address, data=b""):
+    record = bytearray((len(data), address >> 8, address & 0xFF,
+                        record_type))
+    record += data
+    record.append((-sum(record)) & 0xFF)
+    return b":" + binascii.hexlify(record).upper() + b"\n"
+
+
+class _HexReader(object):
+    """
+    State of parsing an Intel HEX file into an image
+    """
+
+    def __init__(self, image, name):
+        self._image = image
+        self._name = name
+        self._base = 0
+        self._index = 0
+        self.finished = False
+
+    def _error(self, message, index=None):
+        if index is None:
+            index = self._index
+
+        return ArduMgrError("%s at record %d of %s!" % (
+            message, index + 1, self._name))
+
+    def feed(self, text):
+        """
+        Parse complete records of text
+        """
+
+        expected = text.count(b":")
+        try:
+            blob = binascii.unhexlify(text.translate(None, _SEPARATORS))
+        except (binascii.Error, ValueError):
+            raise self._error("Invalid Intel HEX text")
+
+        first = self._index
+        self._parse(blob)
+        if (not self.finished) and (self._index - first != expected):
+            raise self._error("Malformed Intel HEX records")
+
+    def _parse(self, blob):
+        pos = 0
+        size = len(blob)
+        while (pos < size) and (not self.finished):
+            if pos + 5 > size:
+                raise self._error("Truncated record")
+
+            count = blob[pos]
+            length = count + 5
+            if pos + length > size:
+                raise self._error("Truncated record")
+
+            address = (blob[pos + 1] << 8) | blob[pos + 2]
+            record_type = blob[pos + 3]
+            if (record_type == DATA) and count:
+                pos += length * self._parse_data_run(
+                    blob, pos, count, address)
+                continue
+
+            record = blob[pos:pos + length]
+            if sum(record) & 0xFF:
+                raise self._error("Checksum mismatch")
+
+            self._parse_record(record_type, record[4:-1])
+            self._index += 1
+            pos += length
+
+    def _parse_data_run(self, blob, pos, count, address):
+        """
+        Decode data records follow the one at pos with same length and
+        consecutive addresses
+
+        @return Count of decoded records
+        """
+
+        length = count + 5
+        limit = min((len(blob) - pos) // length,
+                    (_WINDOW_SIZE - address) // count)
+        limit = max(limit, 1)
+        stop = pos + length * limit
+
+        counts = blob[pos:stop:length]
+        n = limit - len(counts.lstrip(bytes((count,))))
+
+        types = blob[pos + 3:stop:length][:n]
+        n -= len(types.lstrip(b"\0"))
+
+        actual = bytearray(2 * n)
+        actual[0::2] = blob[pos + 1:stop:length][:n]
+        actual[1::2] = blob[pos + 2:stop:length][:n]
+        diff = int.from_bytes(actual, "big") ^ int.from_bytes(
+            _address_column(address, count, n), "big")
+        if diff:
+            n = (16 * n - diff.bit_length()) // 16
+
+        sums = _column_sums(blob, pos, length, n)
+        if sums.count(0) != n:
+            raise self._error("Checksum mismatch", self._index + n - len(
+                sums.lstrip(b"\0")))
+
+        stop = pos + length * n
+        data = bytearray(count * n)
+        for k in range(count):
+            data[k::count] = blob[pos + 4 + k:stop:length]
+
+        self._image.write(self._base + address, data)
+        self._index += n
+        return n
+
+    def _parse_record(self, record_type, data):
+        if record_type == DATA:
+            return
+
+        if record_type == END_OF_FILE:
+            self.finished = True
+        elif record_type in (EXTENDED_SEGMENT_ADDRESS,
+                             EXTENDED_LINEAR_ADDRESS):
+            if len(data) != 2:
+                raise self._error("Invalid extended address")
+
+            shift = 4 if record_type == EXTENDED_SEGMENT_ADDRESS else 16
+            self._base = int.from_bytes(data, "big") << shift
+        elif record_type in (START_SEGMENT_ADDRESS, START_LINEAR_ADDRESS):
+            self._image._start_record = (record_type, bytes(data))
+        else:
+            raise self._error("Unknown record type %d" % record_type)
+
+
+class Image(object):
+    """
+    A sparse memory image.
+
+    Views returned by segments lock their segment, release them before
+    writing to the image again.
+    """
+
+    def __init__(self):
+        # Sorted [start, bytearray], never overlapping nor adjacent
+        self._segments = []
+        self._start_record = None
+
+    @classmethod
+    def from_hex(cls, source):
+        """
+        @arg source Path or binary file object of an Intel HEX file
+        """
+
+        self = cls()
+        name = getattr(source, "name", source)
+        reader = _HexReader(self, name)
+        with _open(source, "rb") as hex_file:
+            pending = b""
+            while not reader.finished:
+                chunk = hex_file.read(_CHUNK_SIZE)
+                if not chunk:
+                    reader.feed(pending)
+                    break
+
+                pending += chunk
+                # Records never cross chunks
+                cut = pending.rfind(b":")
+                if cut > 0:
+                    reader.feed(pending[:cut])
+                    pending = pending[cut:]
+
+        if not reader.finished:
+            raise ArduMgrError(
+                "Missing end of file record of %s!" % name)
+
+        return self
+
+    @classmethod
+    def from_bin(cls, source, address=0):
+        """
+        @arg source Path or binary file object of a raw binary file
+        @arg address Where the first byte placed
+        """
+
+        self = cls()
+        with _open(source, "rb") as bin_file:
+            data = bytearray(bin_file.read())
+
+        if data:
+            self._segments.append([address, data])
+
+        return self
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an Intel HEX file (".hex") or a raw binary file
+        """
+
+        if str(path).lower().endswith(".hex"):
+            return cls.from_hex(path)
+
+        return cls.from_bin(path)
+
+    def __eq__(self, other):
+        if not isinstance(other, Image):
+            return NotImplemented
+
+        return self._segments == other._segments
+
+    __hash__ = None
+
+    @property
+    def segments(self):
+        """
+        @return A list of (start address, memoryview)
+        """
+
+        return [(start, memoryview(data)) for start, data in self._segments]
+
+    @property
+    def start(self):
+        return self._segments[0][0] if self._segments else 0
+
+    @property
+    def end(self):
+        """
+        Address after the last byte
+        """
+
+        if not self._segments:
+            return 0
+
+        start, data = self._segments[-1]
+        return start + len(data)
+
+    @property
+    def size(self):
+        """
+        Count of bytes in the image, gaps excluded
+        """
+
+        return sum(len(data) for _, data in self._segments)
+
+    def write(self, address, data):
+        """
+        Write data at address, overwrite existing bytes
+        """
+
+        end = address + len(data)
+        segments = self._segments
+
+        if segments:
+            last_start, last_data = segments[-1]
+            last_end = last_start + len(last_data)
+            if last_end == address:
+                # Sequential writes (common case) only extend
+                last_data += data
+                return
+
+        if (not segments) or (last_end < address):
+            segments.append([address, bytearray(data)])
+            return
+
+        # Segments overlap or adjacent to [address, end)
+        first = 0
+        while segments[first][0] + len(segments[first][1]) < address:
+            first += 1
+
+        last = first
+        while (last < len(segments)) and (segments[last][0] <= end):
+            last += 1
+
+        if first == last:
+            segments.insert(first, [address, bytearray(data)])
+            return
+
+        new_start = min(segments[first][0], address)
+        new_end = max(segments[last - 1][0] + len(segments[last - 1][1]),
+                      end)
+        merged = bytearray(new_end - new_start)
+        for start, old in segments[first:last]:
+            merged[start - new_start:start - new_start + len(old)] = old
+
+        merged[address - new_start:end - new_start] = data
+        segments[first:last] = [[new_start, merged]]
+
+    def read(self, address, length, fill=0xFF):
+        """
+        @return A bytearray of length bytes from address, gaps filled
+        """
+
+        out = bytearray((fill,)) * length
+        end = address + length
+        for start, data in self._segments:
+            data_end = start + len(data)
+            if data_end <= address:
+                continue
+
+            if start >= end:
+                break
+
+            begin = max(start, address)
+            stop = min(data_end, end)
+            out[begin - address:stop - address] = memoryview(data)[
+                begin - start:stop - start]
+
+        return out
+
+    def overlaps(self, other):
+        """
+        @return Address of the first byte present in both images, or None
+        """
+
+        for start, data in other._segments:
+            end = start + len(data)
+            for my_start, my_data in self._segments:
+                my_end = my_start + len(my_data)
+                if (my_start < end) and (start < my_end):
+                    return max(start, my_start)
+
+        return None
+
+    def merge(self, other, overwrite=False):
+        """
+        Merge other image (for ex: a bootloader) into this one
+
+        @arg overwrite Bytes of other overwrite this one, instead of raising
+        ArduMgrError on overlap
+        @return self
+        """
+
+        if not overwrite:
+            address = self.overlaps(other)
+            if address is not None:
+                raise ArduMgrError("Images overlap at 0x%X!" % address)
+
+        for start, data in other._segments:
+            self.write(start, data)
+
+        if other._start_record is not None:
+            self._start_record = other._start_record
+
+        return self
+
+    def split(self, address):
+        """
+        @return Images (below address, from address)
+        """
+
+        lower = Image()
+        upper = Image()
+        for start, data in self._segments:
+            view = memoryview(data)
+            if start < address:
+                lower.write(start, view[:address - start])
+
+            if start + len(data) > address:
+                offset = max(address - start, 0)
+                upper.write(start + offset, view[offset:])
+
+        upper._start_record = self._start_record
+        return lower, upper
+
+    def fill(self, value=0xFF, start=None, end=None):
+        """
+        Fill gaps between start and end (defaults to the whole image), so
+        they become one segment
+        """
+
+        if start is None:
+            start = self.start
+
+        if end is None:
+            end = self.end
+
+        if end > start:
+            self.write(start, self.read(start, end - start, value))
+
+    def to_bin(self, fill=0xFF):
+        """
+        @return A bytearray from start to end of the image, gaps filled
+        """
+
+        return self.read(self.start, self.end - self.start, fill)
+
+    def crc32(self, fill=0xFF):
+        """
+        @return CRC32 of to_bin(fill), computed without joining segments
+        """
+
+        crc = 0
+        position = self.start
+        for start, data in self._segments:
+            if start > position:
+                crc = zlib.crc32(bytes((fill,)) * (start - position), crc)
+
+            crc = zlib.crc32(data, crc)
+            position = start + len(data)
+
+        return crc & 0xFFFFFFFF
+
+    def page_ranges(self, page_size):
+        """
+        @return A list of (start, end) of page aligned ranges covering the
+        image, adjacent pages joined
+        """
+
+        ranges = []
+        for start, data in self._segments:
+            end = start + len(data)
+            end += -end % page_size
+            start -= start % page_size
+            if ranges and (ranges[-1][1] >= start):
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+        return [tuple(arange) for arange in ranges]
+
+    def compare(self, flash, page_size, hash_only=False):
+        """
+        Compare pages covered by this image against flash contents, for ex:
+        read back from a board or loaded from a previous dump. Gaps in pages
+        are expected to be erased (0xFF), as they are uploaded padded.
+
+        @arg flash An Image of flash contents
+        @arg hash_only Only compare digests of page ranges, mismatched
+        ranges are reported as a whole
+        @return A list of (start, end) of mismatched ranges, empty if the
+        flash matches
+        """
+
+        mismatches = []
+        for start, end in self.page_ranges(page_size):
+            expected = self.read(start, end - start)
+            actual = flash.read(start, end - start)
+            if hash_only:
+                if hashlib.sha256(expected).digest() != hashlib.sha256(
+                        actual).digest():
+                    mismatches.append((start, end))
+
+                continue
+
+            expected = memoryview(expected)
+            actual = memoryview(actual)
+            for offset in range(0, end - start, page_size):
+                page_end = offset + page_size
+                if expected[offset:page_end] == actual[offset:page_end]:
+                    continue
+
+                # Only bytes of mismatched pages are looked at
+                for i in range(offset, page_end):
+                    if expected[i] == actual[i]:
+                        continue
+
+                    address = start + i
+                    if mismatches and (mismatches[-1][1] == address):
+                        mismatches[-1] = (mismatches[-1][0], address + 1)
+                    else:
+                        mismatches.append((address, address + 1))
+
+        return mismatches
+
+    def check_size(self, maximum_size):
+        """
+        Raise ArduMgrError if the image doesn't fit in maximum_size bytes
+        (for ex: "upload.maximum_size" of a board)
+        """
+
+        size = self.size
+        if size > int(maximum_size):
+            raise ArduMgrError(
+                "Image too large: %d bytes, maximum is %d bytes!" % (
+                    size, int(maximum_size)))
+
+    def write_hex(self, target, record_size=16):
+        """
+        @arg target Path or binary file object
+        """
+
+        if not 0 < record_size < 256:
+            raise ArduMgrError("Invalid record size: %s" % record_size)
+
+        with _open(target, "wb") as hex_file:
+            upper = 0
+            for start, data in self._segments:
+                view = memoryview(data)
+                offset = 0
+                while offset < len(data):
+                    address = start + offset
+                    if (address >> 16) != upper:
+                        upper = address >> 16
+                        if upper > 0xFFFF:
+                            raise ArduMgrError(
+                                "Address 0x%X out of Intel HEX range!" % (
+                                    address))
+
+                        hex_file.write(_encode_record(
+                            EXTENDED_LINEAR_ADDRESS, 0,
+                            upper.to_bytes(2, "big")))
+
+                    # Records never cross 64K windows
+                    window = min(len(data) - offset,
+                                 _WINDOW_SIZE - (address & 0xFFFF))
+                    chunk = bytes(view[offset:offset + window])
+                    n, rest = divmod(len(chunk), record_size)
+                    if n:
+                        hex_file.write(_encode_run(
+                            chunk[:n * record_size], address & 0xFFFF,
+                            record_size, n))
+
+                    if rest:
+                        hex_file.write(_encode_run(
+                            chunk[n * record_size:],
+                            (address + n * record_size) & 0xFFFF, rest, 1))
+
+                    offset += window
+
+            if self._start_record is not None:
+                hex_file.write(_encode_record(
+                    self._start_record[0], 0, self._start_record[1]))
+
+            hex_file.write(_encode_record(END_OF_FILE, 0))
+
+    def write_bin(self, target, fill=0xFF):
+        """
+        @arg target Path or binary file object
+        """
+
+        with _open(target, "wb") as bin_file:
+            bin_file.write(self.to_bin(fill))
+
+
+def image_size(path):
+    """
+    @return Count of data bytes in an Intel HEX or raw binary file
+    """
+
+    if str(path).lower().endswith(".hex"):
+        return Image.from_hex(path).size
+
+    return os.path.getsize(str(path))
+
+
+def format_ranges(ranges):
+    """
+    @return Text of (start, end) ranges, for ex: "0x0000-0x007F, 0x0100"
+    """
+
+    return ", ".join(
+        ("0x%04X" % start) if end - start == 1 else (
+            "0x%04X-0x%04X" % (start, end - 1))
+        for start, end in ranges)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""
+Persistent upload job queue backed by a SQLite file.
+
+Every job is an image and the preferences of its target (board, cpu,
+programmer, serial port ...). Enqueue, start and finish times, exit code
+and duration are recorded, so a batch killed halfway could be resumed,
+only unfinished or failed jobs are uploaded again:
+
+    queue = JobQueue("uploads.sqlite")
+    queue.add("Blink.hex", {"ardumgr.board": "uno", ...}, batch="rack1")
+    queue.run(manager, workers=4)
+    ...
+    queue.resume(batch="rack1")
+    queue.run(manager, workers=4)
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from collections import namedtuple, OrderedDict
+from .programmer import Programmer
+from .exceptions import ArduMgrError
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+Job = namedtuple("Job", [
+    "id", "batch", "image", "preferences", "state", "attempts", "exit_code",
+    "error", "enqueued_at", "started_at", "finished_at", "duration"])
+Job.__doc__ = """
+An upload job.
+
+preferences: an OrderedDict of preferences of the target
+exit_code: exit code of the last attempt, None if never finished
+error: message if the programmer could not be created or the upload
+       raised an exception
+*_at: UNIX timestamps, duration in seconds
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    image TEXT NOT NULL,
+    preferences TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    exit_code INTEGER,
+    error TEXT,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, state);
+"""
+
+_COLUMNS = ", ".join(Job._fields)
+
+
+def _to_job(row):
+    row = list(row)
+    row[3] = json.loads(row[3], object_pairs_hook=OrderedDict)
+    return Job(*row)
+
+
+def upload_job(programmer, image):
+    """
+    Default uploader of JobQueue.run()
+
+    @return Exit code of the upload tool
+    """
+
+    return programmer.upload_bin(image, retries=0)
+
+
+class JobQueue(object):
+
+    def __init__(self, path):
+        self._path = str(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self._path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def add(self, image, preferences, batch="default"):
+        """
+        Enqueue an upload job
+
+        @return Id of the job
+        """
+
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (batch, image, preferences, state, "
+                "enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                (batch, str(image), json.dumps(preferences), PENDING,
+                 time.time()))
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        rows = self._execute(
+            "SELECT %s FROM jobs WHERE id = ?" % _COLUMNS, (job_id,))
+        return _to_job(rows[0]) if rows else None
+
+    def jobs(self, batch=None, state=None):
+        """
+        @return Jobs in enqueue order
+        """
+
+        conditions = []
+        parameters = []
+        if batch is not None:
+            conditions.append("batch = ?")
+            parameters.append(batch)
+        if state is not None:
+            conditions.append("state = ?")
+            parameters.append(state)
+
+        sql = "SELECT %s FROM jobs" % _COLUMNS
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        return [_to_job(row)
+                for row in self._execute(sql + " ORDER BY id", parameters)]
+
+    def status(self, batch=None):
+        """
+        @return An OrderedDict of state to count of jobs
+        """
+
+        sql = "SELECT state, COUNT(*) FROM jobs"
+        parameters = ()
+        if batch is not None:
+            sql += " WHERE batch = ?"
+            parameters = (batch,)
+
+        counts = dict(self._execute(sql + " GROUP BY state", parameters))
+        return OrderedDict((state, counts.get(state, 0)) for state in STATES)
+
+    def claim(self, batch=None):
+        """
+        Mark the first pending job as running
+
+        @return The claimed Job, or None if no pending job
+        """
+
+        sql = "SELECT id FROM jobs WHERE state = ?"
+        parameters = [PENDING]
+        if batch is not None:
+            sql += " AND batch = ?"
+            parameters.append(batch)
+
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    sql + " ORDER BY id LIMIT 1", parameters).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET state = ?, attempts = attempts + 1, "
+                        "started_at = ?, finished_at = NULL, duration = NULL "
+                        "WHERE id = ?", (RUNNING, time.time(), row[0]))
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+        if row is None:
+            return None
+
+        return self.get(row[0])
+
+    def finish(self, job_id, exit_code, duration, error=None):
+        state = DONE if (exit_code == 0) and (error is None) else FAILED
+        self._execute(
+            "UPDATE jobs SET state = ?, exit_code = ?, error = ?, "
+            "finished_at = ?, duration = ? WHERE id = ?",
+            (state, exit_code, error, time.time(), duration, job_id))
+
+    def resume(self, batch=None):
+        """
+        Mark unfinished (interrupted while running) and failed jobs pending,
+        don't call it while another process is running the queue.
+
+        @return Count of jobs to be uploaded again
+        """
+
+        sql = "UPDATE jobs SET state = ? WHERE state IN (?, ?)"
+        parameters = [PENDING, RUNNING, FAILED]
+        if batch is not None:
+            sql += " AND batch = ?"
+            parameters.append(batch)
+
+        with self._lock:
+            cursor = self._connection.execute(sql, parameters)
+            return cursor.rowcount
+
+    def run(self, manager, workers=1, batch=None, upload=upload_job):
+        """
+        Drain pending jobs with workers threads
+
+        @arg upload A callable (programmer, image) returns exit code
+        @return Status after all pending jobs finished, see status()
+        """
+
+        def work():
+            while True:
+                job = self.claim(batch)
+                if job is None:
+                    return
+
+                started = time.monotonic()
+                try:
+                    platform_id = job.preferences.get(
+                        "ardumgr.platform", manager._cfgs["ardumgr.platform"])
+                    programmer = Programmer(
+                        manager.get_platform(platform_id), job.preferences)
+                except (ArduMgrError, KeyError) as e:
+                    self.finish(job.id, None, 0.0, "%s: %s" % (
+                        type(e).__name__, e))
+                    continue
+
+                # Jobs interrupted by process exit stay running, resume()
+                # retries them
+                try:
+                    exit_code = upload(programmer, job.image)
+                except Exception as e:
+                    self.finish(job.id, None, time.monotonic() - started,
+                                "%s: %s" % (type(e).__name__, e))
+                    continue
+
+                self.finish(job.id, exit_code, time.monotonic() - started)
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return self.status(batch)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+Index of installed libraries, maps header names to libraries so that
+include resolution while building is a dictionary lookup.
+"""
+
+import os
+import re
+import json
+from pathlib import Path
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+Library = namedtuple("Library", ["name", "root", "src_dir", "legacy"])
+Library.__doc__ = """
+An installed library.
+
+root: library root directory
+src_dir: directory contains library headers and sources, "src" for 1.5
+         format libraries, root for legacy libraries
+legacy: True for pre 1.5 format libraries
+"""
+
+HEADER_SUFFIXES = (".h", ".hh", ".hpp")
+SOURCE_SUFFIXES = (".c", ".cpp", ".cc", ".cxx", ".S", ".s")
+
+_INCLUDE_REGEXP = re.compile(
+    br'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+_INDEX_VERSION = 1
+
+
+def _mtime(path):
+    try:
+        return os.stat(str(path)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _scan_library(root):
+    """
+    @return A tuple (library, headers), or None if root is not a library
+    """
+
+    src_dir = root / "src"
+    legacy = not ((root / "library.properties").exists() and src_dir.is_dir())
+    if legacy:
+        src_dir = root
+
+    try:
+        headers = sorted(
+            entry.name for entry in os.scandir(str(src_dir))
+            if entry.is_file() and entry.name.endswith(HEADER_SUFFIXES))
+    except OSError:
+        return None
+
+    return Library(root.name, str(root), str(src_dir), legacy), headers
+
+
+class LibraryIndex(object):
+    """
+    Header index of libraries found in a list of libraries directories.
+
+    Directories are in priority order, a header provided by libraries in
+    more than one directory resolves to the first one. The index is
+    persisted to cache_path, libraries are only rescanned if modification
+    time of their directories changed.
+    """
+
+    def __init__(self, dirs, cache_path=None):
+        self._dirs = [str(adir) for adir in dirs]
+        self._cache_path = None if cache_path is None else Path(cache_path)
+
+        # root -> {"mtime": [...], "library": [...], "headers": [...]}
+        self._entries = dict()
+        # dir -> mtime
+        self._dir_mtimes = dict()
+        self._headers = dict()
+        self._roots = []
+        self._load()
+        self.update()
+
+    @classmethod
+    def for_platform(cls, platform, cache_path=None):
+        """
+        Create index of sketchbook libraries, platform libraries and
+        Arduino IDE libraries, in priority order.
+        """
+
+        manager = platform._manager
+        cfgs = platform.cfgs
+
+        dirs = []
+        if "sketchbook.path" in cfgs:
+            dirs.append(Path(cfgs["sketchbook.path"]) / "libraries")
+        dirs.append(Path(cfgs["runtime.platform.path"]) / "libraries")
+        dirs.append(manager._home_path / "libraries")
+
+        if cache_path is None:
+            cache_path = manager.cache_dir / (
+                "libraries-%s.json" % platform.id_)
+
+        return cls(dirs, cache_path)
+
+    def _load(self):
+        if (self._cache_path is None) or (not self._cache_path.exists()):
+            return
+
+        try:
+            with self._cache_path.open() as cache_file:
+                data = json.load(cache_file)
+        except ValueError:
+            return
+
+        if ((data.get("version") != _INDEX_VERSION)
+                or (data.get("dirs_order") != self._dirs)):
+            return
+
+        self._entries = data["libraries"]
+        self._dir_mtimes = data["dirs"]
+
+    def _save(self):
+        if self._cache_path is None:
+            return
+
+        data = OrderedDict([
+            ("version", _INDEX_VERSION),
+            ("dirs_order", self._dirs),
+            ("dirs", self._dir_mtimes),
+            ("libraries", self._entries),
+        ])
+
+        self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self._cache_path.with_name(
+            self._cache_path.name + ".tmp")
+        with temp_path.open("w") as cache_file:
+            json.dump(data, cache_file)
+        os.replace(str(temp_path), str(self._cache_path))
+
+    def update(self):
+        """
+        Rescan changed libraries
+
+        @return True if the index changed
+        """
+
+        changed = False
+        roots = []
+        for adir in self._dirs:
+            mtime = _mtime(adir)
+            if self._dir_mtimes.get(adir) != mtime:
+                self._dir_mtimes[adir] = mtime
+                changed = True
+
+            try:
+                entries = sorted(
+                    entry.path for entry in os.scandir(adir)
+                    if entry.is_dir() and not entry.name.startswith("."))
+            except OSError:
+                entries = []
+
+            roots.extend(entries)
+
+        for root in set(self._entries.keys()) - set(roots):
+            del self._entries[root]
+            changed = True
+
+        for root in roots:
+            mtimes = [_mtime(root), _mtime(os.path.join(root, "src"))]
+            entry = self._entries.get(root)
+            if (entry is not None) and (entry["mtime"] == mtimes):
+                continue
+
+            result = _scan_library(Path(root))
+            if result is None:
+                self._entries.pop(root, None)
+            else:
+                self._entries[root] = {
+                    "mtime": mtimes,
+                    "library": list(result[0]),
+                    "headers": result[1],
+                }
+            changed = True
+
+        self._roots = roots
+        if changed or (not self._headers):
+            self._build_headers()
+
+        if changed:
+            self._save()
+
+        return changed
+
+    def _build_headers(self):
+        self._headers = dict()
+        # Roots are in directories priority order, keep the first provider
+        for root in self._roots:
+            entry = self._entries.get(root)
+            if entry is None:
+                continue
+
+            library = Library(*entry["library"])
+            for header in entry["headers"]:
+                self._headers.setdefault(header, library)
+
+    @property
+    def libraries(self):
+        """
+        All libraries in priority order
+        """
+
+        return [
+            Library(*self._entries[root]["library"])
+            for root in self._roots if root in self._entries]
+
+    def resolve(self, header):
+        """
+        @return The library provides header, or None
+        """
+
+        return self._headers.get(header)
+
+
+def get_library_sources(library):
+    """
+    @return Source files of library, sorted
+    """
+
+    src_dir = Path(library.src_dir)
+    if library.legacy:
+        paths = list(src_dir.glob("*"))
+        paths.extend(src_dir.glob("utility/*"))
+    else:
+        paths = src_dir.glob("**/*")
+
+    return sorted(
+        str(apath) for apath in paths
+        if apath.suffix in SOURCE_SUFFIXES and apath.is_file())
+
+
+def scan_file_includes(path):
+    with open(str(path), "rb") as source_file:
+        content = source_file.read()
+
+    return [
+        include.decode("utf-8", "replace")
+        for include in _INCLUDE_REGEXP.findall(content)]
+
+
+def scan_includes(paths, jobs=None):
+    """
+    Scan include directives of files in parallel
+
+    @return An OrderedDict of path to its included headers
+    """
+
+    paths = [str(apath) for apath in paths]
+    with ThreadPoolExecutor(max_workers=jobs or 4) as executor:
+        return OrderedDict(zip(paths, executor.map(scan_file_includes, paths)))
+
+
+def resolve_dependencies(index, sources, jobs=None):
+    """
+    Find libraries required by sources, libraries which required by found
+    libraries are resolved as well.
+
+    @return A tuple (libraries, unresolved), libraries is a list of Library
+    in discovery order, unresolved is a set of headers that neither found
+    beside the including file nor provided by any library.
+    """
+
+    libraries = OrderedDict()
+    unresolved = set()
+    pending = [str(apath) for apath in sources]
+    with ThreadPoolExecutor(max_workers=jobs or 4) as executor:
+        while pending:
+            found = []
+            results = executor.map(scan_file_includes, pending)
+            for path, includes in zip(pending, results):
+                base_dir = os.path.dirname(path)
+                for header in includes:
+                    if os.path.exists(os.path.join(base_dir, header)):
+                        continue
+
+                    library = index.resolve(header)
+                    if library is None:
+                        unresolved.add(header)
+                    elif library.root not in libraries:
+                        libraries[library.root] = library
+                        found.append(library)
+
+            pending = []
+            for library in found:
+                pending.extend(get_library_sources(library))
+
+    return list(libraries.values()), unresolved
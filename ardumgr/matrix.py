@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build many sketches for many boards at once.
+
+Boards are grouped by a fingerprint of their expanded core and variant
+compile recipes, boards sharing it (for ex: clones of a board) compile the
+core once and all their sketches link against it:
+
+    <build root>/cores/<fingerprint>/core/core.a
+    <build root>/<board identity>/<sketch name>/<sketch name>.ino.elf
+
+Translation units, core archives and links of all jobs are tasks of one
+dependency graph run by a global worker pool. Units already up to date are
+not scheduled at all. Ready tasks with the longest remaining path run
+first, durations of the last run (ardumgr-matrix.json under build root)
+are used as estimates, so cores and slow units start early.
+"""
+
+import os
+import re
+import json
+import time
+import heapq
+from pathlib import Path
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .builder import Builder, hash_text
+from .libraries import LibraryIndex
+from .size import get_identity_programmer
+from .exceptions import ArduMgrError
+
+TIMINGS_FILE_NAME = "ardumgr-matrix.json"
+
+JobResult = namedtuple("JobResult", [
+    "sketch", "board", "fingerprint", "elf", "compiled", "linked",
+    "started", "finished", "error"])
+JobResult.__doc__ = """
+Result of building a sketch for a board.
+
+fingerprint: core build used by the job
+compiled: count of compiled translation units, shared core excluded
+started, finished: seconds since the matrix started, None if not run
+error: message if failed, None otherwise
+"""
+
+TaskTiming = namedtuple("TaskTiming", ["name", "started", "seconds"])
+
+MatrixResult = namedtuple("MatrixResult", [
+    "jobs", "cores", "seconds", "critical_path", "critical_seconds"])
+MatrixResult.__doc__ = """
+jobs: a list of JobResult in order of sketches then boards
+cores: count of distinct core builds
+seconds: wall time of running tasks
+critical_path: a list of TaskTiming, the chain of dependent tasks with the
+longest total duration
+critical_seconds: total duration of critical_path, the lower bound of
+seconds with unlimited workers
+"""
+
+_TIMINGS_VERSION = 1
+
+# Seconds estimated for tasks never run before
+_DEFAULT_ESTIMATE = 1.0
+
+_SLUG_REGEXP = re.compile(r"[^\w.=-]+")
+
+
+def _execute(run):
+    started = time.monotonic()
+    try:
+        result = run()
+        error = None
+    except (ArduMgrError, OSError) as e:
+        result = None
+        error = str(e)
+
+    return started, time.monotonic(), result, error
+
+
+class _Task(object):
+
+    def __init__(self, name, run, deps=(), done=None):
+        """
+        @arg run Called in a worker thread
+        @arg done Called with result of run in the scheduling thread,
+        returns an error text or None
+        """
+
+        self.name = name
+        self.run = run
+        self.done = done
+        self.deps = list(deps)
+        self.dependents = []
+        self.remaining = len(self.deps)
+        self.priority = 0.0
+        self.result = None
+        self.started = None
+        self.seconds = None
+        self.error = None
+
+        for dep in self.deps:
+            dep.dependents.append(self)
+
+
+class _Job(object):
+
+    def __init__(self, sketch, board, fingerprint, builder):
+        self.sketch = sketch
+        self.board = board
+        self.fingerprint = fingerprint
+        self.builder = builder
+        self.tasks = []
+        self.link = None
+
+
+class BuildMatrix(object):
+    """
+    Build every sketch for every board identity
+    ("platform:board[:menu=option,...]").
+    """
+
+    def __init__(self, manager, sketches, boards, build_root, jobs=None,
+                 compiler=None):
+        """
+        @arg jobs Size of the worker pool, defaults to CPU count
+        @arg compiler See Builder
+        """
+
+        self._manager = manager
+        self._sketches = [Path(os.path.abspath(str(s))) for s in sketches]
+        self._boards = list(boards)
+        self._build_root = Path(os.path.abspath(str(build_root)))
+        self._jobs = jobs or os.cpu_count() or 1
+        self._compiler = compiler
+        self._library_indexes = dict()
+
+        names = [sketch.name for sketch in self._sketches]
+        if len(set(names)) != len(names):
+            raise ArduMgrError("Names of sketches must be unique!")
+
+    @property
+    def timings_path(self):
+        return self._build_root / TIMINGS_FILE_NAME
+
+    def _get_library_index(self, platform):
+        index = self._library_indexes.get(platform.id_)
+        if index is None:
+            index = self._library_indexes[platform.id_] = (
+                LibraryIndex.for_platform(platform))
+
+        return index
+
+    def _name(self, path):
+        return os.path.relpath(str(path), str(self._build_root))
+
+    def get_fingerprint(self, programmer):
+        """
+        @return Hash of core and variant compile commands of a board with
+        build paths left out, boards with the same fingerprint share cores
+        """
+
+        probe_path = self._build_root / "cores" / "_"
+        probe = Builder(programmer, probe_path, probe_path, self._jobs)
+        commands = "\n".join(
+            unit.command for unit in probe.get_compile_units(
+                ["core", "variant"]))
+        return hash_text(commands.replace(str(probe_path), ""))[:16]
+
+    def _load_estimates(self):
+        try:
+            with self.timings_path.open() as timings_file:
+                data = json.load(timings_file)
+            if data.get("version") == _TIMINGS_VERSION:
+                return data["durations"]
+        except (OSError, ValueError):
+            pass
+
+        return dict()
+
+    def _save_estimates(self, estimates, tasks):
+        for task in tasks:
+            if (task.seconds is not None) and (task.error is None):
+                estimates[task.name] = round(task.seconds, 3)
+
+        self._build_root.mkdir(parents=True, exist_ok=True)
+        temp_path = str(self.timings_path) + ".tmp"
+        with open(temp_path, "w") as timings_file:
+            json.dump({"version": _TIMINGS_VERSION,
+                       "durations": estimates}, timings_file)
+        os.replace(temp_path, str(self.timings_path))
+
+    def _add_unit_tasks(self, tasks, builder, units):
+        added = []
+        for unit in builder.get_pending_units(units):
+            def done(result, builder=builder, unit=unit):
+                return builder.record_unit(unit, *result)
+
+            added.append(_Task(
+                self._name(unit.object),
+                lambda builder=builder, unit=unit: builder.compile_unit(unit),
+                done=done))
+
+        tasks.extend(added)
+        return added
+
+    def _plan(self):
+        """
+        @return A tuple (tasks in topological order, jobs, builders, count
+        of cores)
+        """
+
+        tasks = []
+        # fingerprint -> (builder, archive task, variant units)
+        cores = OrderedDict()
+        boards = []
+        for board in self._boards:
+            programmer = get_identity_programmer(self._manager, board)
+            fingerprint = self.get_fingerprint(programmer)
+            boards.append((board, programmer, fingerprint))
+
+            if fingerprint in cores:
+                continue
+
+            core_path = self._build_root / "cores" / fingerprint
+            builder = Builder(programmer, core_path, core_path, self._jobs,
+                              compiler=self._compiler)
+            units = builder.get_compile_units(["core", "variant"])
+            core_units = [unit for unit in units if unit.group == "core"]
+            variant_units = [unit for unit in units if unit.group != "core"]
+            core_tasks = self._add_unit_tasks(tasks, builder, core_units)
+            variant_tasks = self._add_unit_tasks(
+                tasks, builder, variant_units)
+
+            def archive(builder=builder, units=core_units):
+                builder.state.save()
+                return builder.archive_core(units)
+
+            # Waits for variant units too, the state of builder is only
+            # updated by one thread at a time
+            archive_task = _Task(
+                self._name(core_path / "core" / "core.a"), archive,
+                core_tasks + variant_tasks)
+            tasks.append(archive_task)
+            cores[fingerprint] = (builder, archive_task, variant_units)
+
+        jobs = []
+        for sketch in self._sketches:
+            for board, programmer, fingerprint in boards:
+                build_path = (self._build_root / _SLUG_REGEXP.sub("_", board)
+                              / sketch.name)
+                builder = Builder(
+                    programmer, sketch, build_path, self._jobs,
+                    self._get_library_index(programmer.platform),
+                    self._compiler)
+                _, archive_task, variant_units = cores[fingerprint]
+
+                job = _Job(sketch, board, fingerprint, builder)
+                units = builder.get_compile_units(["sketch", "libraries"])
+                job.tasks = self._add_unit_tasks(tasks, builder, units)
+
+                def link(builder=builder, units=units + variant_units,
+                         archive_path=archive_task.name):
+                    builder.state.save()
+                    builder.use_core(self._build_root / archive_path)
+                    linked = builder.link(units)
+                    builder.objcopy()
+                    return linked
+
+                job.link = _Task(
+                    self._name(build_path / (builder.project_name + ".elf")),
+                    link, job.tasks + [archive_task])
+                tasks.append(job.link)
+                jobs.append(job)
+
+        builders = [core[0] for core in cores.values()]
+        builders.extend(job.builder for job in jobs)
+        return tasks, jobs, builders, len(cores)
+
+    @staticmethod
+    def _skip(task, error):
+        if task.error is not None:
+            return
+
+        task.error = error
+        for dependent in task.dependents:
+            BuildMatrix._skip(dependent, error)
+
+    def _schedule(self, tasks, estimates):
+        # Longest remaining path first, tasks are in topological order
+        for task in reversed(tasks):
+            task.priority = estimates.get(task.name, _DEFAULT_ESTIMATE) + max(
+                [dependent.priority for dependent in task.dependents] or [0])
+
+        ready = []
+        for seq, task in enumerate(tasks):
+            task.seq = seq
+            if task.remaining == 0:
+                heapq.heappush(ready, (-task.priority, seq, task))
+
+        origin = time.monotonic()
+        inflight = dict()
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            while ready or inflight:
+                while ready and (len(inflight) < self._jobs):
+                    task = heapq.heappop(ready)[2]
+                    inflight[executor.submit(_execute, task.run)] = task
+
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = inflight.pop(future)
+                    started, stopped, task.result, error = future.result()
+                    task.started = started - origin
+                    task.seconds = stopped - started
+                    if (error is None) and (task.done is not None):
+                        error = task.done(task.result)
+
+                    if error is not None:
+                        self._skip(task, error)
+                        continue
+
+                    for dependent in task.dependents:
+                        dependent.remaining -= 1
+                        if (dependent.remaining == 0) and (
+                                dependent.error is None):
+                            heapq.heappush(ready, (
+                                -dependent.priority, dependent.seq,
+                                dependent))
+
+        return time.monotonic() - origin
+
+    @staticmethod
+    def get_critical_path(tasks):
+        """
+        @arg tasks Tasks in topological order
+        @return A tuple (list of TaskTiming, total seconds)
+        """
+
+        lengths = dict()
+        previous = dict()
+        for task in tasks:
+            if task.seconds is None:
+                continue
+
+            deps = [dep for dep in task.deps if dep in lengths]
+            longest = max(deps, key=lengths.get) if deps else None
+            previous[task] = longest
+            lengths[task] = task.seconds + (
+                lengths[longest] if longest is not None else 0.0)
+
+        if not lengths:
+            return [], 0.0
+
+        task = max(lengths, key=lengths.get)
+        total = lengths[task]
+        path = []
+        while task is not None:
+            path.append(TaskTiming(task.name, task.started, task.seconds))
+            task = previous[task]
+
+        path.reverse()
+        return path, total
+
+    def run(self):
+        """
+        @return A MatrixResult
+        """
+
+        tasks, jobs, builders, cores = self._plan()
+        estimates = self._load_estimates()
+        seconds = self._schedule(tasks, estimates)
+
+        for builder in builders:
+            builder.state.save()
+
+        self._save_estimates(estimates, tasks)
+
+        results = []
+        for job in jobs:
+            timed = [task for task in job.tasks + [job.link]
+                     if task.seconds is not None]
+            link = job.link
+            results.append(JobResult(
+                str(job.sketch), job.board, job.fingerprint,
+                str(self._build_root / link.name),
+                len([task for task in timed
+                     if (task is not link) and (task.error is None)]),
+                bool(link.result) if link.error is None else False,
+                min(task.started for task in timed) if timed else None,
+                link.started + link.seconds if link.seconds is not None
+                else None,
+                link.error))
+
+        critical_path, critical_seconds = self.get_critical_path(tasks)
+        return MatrixResult(results, cores, seconds, critical_path,
+                            critical_seconds)
+
+
+def write_json(result, afile):
+    json.dump(OrderedDict([
+        ("seconds", result.seconds),
+        ("cores", result.cores),
+        ("critical_seconds", result.critical_seconds),
+        ("critical_path", [
+            OrderedDict(zip(TaskTiming._fields, timing))
+            for timing in result.critical_path]),
+        ("jobs", [OrderedDict(zip(JobResult._fields, job))
+                  for job in result.jobs]),
+    ]), afile, indent=2)
+    afile.write("\n")
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prometheus-style metrics for upload operations.
+
+Metrics could be exported through a node_exporter textfile collector:
+
+    metrics.REGISTRY.write_textfile("/var/lib/node_exporter/ardumgr.prom")
+
+or served on a local HTTP endpoint by a long-running process:
+
+    metrics.start_http_server(9464)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+UPLOAD_LABELS = ("board", "cpu", "programmer", "port")
+
+
+def _escape(value):
+    return (str(value).replace("\\", r"\\").replace("\n", r"\n")
+            .replace('"', r'\"'))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+
+    if not pairs:
+        return ""
+
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+
+    type_name = "counter"
+
+    def __init__(self, name, help_, labelnames, lock):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._lock = lock
+        self._values = OrderedDict()
+
+    def inc(self, labels=(), value=1):
+        labels = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, labels=()):
+        return self._values.get(tuple(str(label) for label in labels), 0)
+
+    def expose(self):
+        for labels, value in self._values.items():
+            yield "%s%s %s" % (
+                self.name, _format_labels(self.labelnames, labels),
+                _format_value(value))
+
+
+class Histogram(object):
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_, labelnames, lock, buckets=None):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(
+            float(bound) for bound in (buckets or DEFAULT_BUCKETS))) + (
+            float("inf"),)
+        self._lock = lock
+        # labels -> [bucket counts..., sum, count]
+        self._values = OrderedDict()
+
+    def observe(self, labels, value):
+        labels = tuple(str(label) for label in labels)
+        with self._lock:
+            stat = self._values.get(labels)
+            if stat is None:
+                stat = self._values[labels] = [0] * len(self.buckets) + [
+                    0.0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    stat[i] += 1
+
+            stat[-2] += value
+            stat[-1] += 1
+
+    def get_count(self, labels=()):
+        stat = self._values.get(tuple(str(label) for label in labels))
+        return 0 if stat is None else stat[-1]
+
+    def expose(self):
+        for labels, stat in self._values.items():
+            for i, bound in enumerate(self.buckets):
+                yield "%s_bucket%s %s" % (
+                    self.name,
+                    _format_labels(self.labelnames, labels,
+                                   ("le", _format_value(bound))),
+                    stat[i])
+
+            formatted_labels = _format_labels(self.labelnames, labels)
+            yield "%s_sum%s %s" % (
+                self.name, formatted_labels, _format_value(stat[-2]))
+            yield "%s_count%s %s" % (self.name, formatted_labels, stat[-1])
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = OrderedDict()
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError("Metric \"%s\" already registered!" % metric.name)
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_, labelnames=()):
+        return self._register(Counter(name, help_, labelnames, self._lock))
+
+    def histogram(self, name, help_, labelnames=(), buckets=None):
+        return self._register(
+            Histogram(name, help_, labelnames, self._lock, buckets))
+
+    def expose(self):
+        """
+        Return all metrics in Prometheus text exposition format
+        """
+
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append("# HELP %s %s" % (metric.name, metric.help))
+                lines.append("# TYPE %s %s" % (metric.name, metric.type_name))
+                lines.extend(metric.expose())
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """
+        Write metrics for node_exporter's textfile collector.
+
+        The file is replaced atomically, so the collector never reads a
+        partial file.
+        """
+
+        path = str(path)
+        temp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(temp_path, "w") as afile:
+            afile.write(self.expose())
+
+        os.replace(temp_path, path)
+
+
+REGISTRY = Registry()
+
+upload_duration = REGISTRY.histogram(
+    "ardumgr_upload_duration_seconds",
+    "Duration of upload tool invocations in seconds",
+    UPLOAD_LABELS)
+
+upload_exit_codes = REGISTRY.counter(
+    "ardumgr_upload_exit_codes_total",
+    "Upload tool invocations by exit code",
+    UPLOAD_LABELS + ("code",))
+
+upload_retries = REGISTRY.counter(
+    "ardumgr_upload_retries_total",
+    "Upload retries after a failed invocation",
+    UPLOAD_LABELS)
+
+upload_bytes = REGISTRY.counter(
+    "ardumgr_upload_bytes_total",
+    "Bytes of binary image flashed successfully",
+    UPLOAD_LABELS)
+
+
+def start_http_server(port, addr="127.0.0.1", registry=REGISTRY):
+    """
+    Serve metrics on http://addr:port/metrics from a daemon thread
+
+    @return The HTTPServer object, call shutdown() to stop it
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = registry.expose().encode("utf-8")
+            self.send_response(200)
+            self.send_header(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((addr, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
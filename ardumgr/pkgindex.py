@@ -0,0 +1,601 @@
+# -*- coding: utf-8 -*-
+
+"""
+Search index of Boards Manager package index files.
+
+package_index.json and third party package_*_index.json files in the
+user directory are parsed incrementally: only one platform or tool entry
+is decoded at a time, so memory stays bounded whatever the file size.
+Entries are stored in a SQLite file, files are only parsed again if their
+size or modification time changed:
+
+    index = PackageIndex.for_manager(manager)
+    index.find_boards("Uno")
+    index.get_tool_dependencies("arduino", "avr")
+"""
+
+import re
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from collections import namedtuple
+from .exceptions import ArduMgrError
+
+INDEX_FILE_PATTERN = "package_*index.json"
+
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    name TEXT,
+    maintainer TEXT,
+    website_url TEXT,
+    email TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_file ON packages (file);
+CREATE TABLE IF NOT EXISTS platforms (
+    id INTEGER PRIMARY KEY,
+    package_id INTEGER NOT NULL REFERENCES packages ON DELETE CASCADE,
+    architecture TEXT NOT NULL,
+    version TEXT NOT NULL,
+    name TEXT,
+    category TEXT,
+    url TEXT,
+    archive_name TEXT,
+    checksum TEXT,
+    size INTEGER,
+    version_rank INTEGER NOT NULL DEFAULT 0,
+    latest INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS platforms_package ON platforms (
+    package_id, architecture);
+CREATE INDEX IF NOT EXISTS platforms_latest ON platforms (latest);
+CREATE TABLE IF NOT EXISTS boards (
+    platform_id INTEGER NOT NULL REFERENCES platforms ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boards_platform ON boards (platform_id);
+CREATE INDEX IF NOT EXISTS boards_name ON boards (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS tool_dependencies (
+    platform_id INTEGER NOT NULL REFERENCES platforms ON DELETE CASCADE,
+    packager TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tool_dependencies_platform ON tool_dependencies (
+    platform_id);
+CREATE TABLE IF NOT EXISTS tools (
+    id INTEGER PRIMARY KEY,
+    package_id INTEGER NOT NULL REFERENCES packages ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tools_package ON tools (package_id, name);
+CREATE TABLE IF NOT EXISTS tool_systems (
+    tool_id INTEGER NOT NULL REFERENCES tools ON DELETE CASCADE,
+    host TEXT NOT NULL,
+    url TEXT,
+    archive_name TEXT,
+    checksum TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS tool_systems_tool ON tool_systems (tool_id);
+"""
+
+_TABLES = ("tool_systems", "tools", "tool_dependencies", "boards",
+           "platforms", "packages", "files")
+
+IndexedPlatform = namedtuple("IndexedPlatform", [
+    "package", "architecture", "version", "name", "category", "url",
+    "archive_name", "checksum", "size"])
+
+Board = namedtuple("Board", ["name", "package", "architecture", "version"])
+
+ToolDependency = namedtuple(
+    "ToolDependency", ["packager", "name", "version"])
+
+ToolSystem = namedtuple(
+    "ToolSystem", ["host", "url", "archive_name", "checksum", "size"])
+
+_WHITESPACES = " \t\r\n"
+
+_VERSION_PART_REGEXP = re.compile(r"(\d+)|([^\d.+-]+)")
+
+
+def version_key(version):
+    """
+    Sort key of semantic versions, numeric parts compare as numbers,
+    pre-releases (for ex: "1.0.0-rc1") sort before their release
+    """
+
+    release, sep, prerelease = version.partition("-")
+    parts = [
+        (int(number), "") if number else (-1, text)
+        for number, text in _VERSION_PART_REGEXP.findall(release)]
+    return (parts, 0 if sep else 1, prerelease)
+
+
+class JsonStream(object):
+    """
+    Incremental reader of a JSON document, values are decoded one at a
+    time with json.JSONDecoder.raw_decode().
+    """
+
+    def __init__(self, fp, chunk_size=64 * 1024, name=None):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._name = name or getattr(fp, "name", "<stream>")
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _error(self, message):
+        return ArduMgrError("%s in %s!" % (message, self._name))
+
+    def _fill(self):
+        """
+        Append a chunk to the buffer, drop consumed text
+
+        @return False if at end of file
+        """
+
+        if self._eof:
+            return False
+
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """
+        @return Next non-whitespace character, "" at end of file
+        """
+
+        while True:
+            buffer = self._buffer
+            pos = self._pos
+            size = len(buffer)
+            while (pos < size) and (buffer[pos] in _WHITESPACES):
+                pos += 1
+
+            self._pos = pos
+            if pos < size:
+                return buffer[pos]
+
+            if not self._fill():
+                return ""
+
+    def _next(self):
+        char = self.peek()
+        if not char:
+            raise self._error("Unexpected end of file")
+
+        self._pos += 1
+        return char
+
+    def _expect(self, expected):
+        char = self._next()
+        if char != expected:
+            raise self._error("Expected \"%s\" but got \"%s\"" % (
+                expected, char))
+
+    def decode(self):
+        """
+        Decode the next value
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(
+                    self._buffer, self._pos)
+            except ValueError:
+                # Value not complete in buffer yet
+                if not self._fill():
+                    raise self._error("Invalid JSON")
+
+                continue
+
+            # Numbers may continue in the next chunk
+            if (end == len(self._buffer)) and self._fill():
+                continue
+
+            self._pos = end
+            return value
+
+    skip = decode
+
+    def iter_array(self):
+        """
+        Iterate elements of the next array, the caller must decode(),
+        skip() or iterate each element before advancing
+        """
+
+        self._expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield
+
+            char = self._next()
+            if char == "]":
+                return
+
+            if char != ",":
+                raise self._error("Expected \",\" but got \"%s\"" % char)
+
+    def iter_object(self):
+        """
+        Iterate keys of the next object, the caller must consume the value
+        of each key before advancing
+        """
+
+        self._expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self.decode()
+            self._expect(":")
+            yield key
+
+            char = self._next()
+            if char == "}":
+                return
+
+            if char != ",":
+                raise self._error("Expected \",\" but got \"%s\"" % char)
+
+
+def _stat(path):
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+class PackageIndex(object):
+    """
+    SQLite index of package index files.
+    """
+
+    def __init__(self, paths, db_path):
+        """
+        @arg paths Package index files, later files don't override earlier
+        ones, all packages are indexed
+        """
+
+        self._paths = [Path(str(apath)) for apath in paths]
+        self._db_path = str(db_path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self._db_path, check_same_thread=False, isolation_level=None)
+        self._init_schema()
+        self.update()
+
+    @classmethod
+    def for_manager(cls, manager, db_path=None):
+        """
+        Index of package index files in user directory of manager
+        """
+
+        paths = sorted(manager.user_dir.glob(INDEX_FILE_PATTERN))
+        if db_path is None:
+            cache_dir = manager.cache_dir
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            db_path = cache_dir / "package-index.sqlite"
+
+        return cls(paths, db_path)
+
+    def _init_schema(self):
+        connection = self._connection
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != _SCHEMA_VERSION:
+            for table in _TABLES:
+                connection.execute("DROP TABLE IF EXISTS %s" % table)
+
+            connection.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+
+        connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def update(self, force=False):
+        """
+        Parse changed, new files again, drop entries of removed files
+
+        @return Paths of parsed files
+        """
+
+        current = dict()
+        for apath in self._paths:
+            if apath.exists():
+                current[str(apath)] = _stat(apath)
+
+        with self._lock:
+            connection = self._connection
+            indexed = dict(
+                (path, (size, mtime)) for path, size, mtime in
+                connection.execute("SELECT path, size, mtime FROM files"))
+
+            changed = [
+                path for path in sorted(current)
+                if force or (indexed.get(path) != current[path])]
+            removed = [path for path in indexed if path not in current]
+            if not (changed or removed):
+                return []
+
+            connection.execute("BEGIN")
+            try:
+                for path in removed + changed:
+                    connection.execute(
+                        "DELETE FROM packages WHERE file = ?", (path,))
+                    connection.execute(
+                        "DELETE FROM files WHERE path = ?", (path,))
+
+                for path in changed:
+                    with open(path, encoding="utf-8") as index_file:
+                        self._ingest(JsonStream(index_file), path)
+
+                    connection.execute(
+                        "INSERT INTO files (path, size, mtime) "
+                        "VALUES (?, ?, ?)", (path,) + current[path])
+
+                self._rank_versions()
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+        return changed
+
+    def _rank_versions(self):
+        """
+        Store the order of versions of each platform, so queries sort and
+        pick latest versions in SQL instead of comparing versions in Python
+        """
+
+        connection = self._connection
+        rows = connection.execute(
+            "SELECT p.id, k.name, p.architecture, p.version FROM platforms p "
+            "JOIN packages k ON p.package_id = k.id").fetchall()
+        rows.sort(key=lambda row: (row[1], row[2], version_key(row[3])))
+
+        ranks = []
+        for i, (id_, package, architecture, _) in enumerate(rows):
+            following = rows[i + 1] if i + 1 < len(rows) else None
+            latest = (following is None) or (
+                following[1:3] != (package, architecture))
+            ranks.append((i, int(latest), id_))
+
+        connection.executemany(
+            "UPDATE platforms SET version_rank = ?, latest = ? WHERE id = ?",
+            ranks)
+
+    def _ingest(self, stream, path):
+        for key in stream.iter_object():
+            if key != "packages":
+                stream.skip()
+                continue
+
+            for _ in stream.iter_array():
+                self._ingest_package(stream, path)
+
+    def _ingest_package(self, stream, path):
+        connection = self._connection
+        package_id = connection.execute(
+            "INSERT INTO packages (file) VALUES (?)", (path,)).lastrowid
+
+        fields = {
+            "name": "name",
+            "maintainer": "maintainer",
+            "websiteURL": "website_url",
+            "email": "email",
+        }
+        for key in stream.iter_object():
+            if key == "platforms":
+                for _ in stream.iter_array():
+                    self._ingest_platform(package_id, stream.decode())
+            elif key == "tools":
+                for _ in stream.iter_array():
+                    self._ingest_tool(package_id, stream.decode())
+            elif key in fields:
+                # Key order is not guaranteed, platforms may come first
+                connection.execute(
+                    "UPDATE packages SET %s = ? WHERE id = ?" % fields[key],
+                    (stream.decode(), package_id))
+            else:
+                stream.skip()
+
+    def _ingest_platform(self, package_id, entry):
+        connection = self._connection
+        platform_id = connection.execute(
+            "INSERT INTO platforms (package_id, architecture, version, name, "
+            "category, url, archive_name, checksum, size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                package_id, entry["architecture"], entry["version"],
+                entry.get("name"), entry.get("category"), entry.get("url"),
+                entry.get("archiveFileName"), entry.get("checksum"),
+                entry.get("size"))).lastrowid
+
+        connection.executemany(
+            "INSERT INTO boards (platform_id, name) VALUES (?, ?)",
+            [(platform_id, board["name"])
+             for board in entry.get("boards", [])])
+        connection.executemany(
+            "INSERT INTO tool_dependencies (platform_id, packager, name, "
+            "version) VALUES (?, ?, ?, ?)",
+            [(platform_id, dependency["packager"], dependency["name"],
+              dependency["version"])
+             for dependency in entry.get("toolsDependencies", [])])
+
+    def _ingest_tool(self, package_id, entry):
+        connection = self._connection
+        tool_id = connection.execute(
+            "INSERT INTO tools (package_id, name, version) VALUES (?, ?, ?)",
+            (package_id, entry["name"], entry["version"])).lastrowid
+
+        connection.executemany(
+            "INSERT INTO tool_systems (tool_id, host, url, archive_name, "
+            "checksum, size) VALUES (?, ?, ?, ?, ?, ?)",
+            [(tool_id, system["host"], system.get("url"),
+              system.get("archiveFileName"), system.get("checksum"),
+              system.get("size"))
+             for system in entry.get("systems", [])])
+
+    @property
+    def counts(self):
+        """
+        @return A dict of table name to count of rows
+        """
+
+        return dict(
+            (table, self._execute("SELECT COUNT(*) FROM %s" % table)[0][0])
+            for table in _TABLES if table != "files")
+
+    def _find_platform_id(self, package, architecture, version=None):
+        sql = (
+            "SELECT p.id FROM platforms p "
+            "JOIN packages k ON p.package_id = k.id "
+            "WHERE k.name = ? AND p.architecture = ?")
+        parameters = (package, architecture)
+        if version is None:
+            sql += " AND p.latest = 1"
+        else:
+            sql += " AND p.version = ?"
+            parameters += (version,)
+
+        rows = self._execute(
+            sql + " ORDER BY p.version_rank DESC LIMIT 1", parameters)
+        if not rows:
+            raise ArduMgrError("Platform %s:%s%s not found in index!" % (
+                package, architecture,
+                "" if version is None else "@%s" % version))
+
+        return rows[0][0]
+
+    def get_platforms(self, package=None, all_versions=False):
+        """
+        @arg all_versions False to return the latest version of each
+        platform only
+        @return A list of IndexedPlatform sorted by package and architecture
+        """
+
+        sql = (
+            "SELECT k.name, p.architecture, p.version, p.name, p.category, "
+            "p.url, p.archive_name, p.checksum, p.size FROM platforms p "
+            "JOIN packages k ON p.package_id = k.id")
+        conditions = []
+        parameters = ()
+        if package is not None:
+            conditions.append("k.name = ?")
+            parameters = (package,)
+
+        if not all_versions:
+            conditions.append("p.latest = 1")
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        # Ranks are ordered by package, architecture then version
+        return [IndexedPlatform(*row) for row in self._execute(
+            sql + " ORDER BY p.version_rank", parameters)]
+
+    def get_platform(self, package, architecture, version=None):
+        """
+        @arg version None for the latest version
+        """
+
+        platform_id = self._find_platform_id(package, architecture, version)
+        row = self._execute(
+            "SELECT k.name, p.architecture, p.version, p.name, p.category, "
+            "p.url, p.archive_name, p.checksum, p.size FROM platforms p "
+            "JOIN packages k ON p.package_id = k.id WHERE p.id = ?",
+            (platform_id,))[0]
+        return IndexedPlatform(*row)
+
+    def find_boards(self, name, all_versions=False):
+        """
+        Find platforms provide boards whose names contain name, case
+        insensitive
+
+        @arg all_versions False to only search the latest version of each
+        platform
+        @return A list of Board
+        """
+
+        if all_versions:
+            sql = "FROM boards b JOIN platforms p ON b.platform_id = p.id "
+        else:
+            # Boards of latest platforms only, looked up by platform
+            sql = (
+                "FROM platforms p CROSS JOIN boards b "
+                "ON b.platform_id = p.id AND p.latest = 1 ")
+
+        rows = self._execute(
+            "SELECT b.name, k.name, p.architecture, p.version " + sql +
+            "JOIN packages k ON p.package_id = k.id "
+            "WHERE b.name LIKE ? ESCAPE '\\' "
+            "ORDER BY p.version_rank, b.name", (
+                "%%%s%%" % re.sub(r"([%_\\])", r"\\\1", name),))
+        return [Board(*row) for row in rows]
+
+    def get_boards(self, package, architecture, version=None):
+        """
+        @return Names of boards provided by a platform
+        """
+
+        platform_id = self._find_platform_id(package, architecture, version)
+        return [row[0] for row in self._execute(
+            "SELECT name FROM boards WHERE platform_id = ? ORDER BY rowid",
+            (platform_id,))]
+
+    def get_tool_dependencies(self, package, architecture, version=None):
+        """
+        @return A list of ToolDependency of a platform
+        """
+
+        platform_id = self._find_platform_id(package, architecture, version)
+        return [ToolDependency(*row) for row in self._execute(
+            "SELECT packager, name, version FROM tool_dependencies "
+            "WHERE platform_id = ? ORDER BY rowid", (platform_id,))]
+
+    def get_tool_systems(self, packager, name, version):
+        """
+        @return A list of ToolSystem, downloads of a tool for each host
+        """
+
+        return [ToolSystem(*row) for row in self._execute(
+            "SELECT s.host, s.url, s.archive_name, s.checksum, s.size "
+            "FROM tool_systems s JOIN tools t ON s.tool_id = t.id "
+            "JOIN packages k ON t.package_id = k.id "
+            "WHERE k.name = ? AND t.name = ? AND t.version = ? "
+            "ORDER BY s.rowid", (packager, name, version))]
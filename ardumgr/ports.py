@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+Serial ports enumeration and leasing.
+
+Ports are enumerated from sysfs (/sys/class/tty) without udev, USB ports
+carry their vendor and product ids, which are matched against
+"boards.<id>.vid.N"/"boards.<id>.pid.N" of a platform.
+
+A PortPool caches the enumeration, leases ports to concurrent uploads:
+
+    pool = PortPool()
+    with pool.lease(platform, "uno") as port:
+        programmer = Programmer(
+            platform, {"ardumgr.serial_port": port.device})
+"""
+
+import os
+import re
+import time
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from .exceptions import ArduMgrError
+
+SerialPort = namedtuple("SerialPort", [
+    "device", "name", "vid", "pid", "serial_number", "manufacturer",
+    "product", "location"])
+SerialPort.__doc__ = """
+A serial device.
+
+device: device node path, for ex: /dev/ttyACM0
+vid, pid: lower case hex strings with "0x" prefix just like boards.txt,
+          None for non USB ports
+location: USB bus path, for ex: 1-1.2
+"""
+
+_BOARD_ID_REGEXP = re.compile(r"^boards\.([^.]+)\.(vid|pid)\.(\d+)$")
+
+# Levels to search USB device attributes above the tty device
+_USB_SEARCH_DEPTH = 3
+
+
+class PortLeaseTimeout(ArduMgrError):
+    pass
+
+
+def _read_attr(adir, name):
+    try:
+        with open(os.path.join(adir, name)) as afile:
+            return afile.read().strip()
+    except OSError:
+        return None
+
+
+def _find_usb_device(device_dir):
+    adir = device_dir
+    for _ in range(_USB_SEARCH_DEPTH):
+        if os.path.exists(os.path.join(adir, "idVendor")):
+            return adir
+
+        adir = os.path.dirname(adir)
+
+    return None
+
+
+def _normalize_id(value):
+    """
+    Normalize vid/pid to "0x" prefixed lower case hex
+    """
+
+    value = value.strip().lower()
+    if not value.startswith("0x"):
+        value = "0x" + value
+
+    return value
+
+
+def get_port(name, sysfs_root="/sys", dev_root="/dev"):
+    """
+    @return SerialPort of a tty, or None if it has no backing device
+    """
+
+    device_link = os.path.join(sysfs_root, "class", "tty", name, "device")
+    if not os.path.exists(device_link):
+        return None
+
+    device_dir = os.path.realpath(device_link)
+    usb_dir = _find_usb_device(device_dir)
+    if usb_dir is None:
+        # Legacy 8250 ports are always present even without hardware
+        if name.startswith("ttyS"):
+            return None
+
+        return SerialPort(os.path.join(dev_root, name), name, None, None,
+                          None, None, None, None)
+
+    vid = _read_attr(usb_dir, "idVendor")
+    pid = _read_attr(usb_dir, "idProduct")
+    if (vid is None) or (pid is None):
+        # Unplugged while enumerating
+        return None
+
+    return SerialPort(
+        os.path.join(dev_root, name),
+        name,
+        _normalize_id(vid),
+        _normalize_id(pid),
+        _read_attr(usb_dir, "serial"),
+        _read_attr(usb_dir, "manufacturer"),
+        _read_attr(usb_dir, "product"),
+        os.path.basename(usb_dir))
+
+
+def _list_ttys(sysfs_root):
+    try:
+        return sorted(os.listdir(os.path.join(sysfs_root, "class", "tty")))
+    except OSError:
+        return []
+
+
+def enumerate_ports(sysfs_root="/sys", dev_root="/dev"):
+    """
+    @return A list of SerialPort sorted by name
+    """
+
+    ports = []
+    for name in _list_ttys(sysfs_root):
+        port = get_port(name, sysfs_root, dev_root)
+        if port is not None:
+            ports.append(port)
+
+    return ports
+
+
+def get_board_ids(platform):
+    """
+    @return A dict of (vid, pid) to list of board ids of a platform
+    """
+
+    ids = dict()
+    for akey in platform.cfgs.keys():
+        matched = _BOARD_ID_REGEXP.match(akey)
+        if matched is not None:
+            board, kind, index = matched.groups()
+            ids.setdefault((board, index), dict())[kind] = _normalize_id(
+                platform.cfgs[akey])
+
+    boards = dict()
+    for (board, _), pair in sorted(ids.items()):
+        if ("vid" in pair) and ("pid" in pair):
+            usb_id = (pair["vid"], pair["pid"])
+            boards.setdefault(usb_id, [])
+            if board not in boards[usb_id]:
+                boards[usb_id].append(board)
+
+    return boards
+
+
+class PortPool(object):
+    """
+    Cached serial ports enumeration, and leases of ports.
+
+    The enumeration is refreshed at most every interval seconds, and only if
+    ttys in sysfs changed.
+    """
+
+    def __init__(self, sysfs_root="/sys", dev_root="/dev", interval=1.0):
+        self._sysfs_root = sysfs_root
+        self._dev_root = dev_root
+        self._interval = interval
+        self._condition = threading.Condition()
+        self._ports = None
+        self._ttys = None
+        self._checked = 0.0
+        self._leased = set()
+        # platform id -> board ids by (vid, pid)
+        self._board_ids = dict()
+
+    def refresh(self, force=False):
+        with self._condition:
+            now = time.monotonic()
+            if (not force) and (self._ports is not None) and (
+                    now - self._checked < self._interval):
+                return
+
+            self._checked = now
+            ttys = _list_ttys(self._sysfs_root)
+            if force or (ttys != self._ttys):
+                self._ttys = ttys
+                self._ports = enumerate_ports(
+                    self._sysfs_root, self._dev_root)
+
+    @property
+    def ports(self):
+        self.refresh()
+        return list(self._ports)
+
+    def _get_board_ids(self, platform):
+        board_ids = self._board_ids.get(platform.id_)
+        if board_ids is None:
+            board_ids = self._board_ids[platform.id_] = get_board_ids(
+                platform)
+
+        return board_ids
+
+    def get_boards(self, platform, port):
+        """
+        @return Ids of boards match a port
+        """
+
+        return list(self._get_board_ids(platform).get(
+            (port.vid, port.pid), []))
+
+    def find_ports(self, platform, board):
+        """
+        @return Ports whose USB ids match a board
+        """
+
+        return [
+            port for port in self.ports
+            if board in self.get_boards(platform, port)]
+
+    @property
+    def leased(self):
+        with self._condition:
+            return set(self._leased)
+
+    def acquire(self, platform=None, board=None, device=None, timeout=None):
+        """
+        Lease a free port of a board, or a specific device
+
+        @arg timeout Seconds to wait for a free port, None to wait forever
+        @return The leased SerialPort
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if device is not None:
+                    ports = [
+                        port for port in self.ports if port.device == device]
+                else:
+                    ports = self.find_ports(platform, board)
+
+                if not ports:
+                    raise ArduMgrError("No serial port found for %s!" % (
+                        device or board))
+
+                for port in ports:
+                    if port.device not in self._leased:
+                        self._leased.add(port.device)
+                        return port
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PortLeaseTimeout(
+                            "All serial ports of %s are busy!" % (
+                                device or board))
+
+                self._condition.wait(remaining)
+
+    def release(self, port):
+        with self._condition:
+            self._leased.discard(port.device)
+            self._condition.notify_all()
+
+    @contextmanager
+    def lease(self, platform=None, board=None, device=None, timeout=None):
+        port = self.acquire(platform, board, device, timeout)
+        try:
+            yield port
+        finally:
+            self.release(port)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timing and counting instrumentation for hot paths.
+
+Instrumentation is disabled by default, instrumented code only checks
+whether `active` is None before doing anything:
+
+    from ardumgr import profiling
+
+    profiler = profiling.enable()
+    profiler.add_hook(lambda kind, name, value: print(kind, name, value))
+    ...
+    print(profiler.format_table())
+    profiling.disable()
+"""
+
+import json
+import time
+import functools
+from contextlib import contextmanager
+from collections import OrderedDict
+
+# The enabled profiler, None if profiling disabled
+active = None
+
+
+class Profiler(object):
+
+    def __init__(self):
+        # name -> [calls, total seconds, max seconds]
+        self._timers = OrderedDict()
+        self._counters = OrderedDict()
+        self._hooks = []
+
+    clock = staticmethod(time.perf_counter)
+
+    def add_hook(self, callback):
+        """
+        Register a callback(kind, name, value) invoked on every record.
+
+        kind is "timer" with elapsed seconds as value, or "counter" with the
+        increment as value.
+        """
+
+        self._hooks.append(callback)
+
+    def remove_hook(self, callback):
+        self._hooks.remove(callback)
+
+    def count(self, name, value=1):
+        self._counters[name] = self._counters.get(name, 0) + value
+        for callback in self._hooks:
+            callback("counter", name, value)
+
+    def record(self, name, started):
+        """
+        Record a timer which started at `started` (from clock())
+        """
+
+        elapsed = self.clock() - started
+        stat = self._timers.get(name)
+        if stat is None:
+            stat = self._timers[name] = [0, 0.0, 0.0]
+
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+
+        for callback in self._hooks:
+            callback("timer", name, elapsed)
+
+    @contextmanager
+    def timer(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def reset(self):
+        self._timers = OrderedDict()
+        self._counters = OrderedDict()
+
+    def summary(self):
+        timers = OrderedDict()
+        for name, (calls, total, max_) in self._timers.items():
+            timers[name] = OrderedDict([
+                ("calls", calls),
+                ("total", total),
+                ("max", max_),
+            ])
+
+        return OrderedDict([
+            ("timers", timers),
+            ("counters", OrderedDict(self._counters)),
+        ])
+
+    def format_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def format_table(self):
+        lines = []
+
+        names = list(self._timers.keys()) + list(self._counters.keys())
+        width = max([len(name) for name in names] + [len("Timer")]) + 4
+
+        if self._timers:
+            lines.append("%s%10s%12s%12s" % (
+                "Timer".ljust(width), "Calls", "Total(ms)", "Max(ms)"))
+            for name, (calls, total, max_) in self._timers.items():
+                lines.append("%s%10d%12.3f%12.3f" % (
+                    name.ljust(width), calls, total * 1000, max_ * 1000))
+
+        if self._counters:
+            if lines:
+                lines.append("")
+
+            lines.append("%s%10s" % ("Counter".ljust(width), "Value"))
+            for name, value in self._counters.items():
+                lines.append("%s%10d" % (name.ljust(width), value))
+
+        return "\n".join(lines)
+
+
+def enable(profiler=None):
+    """
+    Enable profiling, return the active profiler
+    """
+
+    global active
+
+    if profiler is None:
+        profiler = Profiler()
+
+    active = profiler
+    return profiler
+
+
+def disable():
+    """
+    Disable profiling, return the profiler which was active
+    """
+
+    global active
+
+    profiler = active
+    active = None
+    return profiler
+
+
+def timed(name):
+    """
+    Decorator which records the elapsed time of each call when profiling
+    enabled
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = active
+            if profiler is None:
+                return func(*args, **kwargs)
+
+            started = profiler.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, started)
+
+        return wrapper
+
+    return decorator
@@ -1,8 +1,19 @@
+import sys
+import time
 import subprocess
 import os.path
 from pathlib import Path
+from collections import OrderedDict
 from .exceptions import ArduMgrError
-from .configs import ConfigsMgr
+from .configs import ConfigsMgr, OS_SUFFIXES
+from .export import read_export
+from .image import Image
+from .stk500 import Stk500Uploader, PAGE_SIZES
+from . import profiling
+from . import metrics
+
+# Granularity of comparing dumps of MCUs without known page sizes
+_DEFAULT_PAGE_SIZE = 256
 
 
 class Programmer(object):
@@ -14,7 +25,8 @@ class Programmer(object):
     3. Board configuration change or reading
     """
 
-    def __init__(self, platform):
+    @profiling.timed("programmer.init")
+    def __init__(self, platform, preferences=None):
         """
         You must predefined these preferences before create a programmer
         (for ex):
@@ -30,42 +42,40 @@ class Programmer(object):
         board=mega
         custom_cpu=mega_atmega2560
         serial.port=/dev/ttyUSB0
+
+        Options of other board menus could be selected by preferences
+        "ardumgr.menu.<menu>=<option>" (for ex: ardumgr.menu.speed=16mhz),
+        "ardumgr.cpu" is the same as "ardumgr.menu.cpu". Menus without a
+        selected option use their first option, except the cpu menu.
+
+        @arg preferences Preferences only applied to this programmer, they
+        override preferences of the manager (for ex: a different board).
         """
 
         self._platform = platform
         self._cfgs = ConfigsMgr()
         self._cfgs.base_on(platform.cfgs)
+        if preferences:
+            self._cfgs.update(preferences)
 
         self._programmer = self._cfgs["ardumgr.programmer"]
         self._board = self._cfgs["ardumgr.board"]
-        self._cpu = self._cfgs["ardumgr.cpu"]
+        self._cpu = self._get_optional("ardumgr.cpu")
         self._serial_port = self._cfgs["ardumgr.serial_port"]
 
-        # Check if cpu related to specfic board
-        cpus = platform.get_board_supported_cpus(self._board)
-        if cpus:
-            if self._cpu is None:
-                raise ArduMgrError(
-                    "You must specific a cpu for board \"%s\"! Choice : %s" % (
-                        self._board, cpus))
-            elif self._cpu not in cpus:
-                raise ArduMgrError(
-                    "Board \"%s\" don't support cpu \"%s\"!" % (
-                        self._board, self._cpu))
-        elif self._cpu is not None:
-            raise ArduMgrError(
-                "Board have a default cpu, don't specfic it yourself!"
-                % self._board)
+        self._menus = self._resolve_menus()
+        self._cpu = self._menus.get("cpu")
 
-        # Find board and cpu specific configs and expand it to our platform
+        # Find board and menus specific configs and expand it to our platform
         key = "boards.%s" % self._board
         subtree = self._cfgs.get_subtree(key)
         self._cfgs.update(subtree)
 
-        if self._cpu:
-            key = "boards.%s.menu.cpu.%s" % (self._board, self._cpu)
+        for menu, option in self._menus.items():
+            key = "boards.%s.menu.%s.%s" % (self._board, menu, option)
             subtree = self._cfgs.get_subtree(key)
             self._cfgs.update(subtree)
+            self._cfgs["custom_%s" % menu] = "%s_%s" % (self._board, option)
 
         # Expand upload tool configs
         upload_tool = self._cfgs["upload.tool"]
@@ -76,6 +86,114 @@ class Programmer(object):
         subtree = self._cfgs.get_subtree("programmers.%s" % self._programmer)
         self._cfgs.update(subtree)
 
+    @classmethod
+    def from_export(cls, export, preferences=None):
+        """
+        Create a programmer from configs exported by
+        ardumgr.export.export_programmer(), without loading any platform.
+
+        @arg export Path of an export file, or the exported dict
+        @arg preferences Preferences override exported configs, for ex:
+        "ardumgr.serial_port"
+        """
+
+        if not isinstance(export, dict):
+            export = read_export(export)
+
+        base_cfgs = ConfigsMgr()
+        base_cfgs.update(export["configs"])
+
+        self = cls.__new__(cls)
+        self._platform = None
+        self._cfgs = ConfigsMgr()
+        self._cfgs.base_on(base_cfgs)
+        if preferences:
+            self._cfgs.update(preferences)
+
+        self._programmer = export["programmer"]
+        self._board = export["board"]
+        self._cpu = export["cpu"] or None
+        self._serial_port = self._cfgs["ardumgr.serial_port"]
+        self._menus = OrderedDict(export["menus"])
+        return self
+
+    def _get_optional(self, key):
+        if key in self._cfgs:
+            return self._cfgs[key] or None
+
+        return None
+
+    def _resolve_menus(self):
+        """
+        Validate selected menu options against the board's menus
+
+        @return A dict of menu id to selected option id in menu declaration
+        order
+        """
+
+        board_menus = self._platform.get_board_menus(self._board)
+
+        selected = self._cfgs.get_subtree("ardumgr.menu")
+        if self._cpu is not None:
+            selected.setdefault("cpu", self._cpu)
+
+        for menu, option in selected.items():
+            if menu not in board_menus:
+                if menu == "cpu":
+                    raise ArduMgrError(
+                        "Board \"%s\" have a default cpu, don't specfic it "
+                        "yourself!" % self._board)
+
+                raise ArduMgrError(
+                    "Board \"%s\" don't have menu \"%s\"! Choice : %s" % (
+                        self._board, menu, list(board_menus.keys())))
+
+            if option not in board_menus[menu]:
+                if menu == "cpu":
+                    raise ArduMgrError(
+                        "Board \"%s\" don't support cpu \"%s\"!" % (
+                            self._board, option))
+
+                raise ArduMgrError(
+                    "Board \"%s\" don't support option \"%s\" of menu "
+                    "\"%s\"! Choice : %s" % (
+                        self._board, option, menu,
+                        list(board_menus[menu].keys())))
+
+        menus = OrderedDict()
+        for menu, options in board_menus.items():
+            if menu in selected:
+                menus[menu] = selected[menu]
+            elif menu == "cpu":
+                raise ArduMgrError(
+                    "You must specific a cpu for board \"%s\"! Choice : %s" % (
+                        self._board, list(options.keys())))
+            else:
+                # Arduino IDE selects the first option by default
+                menus[menu] = next(iter(options.keys()))
+
+        return menus
+
+    @property
+    def platform(self):
+        """
+        Platform of this programmer, None if created from an export
+        """
+
+        return self._platform
+
+    @property
+    def cfgs(self):
+        return self._cfgs
+
+    @property
+    def menus(self):
+        """
+        Selected board menu options, a dict of menu id to option id
+        """
+
+        return OrderedDict(self._menus)
+
     def _generate_upload_pattern(self, build_path, project_name):
         cfgs = ConfigsMgr()
         cfgs.base_on(self._cfgs)
@@ -100,10 +218,226 @@ class Programmer(object):
 
         return cfgs.get_expanded("upload.pattern")
 
-    def upload(self, build_path=None, project_name=None):
-        pattern = self._generate_upload_pattern(build_path, project_name)
-        return subprocess.call(pattern, shell=True)
+    def expand_for_os(self, keys, oss=None, build_path=None,
+                      project_name=None):
+        """
+        Expand keys for several OSes in one pass, for ex: to generate upload
+        commands of all hosts on one build server. Parts shared by all OSes
+        are only expanded once.
+
+        @arg oss OS names, all supported OSes by default
+        @return An OrderedDict of OS -> OrderedDict of key -> expanded value
+        """
+
+        cfgs = ConfigsMgr()
+        cfgs.base_on(self._cfgs)
+
+        if build_path is not None:
+            cfgs["build.path"] = build_path
+
+        if project_name is not None:
+            cfgs["build.project_name"] = project_name
+
+        if oss is None:
+            oss = OS_SUFFIXES
+
+        return cfgs.expand_for_os(keys, oss)
+
+    def _call_upload_tool(self, pattern):
+        profiler = profiling.active
+        if profiler is None:
+            return subprocess.call(pattern, shell=True)
+
+        with profiler.timer("programmer.upload.subprocess"):
+            return subprocess.call(pattern, shell=True)
+
+    def get_native_uploader(self):
+        """
+        @return A Stk500Uploader if preference "ardumgr.native_upload" is
+        enabled and the board uploads through avrdude with protocol
+        "arduino", otherwise None
+        """
+
+        native_upload = self._get_optional("ardumgr.native_upload")
+        if (native_upload is None) or (
+                native_upload.strip().lower() not in ("true", "yes", "1")):
+            return None
+
+        # Boards with MCUs unknown to the native uploader keep using avrdude
+        if ("build.mcu" not in self._cfgs) or (
+                self._cfgs.get_expanded("build.mcu") not in PAGE_SIZES):
+            return None
+
+        return self._get_stk500_uploader()
+
+    def _get_stk500_uploader(self):
+        if (self._get_optional("upload.tool") != "avrdude") or (
+                self._get_optional("upload.protocol") != "arduino"):
+            return None
+
+        return Stk500Uploader.from_cfgs(self._cfgs)
+
+    def _require_stk500_uploader(self):
+        uploader = self._get_stk500_uploader()
+        if uploader is None:
+            raise ArduMgrError(
+                "Reading flash requires an STK500v1 bootloader "
+                "(\"upload.protocol=arduino\")!")
+
+        return uploader
+
+    def dump(self, start=0, length=None):
+        """
+        Read flash of the board through its bootloader, does not need
+        preference "ardumgr.native_upload"
+
+        @arg length Bytes to read, defaults to "upload.maximum_size"
+        @return An Image of the flash contents
+        """
+
+        return self._require_stk500_uploader().dump(start, length)
+
+    def verify_bin(self, binary_file_path, dump=None, hash_only=False):
+        """
+        Check flash contents against an image, pages covered by the image
+        are read back once and compared in memory.
+
+        @arg dump Path of a previous dump, compared instead of reading the
+        board
+        @arg hash_only Only compare digests of page ranges
+        @return A list of (start, end) of mismatched ranges, empty if the
+        flash matches
+        """
+
+        image = self.check_image(binary_file_path)
+        if dump is None:
+            return self._require_stk500_uploader().verify_image(
+                image, hash_only)
+
+        if not os.path.exists(str(dump)):
+            raise ArduMgrError("Dump \"%s\" not found!" % dump)
+
+        mcu = self._get_optional("build.mcu")
+        page_size = PAGE_SIZES.get(mcu, _DEFAULT_PAGE_SIZE)
+        return image.compare(Image.load(dump), page_size, hash_only)
+
+    def _call_native_uploader(self, uploader, image):
+        profiler = profiling.active
+        try:
+            if profiler is None:
+                uploader.upload(image)
+            else:
+                with profiler.timer("programmer.upload.native"):
+                    uploader.upload(image)
+        except (ArduMgrError, OSError) as e:
+            # Failed like an upload tool, so retries and metrics still apply
+            sys.stderr.write("%s\n" % e)
+            return 1
+
+        return 0
+
+    @property
+    def metric_labels(self):
+        """
+        Labels used for upload metrics: board, cpu, programmer and port
+        """
+
+        return (self._board, self._cpu or "", self._programmer,
+                self._serial_port)
+
+    def _get_upload_retries(self):
+        key = "ardumgr.upload_retries"
+        if key in self._cfgs:
+            return int(self._cfgs[key] or 0)
+
+        return 0
+
+    def upload(self, build_path=None, project_name=None, retries=None):
+        """
+        Upload {build.path}/{build.project_name} to the board.
+
+        @arg retries Count of retries after the upload tool failed, defaults
+        to preference "ardumgr.upload_retries" or 0.
+        @return Exit code of the upload tool
+        """
+
+        image_path = self._find_image(build_path, project_name)
+        return self._upload(build_path, project_name, image_path, retries)
+
+    @staticmethod
+    def _find_image(build_path, project_name):
+        if (build_path is None) or (project_name is None):
+            return None
+
+        for suffix in (".hex", ".bin"):
+            apath = Path(str(build_path)) / (project_name + suffix)
+            if apath.exists():
+                return apath
+
+        return None
+
+    def _record_upload_attempt(self, attempt, started, exit_code):
+        labels = self.metric_labels
+        if attempt > 0:
+            metrics.upload_retries.inc(labels)
+
+        metrics.upload_duration.observe(labels, time.monotonic() - started)
+        metrics.upload_exit_codes.inc(labels + (exit_code,))
+
+    def check_image(self, image_path):
+        """
+        Load an image and check it against "upload.maximum_size" of the
+        board
+
+        @return The loaded Image, or None if image_path is None
+        """
+
+        if image_path is None:
+            return None
+
+        if not os.path.exists(str(image_path)):
+            raise ArduMgrError("Image \"%s\" not found!" % image_path)
+
+        image = Image.load(image_path)
+        if "upload.maximum_size" in self._cfgs:
+            image.check_size(self._cfgs["upload.maximum_size"])
+
+        return image
+
+    def _record_upload_result(self, exit_code, image):
+        if (exit_code == 0) and (image is not None):
+            metrics.upload_bytes.inc(self.metric_labels, image.size)
+
+    def _upload(self, build_path, project_name, image_path, retries):
+        image = self.check_image(image_path)
+        uploader = self.get_native_uploader()
+        if uploader is None:
+            pattern = self._generate_upload_pattern(build_path, project_name)
+
+            def call():
+                return self._call_upload_tool(pattern)
+        elif image is None:
+            raise ArduMgrError("No image found for native upload!")
+        else:
+            def call():
+                return self._call_native_uploader(uploader, image)
+
+        if retries is None:
+            retries = self._get_upload_retries()
+
+        for attempt in range(retries + 1):
+            started = time.monotonic()
+            exit_code = call()
+            self._record_upload_attempt(attempt, started, exit_code)
+
+            if exit_code == 0:
+                break
+
+        self._record_upload_result(exit_code, image)
+
+        return exit_code
 
-    def upload_bin(self, binary_file_path):
+    def upload_bin(self, binary_file_path, retries=None):
         path = Path(binary_file_path)
-        return self.upload(path.parent, os.path.splitext(path.name)[0])
+        return self._upload(
+            path.parent, os.path.splitext(path.name)[0], path, retries)
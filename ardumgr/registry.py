@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manage several Arduino installations side by side.
+
+Managers in a registry share a ParsedFileCache, so config files with the
+same content in different installations are only parsed once. Requests are
+routed to an installation by a version constraint:
+
+    registry = ArduMgrRegistry()
+    registry.discover(["/opt"])
+    manager = registry.get(">=1.6.10,<1.9", platform="avr")
+"""
+
+import re
+from pathlib import Path
+from collections import OrderedDict
+from .ardumgr import ArduMgr, version_to_int
+from .configs import ParsedFileCache
+from .exceptions import ArduMgrError
+
+_CONSTRAINT_REGEXP = re.compile(r"^\s*(>=|<=|==|!=|>|<|=)?\s*(\S+?)\s*$")
+
+_OPERATORS = {
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+    "==": lambda a, b: a == b,
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+
+def is_home_path(path):
+    """
+    @return True if path looks like an Arduino installation
+    """
+
+    path = Path(path)
+    return (((path / "revisions.txt").is_file()
+             or (path / "lib" / "version.txt").is_file())
+            and (path / "hardware").is_dir())
+
+
+def parse_constraint(constraint):
+    """
+    Parse a version constraint, for ex: ">=1.6.10,<1.9", "1.8.5"
+
+    @return A function accepts an int version (see version_to_int())
+    """
+
+    checks = []
+    for clause in constraint.split(","):
+        if not clause.strip():
+            continue
+
+        matched = _CONSTRAINT_REGEXP.match(clause)
+        if matched is None:
+            raise ArduMgrError("Invalid version constraint: %s" % constraint)
+
+        operator = _OPERATORS[matched.group(1) or "=="]
+        try:
+            value = version_to_int(matched.group(2))
+        except (ValueError, UnboundLocalError):
+            raise ArduMgrError("Invalid version constraint: %s" % constraint)
+
+        checks.append((operator, value))
+
+    return lambda version: all(
+        operator(version, value) for operator, value in checks)
+
+
+class ArduMgrRegistry(object):
+    """
+    A set of managers of different Arduino installations.
+
+    @arg preferences Preferences applied to all managers, except
+    "ardumgr.home_path"
+    """
+
+    def __init__(self, preferences=None):
+        self._preferences = OrderedDict(preferences or {})
+        self._file_cache = ParsedFileCache()
+        # home path -> manager
+        self._managers = OrderedDict()
+
+    @property
+    def file_cache(self):
+        return self._file_cache
+
+    @property
+    def managers(self):
+        """
+        All managers, newest version first
+        """
+
+        return sorted(self._managers.values(),
+                      key=lambda manager: manager.int_version, reverse=True)
+
+    def add(self, home_path, preferences=None):
+        """
+        Add an installation, the existing manager is returned if it was
+        added before.
+
+        @arg preferences Preferences only applied to this installation
+        """
+
+        home_path = str(Path(home_path).resolve())
+        manager = self._managers.get(home_path)
+        if manager is None:
+            manager_preferences = OrderedDict(self._preferences)
+            if preferences:
+                manager_preferences.update(preferences)
+            manager_preferences["ardumgr.home_path"] = home_path
+
+            manager = ArduMgr(manager_preferences, self._file_cache)
+            self._managers[home_path] = manager
+
+        return manager
+
+    def discover(self, search_dirs):
+        """
+        Add installations found in search_dirs or their sub directories
+
+        @return A list of added managers
+        """
+
+        found = []
+        for search_dir in search_dirs:
+            search_dir = Path(search_dir)
+            if is_home_path(search_dir):
+                found.append(self.add(search_dir))
+                continue
+
+            try:
+                children = sorted(search_dir.iterdir())
+            except OSError:
+                continue
+
+            for child in children:
+                if child.is_dir() and is_home_path(child):
+                    found.append(self.add(child))
+
+        return found
+
+    def find(self, constraint=None, platform=None):
+        """
+        @return Managers match the version constraint and have the
+        platform, newest version first
+        """
+
+        check = None if constraint is None else parse_constraint(constraint)
+        return [
+            manager for manager in self.managers
+            if ((check is None) or check(manager.int_version))
+            and ((platform is None) or (platform in manager.platforms))]
+
+    def get(self, constraint=None, platform=None):
+        """
+        @return The newest manager matches the version constraint and has
+        the platform
+        """
+
+        managers = self.find(constraint, platform)
+        if not managers:
+            raise ArduMgrError(
+                "No installation matches version \"%s\" with platform "
+                "\"%s\"!" % (constraint or "*", platform or "*"))
+
+        return managers[0]
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+Report program sizes of many builds against board limits.
+
+Each build is an image path with a board identity in form of
+"platform:board[:menu=option,...]", for ex: "avr:mega:cpu=atmega2560". The
+size recipe is expanded once per identity, size tools of all builds run
+concurrently.
+
+ELF images (".elf", or a build path without suffix like "Blink.ino") are
+measured by the size recipe. Intel HEX (".hex") and raw binary (".bin")
+images only carry flash contents, their flash size is counted directly and
+data size is left unknown.
+"""
+
+import os
+import re
+import csv
+import json
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .configs import ConfigsMgr
+from .builder import run_command
+from .image import image_size
+from .exceptions import ArduMgrError
+
+SizeResult = namedtuple("SizeResult", [
+    "path", "board", "flash", "max_flash", "data", "max_data", "passed",
+    "error"])
+SizeResult.__doc__ = """
+Size of a build.
+
+board: board identity
+max_flash, max_data: limits of board, None if not defined
+passed: True if sizes within limits
+error: message if size tool failed, None otherwise
+"""
+
+FIELDS = SizeResult._fields
+
+# Replaced by path of each build after the recipe expanded
+_BUILD_PATH = "\0build.path\0"
+_PROJECT_NAME = "\0build.project_name\0"
+
+# Images measured without the size recipe
+_FLASH_IMAGE_SUFFIXES = (".hex", ".bin")
+
+
+def parse_identity(identity):
+    """
+    @return A tuple (platform id, OrderedDict of preferences)
+    """
+
+    parts = identity.split(":")
+    if (len(parts) < 2) or (not parts[0]) or (not parts[1]):
+        raise ArduMgrError("Invalid board identity: %s" % identity)
+
+    preferences = OrderedDict([("ardumgr.board", parts[1])])
+    for item in ":".join(parts[2:]).split(","):
+        if not item:
+            continue
+
+        menu, sep, option = item.partition("=")
+        if not sep:
+            raise ArduMgrError("Invalid menu option \"%s\" of %s" % (
+                item, identity))
+
+        if menu == "cpu":
+            preferences["ardumgr.cpu"] = option
+        else:
+            preferences["ardumgr.menu.%s" % menu] = option
+
+    preferences.setdefault("ardumgr.cpu", "")
+    return parts[0], preferences
+
+
+def get_identity_programmer(manager, identity):
+    """
+    Cached programmer of a board identity, see Platform.get_programmer()
+    """
+
+    platform_id, preferences = parse_identity(identity)
+    menus = OrderedDict(
+        (akey[len("ardumgr.menu."):], value)
+        for akey, value in preferences.items()
+        if akey.startswith("ardumgr.menu."))
+
+    # Not used by builds, comparisons nor sizes, but required by Programmer
+    programmer = None if "ardumgr.programmer" in manager._cfgs else ""
+    port = None if "ardumgr.serial_port" in manager._cfgs else ""
+    return manager.get_platform(platform_id).get_programmer(
+        preferences["ardumgr.board"], preferences["ardumgr.cpu"],
+        programmer, port, menus)
+
+
+class _BoardSize(object):
+    """
+    Size recipe and limits of a board identity
+    """
+
+    def __init__(self, manager, identity):
+        programmer = get_identity_programmer(manager, identity)
+
+        cfgs = ConfigsMgr()
+        cfgs.base_on(programmer.cfgs)
+        cfgs["build.path"] = _BUILD_PATH
+        cfgs["build.project_name"] = _PROJECT_NAME
+
+        try:
+            self.command = cfgs.get_expanded("recipe.size.pattern")
+        except KeyError as e:
+            raise ArduMgrError(
+                "Replacement field %s not found in size recipe of %s!" % (
+                    str(e), identity))
+        self.regexps = []
+        for key in ("recipe.size.regex", "recipe.size.regex.data"):
+            regexp = None
+            if key in cfgs:
+                regexp = re.compile(cfgs.get_overrided(key), re.MULTILINE)
+            self.regexps.append(regexp)
+
+        self.limits = [
+            self._get_limit(cfgs, "upload.maximum_size"),
+            self._get_limit(cfgs, "upload.maximum_data_size"),
+        ]
+
+    @staticmethod
+    def _get_limit(cfgs, key):
+        if key not in cfgs:
+            return None
+
+        value = cfgs.get_overrided(key)
+        return int(value) if value else None
+
+    def get_command(self, path):
+        build_path, name = os.path.split(os.path.abspath(path))
+        if name.lower().endswith(".elf"):
+            name = name[:-len(".elf")]
+
+        return self.command.replace(_BUILD_PATH, build_path).replace(
+            _PROJECT_NAME, name)
+
+
+def _sum_matches(regexp, output):
+    if regexp is None:
+        return None
+
+    return sum(int(match.group(1) or 0)
+               for match in regexp.finditer(output))
+
+
+def _measure(board_size, path, identity):
+    if path.lower().endswith(_FLASH_IMAGE_SUFFIXES):
+        try:
+            sizes = [image_size(path), None]
+        except (ArduMgrError, OSError) as e:
+            return SizeResult(path, identity, None, board_size.limits[0],
+                              None, board_size.limits[1], False, str(e))
+    else:
+        exit_code, output = run_command(board_size.get_command(path))
+        if exit_code != 0:
+            return SizeResult(path, identity, None, board_size.limits[0],
+                              None, board_size.limits[1], False,
+                              output.strip())
+
+        sizes = [_sum_matches(regexp, output)
+                 for regexp in board_size.regexps]
+
+    passed = all(
+        (size is None) or (limit is None) or (size <= limit)
+        for size, limit in zip(sizes, board_size.limits))
+
+    return SizeResult(path, identity, sizes[0], board_size.limits[0],
+                      sizes[1], board_size.limits[1], passed, None)
+
+
+def measure(manager, builds, jobs=None):
+    """
+    Measure sizes of builds
+
+    @arg builds A list of (image path, board identity)
+    @arg jobs Count of size tools run at the same time, None for CPU count
+    @return A list of SizeResult in order of builds
+    """
+
+    board_sizes = dict()
+    for _, identity in builds:
+        if identity not in board_sizes:
+            board_sizes[identity] = _BoardSize(manager, identity)
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(_measure, board_sizes[identity], path, identity)
+            for path, identity in builds]
+        return [future.result() for future in futures]
+
+
+def write_json(results, afile):
+    json.dump([OrderedDict(zip(FIELDS, result)) for result in results],
+              afile, indent=2)
+    afile.write("\n")
+
+
+def write_csv(results, afile):
+    writer = csv.writer(afile, lineterminator="\n")
+    writer.writerow(FIELDS)
+    for result in results:
+        writer.writerow(["" if value is None else value for value in result])
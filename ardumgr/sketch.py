@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+Convert sketch .ino files into a compilable .cpp file.
+
+All .ino files are concatenated (main file named after the sketch directory
+first, others in alphabetical order), "#include <Arduino.h>" is inserted at
+the top and prototypes of functions are inserted before the first function
+definition. "#line" directives keep compiler messages pointing to the
+original .ino files.
+
+The conversion is skipped if the .ino files didn't change: a cache file
+beside the output records their stats and content hash.
+"""
+
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+
+INO_SUFFIXES = (".ino", ".pde")
+
+CACHE_FILE_NAME = "ardumgr-sketch.json"
+
+_CACHE_VERSION = 1
+
+_TOKEN_REGEXP = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<directive>^[ \t]*\#(?:\\\n|[^\n])*)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+  | (?P<space>[ \t\r\f\v]+|\n)
+  | (?P<punct>::|->|.)
+""", re.VERBOSE | re.DOTALL | re.MULTILINE)
+
+# Statements started by these are never function definitions
+_NON_FUNCTION_KEYWORDS = frozenset([
+    "struct", "class", "union", "enum", "namespace", "typedef", "template",
+    "extern", "using", "if", "else", "for", "while", "do", "switch",
+    "return",
+])
+
+
+def get_ino_files(sketch_path):
+    """
+    @return Paths of .ino files of a sketch, main file first, or an empty
+    list if the sketch has no .ino files
+    """
+
+    sketch_path = Path(sketch_path)
+    try:
+        paths = sorted(
+            str(apath) for apath in sketch_path.iterdir()
+            if apath.suffix in INO_SUFFIXES and apath.is_file())
+    except OSError:
+        return []
+
+    for suffix in INO_SUFFIXES:
+        main = str(sketch_path / (sketch_path.name + suffix))
+        if main in paths:
+            paths.remove(main)
+            paths.insert(0, main)
+            break
+
+    return paths
+
+
+def _tokenize(text):
+    """
+    Yield (kind, value, line, start, end) of tokens except spaces and
+    comments
+    """
+
+    line = 1
+    for match in _TOKEN_REGEXP.finditer(text):
+        kind = match.lastgroup
+        value = match.group()
+        if kind not in ("space", "comment"):
+            yield kind, value, line, match.start(), match.end()
+
+        line += value.count("\n")
+
+
+def _join_tokens(text, tokens):
+    """
+    Join tokens by a single space where they were separated in text
+    """
+
+    pieces = []
+    end = None
+    for _, value, _, start, token_end in tokens:
+        if (end is not None) and (start != end):
+            pieces.append(" ")
+        pieces.append(value)
+        end = token_end
+
+    return "".join(pieces)
+
+
+def _is_function_head(tokens):
+    values = [token[1] for token in tokens]
+    if (len(values) < 4) or (values[-1] != ")") or ("(" not in values):
+        return False
+
+    head = values[:values.index("(")]
+    if (len(head) < 2) or (head[0] in _NON_FUNCTION_KEYWORDS):
+        # One name followed by parentheses is a macro, for ex: ISR(vect)
+        return False
+
+    # Member function definitions or initialized variables
+    return ("::" not in head) and ("=" not in head)
+
+
+def scan_functions(text):
+    """
+    Find top level function definitions and declarations of a source
+
+    @return A tuple (definitions, declarations), definitions is a list of
+    (line, prototype), declarations is a set of declared prototypes
+    """
+
+    definitions = []
+    declarations = set()
+    statement = []
+    depth = 0
+    for token in _tokenize(text):
+        kind, value = token[:2]
+        if depth > 0:
+            if value == "{":
+                depth += 1
+            elif value == "}":
+                depth -= 1
+            continue
+
+        if kind == "directive":
+            statement = []
+        elif value == "{":
+            if _is_function_head(statement):
+                definitions.append(
+                    (statement[0][2], _join_tokens(text, statement) + ";"))
+            statement = []
+            depth += 1
+        elif value in (";", "}"):
+            if (value == ";") and _is_function_head(statement):
+                declarations.add(_join_tokens(text, statement) + ";")
+            statement = []
+        else:
+            statement.append(token)
+
+    return definitions, declarations
+
+
+def _line_directive(line, path):
+    return '#line %s "%s"\n' % (
+        line, path.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def convert(sources):
+    """
+    Convert .ino sources into a .cpp source
+
+    @arg sources A list of (path, text), main file first
+    @return The .cpp text
+    """
+
+    definitions = []
+    declarations = set()
+    for _, text in sources:
+        found, declared = scan_functions(text)
+        definitions.append(found)
+        declarations.update(declared)
+
+    prototypes = []
+    for found in definitions:
+        for _, prototype in found:
+            # Prototypes with default arguments conflict with definitions
+            if ((prototype not in declarations)
+                    and (prototype not in prototypes)
+                    and ("=" not in prototype)):
+                prototypes.append(prototype)
+
+    pieces = ["#include <Arduino.h>\n"]
+    inserted = not prototypes
+    for (path, text), found in zip(sources, definitions):
+        pieces.append(_line_directive(1, path))
+        if inserted or (not found):
+            pieces.append(text)
+        else:
+            line = found[0][0]
+            lines = text.splitlines(True)
+            pieces.extend(lines[:line - 1])
+            pieces.extend(prototype + "\n" for prototype in prototypes)
+            pieces.append(_line_directive(line, path))
+            pieces.extend(lines[line - 1:])
+            inserted = True
+
+        if not text.endswith("\n"):
+            pieces.append("\n")
+
+    return "".join(pieces)
+
+
+def _get_stats(paths):
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append([path, stat.st_mtime_ns, stat.st_size])
+
+    return stats
+
+
+def preprocess(sketch_path, output_path):
+    """
+    Convert .ino files of a sketch into output_path if they changed
+
+    @return True if output_path rewritten
+    """
+
+    output_path = str(output_path)
+    cache_path = os.path.join(os.path.dirname(output_path), CACHE_FILE_NAME)
+    paths = get_ino_files(sketch_path)
+    stats = _get_stats(paths)
+
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        if (cache.get("version") != _CACHE_VERSION
+                or cache.get("output") != output_path):
+            cache = dict()
+    except (OSError, ValueError):
+        cache = dict()
+
+    output_exists = os.path.exists(output_path)
+    if output_exists and (cache.get("stats") == stats):
+        return False
+
+    sources = []
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as source_file:
+            content = source_file.read()
+        digest.update(path.encode("utf-8") + b"\0" + content + b"\0")
+        sources.append((path, content.decode("utf-8", "replace")))
+
+    digest = digest.hexdigest()
+    changed = (not output_exists) or (cache.get("hash") != digest)
+    if changed:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, "w") as output_file:
+            output_file.write(convert(sources))
+
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w") as cache_file:
+        json.dump({
+            "version": _CACHE_VERSION,
+            "output": output_path,
+            "stats": stats,
+            "hash": digest,
+        }, cache_file)
+    os.replace(temp_path, cache_path)
+
+    return changed
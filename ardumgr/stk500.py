@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-process STK500v1 uploader for optiboot based boards.
+
+Used instead of spawning avrdude when preference "ardumgr.native_upload"
+is enabled, for boards with "upload.tool=avrdude" and
+"upload.protocol=arduino". Pages are streamed from an in-memory Image,
+the load address command of each page is sent together with the page, so
+a page costs one round trip instead of two.
+
+Flash could also be read back in one pass (dump() and verify_image()),
+pages are compared in memory instead of running avrdude a second time.
+
+Requires pyserial.
+"""
+
+import os
+import time
+from binascii import hexlify
+from contextlib import contextmanager
+from .exceptions import ArduMgrError
+from .image import Image, format_ranges
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+# STK500v1 protocol
+STK_OK = 0x10
+STK_INSYNC = 0x14
+STK_NOSYNC = 0x15
+CRC_EOP = 0x20
+
+STK_GET_SYNC = 0x30
+STK_GET_PARAMETER = 0x41
+STK_SET_DEVICE = 0x42
+STK_SET_DEVICE_EXT = 0x45
+STK_ENTER_PROGMODE = 0x50
+STK_LEAVE_PROGMODE = 0x51
+STK_CHIP_ERASE = 0x52
+STK_LOAD_ADDRESS = 0x55
+STK_UNIVERSAL = 0x56
+STK_PROG_PAGE = 0x64
+STK_READ_PAGE = 0x74
+STK_READ_SIGN = 0x75
+
+STK_HW_VER = 0x80
+STK_SW_MAJOR = 0x81
+STK_SW_MINOR = 0x82
+
+# Flash page sizes in bytes by "build.mcu"
+PAGE_SIZES = {
+    "atmega8": 64,
+    "atmega48": 64,
+    "atmega88": 64,
+    "atmega168": 128,
+    "atmega168p": 128,
+    "atmega328": 128,
+    "atmega328p": 128,
+    "atmega328pb": 128,
+    "atmega32u4": 128,
+    "atmega644p": 256,
+    "atmega1280": 256,
+    "atmega1284p": 256,
+    "atmega2560": 256,
+}
+
+SIGNATURES = {
+    "atmega8": b"\x1e\x93\x07",
+    "atmega88": b"\x1e\x93\x0a",
+    "atmega168": b"\x1e\x94\x06",
+    "atmega168p": b"\x1e\x94\x0b",
+    "atmega328": b"\x1e\x95\x14",
+    "atmega328p": b"\x1e\x95\x0f",
+    "atmega328pb": b"\x1e\x95\x16",
+    "atmega32u4": b"\x1e\x95\x87",
+    "atmega644p": b"\x1e\x96\x0a",
+    "atmega1280": b"\x1e\x97\x03",
+    "atmega1284p": b"\x1e\x97\x05",
+    "atmega2560": b"\x1e\x98\x01",
+}
+
+_OK = bytes((STK_INSYNC, STK_OK))
+
+# Seconds the bootloader needs to start after reset
+_RESET_DELAY = 0.05
+
+# Seconds to wait for the port to come back after a 1200bps touch
+_TOUCH_TIMEOUT = 10.0
+
+
+def _is_true(value):
+    return value.strip().lower() in ("true", "yes", "1")
+
+
+class Stk500Uploader(object):
+    """
+    Upload images to an optiboot bootloader through a serial port.
+    """
+
+    def __init__(self, port, baudrate, page_size, signature=None,
+                 use_1200bps_touch=False, verify=True, timeout=1.0,
+                 sync_attempts=10, flash_size=None):
+        """
+        @arg signature Expected device signature, None to skip the check
+        @arg timeout Seconds to wait for each response
+        @arg flash_size Bytes dumped by default, for ex:
+        "upload.maximum_size" (bootloader excluded)
+        """
+
+        if serial is None:
+            raise ArduMgrError("Native uploads require pyserial!")
+
+        self.port = port
+        self.baudrate = int(baudrate)
+        self.page_size = int(page_size)
+        self.signature = signature
+        self.use_1200bps_touch = use_1200bps_touch
+        self.verify = verify
+        self.timeout = timeout
+        self.sync_attempts = sync_attempts
+        self.flash_size = flash_size
+
+    @classmethod
+    def from_cfgs(cls, cfgs):
+        """
+        Create an uploader from resolved configs of a programmer
+        """
+
+        mcu = cfgs.get_expanded("build.mcu")
+        if mcu not in PAGE_SIZES:
+            raise ArduMgrError(
+                "Page size of \"%s\" unknown, native upload unsupported!" % (
+                    mcu))
+
+        use_1200bps_touch = False
+        if "upload.use_1200bps_touch" in cfgs:
+            use_1200bps_touch = _is_true(
+                cfgs.get_expanded("upload.use_1200bps_touch"))
+
+        # ArduMgr moves "upload.verify" of preferences here
+        verify = True
+        if "ardumgr.verify" in cfgs:
+            value = cfgs.get_expanded("ardumgr.verify").strip()
+            verify = value.lower() not in ("false", "no", "0")
+
+        flash_size = None
+        if "upload.maximum_size" in cfgs:
+            flash_size = int(cfgs.get_expanded("upload.maximum_size"))
+
+        return cls(cfgs.get_expanded("serial.port"),
+                   cfgs.get_expanded("upload.speed"),
+                   PAGE_SIZES[mcu],
+                   signature=SIGNATURES.get(mcu),
+                   use_1200bps_touch=use_1200bps_touch,
+                   verify=verify,
+                   flash_size=flash_size)
+
+    def _touch(self):
+        """
+        Opening the port at 1200 bps resets boards with native USB into
+        their bootloader
+        """
+
+        connection = serial.Serial(self.port, 1200)
+        connection.close()
+
+        deadline = time.monotonic() + _TOUCH_TIMEOUT
+        time.sleep(0.5)
+        while not os.path.exists(self.port):
+            if time.monotonic() > deadline:
+                raise ArduMgrError(
+                    "Port \"%s\" not back after 1200bps touch!" % self.port)
+
+            time.sleep(0.1)
+
+    def _reset(self, connection):
+        # Same as avrdude's arduino programmer, pseudo-terminals don't have
+        # modem lines though
+        try:
+            connection.dtr = False
+            connection.rts = False
+            time.sleep(0.25)
+            connection.dtr = True
+            connection.rts = True
+        except (OSError, serial.SerialException):
+            return
+
+        time.sleep(_RESET_DELAY)
+
+    def _receive(self, connection, size):
+        response = connection.read(size)
+        if len(response) != size:
+            raise ArduMgrError("Timeout while waiting for bootloader of "
+                               "\"%s\"!" % self.port)
+
+        return response
+
+    def _command(self, connection, request, size=0, commands=1):
+        """
+        Send a request of one or more commands, check their responses
+
+        @arg size Count of bytes between STK_INSYNC and STK_OK of the last
+        command
+        @return Bytes between STK_INSYNC and STK_OK of the last command
+        """
+
+        connection.write(request)
+        response = self._receive(connection, 2 * commands + size)
+        last = 2 * (commands - 1)
+        if (response[:last] != _OK * (commands - 1)) or (
+                response[last] != STK_INSYNC) or (response[-1] != STK_OK):
+            raise ArduMgrError("Bootloader of \"%s\" out of sync!" % (
+                self.port))
+
+        return response[last + 1:-1]
+
+    def _sync(self, connection):
+        request = bytes((STK_GET_SYNC, CRC_EOP))
+        for _ in range(self.sync_attempts):
+            connection.reset_input_buffer()
+            connection.write(request)
+            if connection.read(2) == _OK:
+                return
+
+        raise ArduMgrError("Bootloader of \"%s\" not responding!" % (
+            self.port))
+
+    def _get_pages(self, image):
+        page_size = self.page_size
+        pages = []
+        for start, data in image.segments:
+            address = start - (start % page_size)
+            end = start + len(data)
+            if pages and (pages[-1] == address):
+                address += page_size
+
+            pages.extend(range(address, end, page_size))
+
+        if pages and (pages[-1] // 2 > 0xFFFF):
+            raise ArduMgrError("Image too large for STK500v1 addresses!")
+
+        return pages
+
+    @staticmethod
+    def _load_address(address):
+        word = address // 2
+        return bytes((STK_LOAD_ADDRESS, word & 0xFF, word >> 8, CRC_EOP))
+
+    def _write_pages(self, connection, image, pages):
+        page_size = self.page_size
+        header = bytes((STK_PROG_PAGE, page_size >> 8, page_size & 0xFF,
+                        ord("F")))
+        for address in pages:
+            self._command(connection, b"".join([
+                self._load_address(address), header,
+                image.read(address, page_size), bytes((CRC_EOP,))]),
+                commands=2)
+
+    def _read_ranges(self, connection, ranges):
+        """
+        Read page aligned ranges into one buffer per range
+
+        @return An Image of the read flash
+        """
+
+        page_size = self.page_size
+        request = bytes((STK_READ_PAGE, page_size >> 8, page_size & 0xFF,
+                         ord("F"), CRC_EOP))
+        flash = Image()
+        for start, end in ranges:
+            if (end - 1) // 2 > 0xFFFF:
+                raise ArduMgrError("Range 0x%X-0x%X out of STK500v1 "
+                                   "addresses!" % (start, end - 1))
+
+            buffer = bytearray(end - start)
+            view = memoryview(buffer)
+            for address in range(start, end, page_size):
+                offset = address - start
+                view[offset:offset + page_size] = self._command(
+                    connection, self._load_address(address) + request,
+                    page_size, commands=2)
+
+            flash.write(start, buffer)
+
+        return flash
+
+    @contextmanager
+    def _programming(self):
+        """
+        Reset the board and enter programming mode
+
+        @return A context manager of the serial connection
+        """
+
+        if self.use_1200bps_touch:
+            self._touch()
+
+        connection = serial.Serial(
+            self.port, self.baudrate, timeout=self.timeout)
+        try:
+            self._reset(connection)
+            self._sync(connection)
+
+            signature = self._command(
+                connection, bytes((STK_READ_SIGN, CRC_EOP)), 3)
+            if (self.signature is not None) and (
+                    signature != self.signature):
+                raise ArduMgrError(
+                    "Device signature %s of \"%s\" mismatch, expected "
+                    "%s!" % (hexlify(signature).decode(), self.port,
+                             hexlify(self.signature).decode()))
+
+            self._command(connection, bytes((STK_ENTER_PROGMODE, CRC_EOP)))
+            yield connection
+            self._command(connection, bytes((STK_LEAVE_PROGMODE, CRC_EOP)))
+        finally:
+            connection.close()
+
+    def upload(self, image):
+        """
+        Write an Image to flash, raise ArduMgrError on failures
+        """
+
+        pages = self._get_pages(image)
+        with self._programming() as connection:
+            self._write_pages(connection, image, pages)
+            if self.verify:
+                flash = self._read_ranges(
+                    connection, image.page_ranges(self.page_size))
+                mismatches = image.compare(flash, self.page_size)
+                if mismatches:
+                    raise ArduMgrError(
+                        "Verification of \"%s\" failed at %s!" % (
+                            self.port, format_ranges(mismatches)))
+
+    def dump(self, start=0, length=None):
+        """
+        Read flash from start, page aligned
+
+        @arg length Bytes to read, defaults to flash_size
+        @return An Image of the flash contents
+        """
+
+        if length is None:
+            if self.flash_size is None:
+                raise ArduMgrError("Flash size of \"%s\" unknown!" % (
+                    self.port))
+
+            length = self.flash_size - start
+
+        page_size = self.page_size
+        end = start + length
+        end += -end % page_size
+        start -= start % page_size
+        with self._programming() as connection:
+            return self._read_ranges(connection, [(start, end)])
+
+    def verify_image(self, image, hash_only=False):
+        """
+        Read back pages covered by image once and compare them in memory
+
+        @arg hash_only See Image.compare()
+        @return A list of (start, end) of mismatched ranges
+        """
+
+        with self._programming() as connection:
+            flash = self._read_ranges(
+                connection, image.page_ranges(self.page_size))
+
+        return image.compare(flash, self.page_size, hash_only)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+"""
+Watch Arduino configuration files and directories, invalidate loaded
+platforms and tools when they changed on disk.
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+from collections import OrderedDict
+
+
+class PollingBackend(object):
+    """
+    A portable backend which compares stat() snapshots of watched paths.
+    """
+
+    def __init__(self, interval=1.0):
+        self._interval = interval
+        self._files = dict()
+        self._dirs = dict()
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _list(path):
+        try:
+            return frozenset(os.listdir(str(path)))
+        except OSError:
+            return frozenset()
+
+    def set_paths(self, files, dirs):
+        self._files = dict(
+            (apath, self._files.get(apath, self._stat(apath)))
+            for apath in files)
+        self._dirs = dict(
+            (apath, self._dirs.get(apath, self._list(apath)))
+            for apath in dirs)
+
+    def _check(self):
+        changed = set()
+        for apath, snapshot in self._files.items():
+            current = self._stat(apath)
+            if current != snapshot:
+                self._files[apath] = current
+                changed.add(apath)
+
+        for apath, snapshot in self._dirs.items():
+            current = self._list(apath)
+            if current != snapshot:
+                self._dirs[apath] = current
+                for name in current.symmetric_difference(snapshot):
+                    changed.add(apath / name)
+
+        return changed
+
+    def poll(self, timeout=0):
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._check()
+            remain = deadline - time.monotonic()
+            if changed or (remain <= 0):
+                return changed
+
+            time.sleep(min(self._interval, remain))
+
+    def close(self):
+        self._files = dict()
+        self._dirs = dict()
+
+
+class InotifyBackend(object):
+    """
+    Linux inotify backend, files are watched through their parent
+    directories, so that editors which replace files are noticed as well.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+                  | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+                  | IN_MOVE_SELF)
+
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._wds = dict()
+        self._files = set()
+        self._dirs = set()
+
+    def _add_watch(self, apath):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(str(apath)), self.WATCH_MASK)
+        if wd >= 0:
+            self._wds[wd] = apath
+
+    def set_paths(self, files, dirs):
+        for wd in list(self._wds.keys()):
+            self._libc.inotify_rm_watch(self._fd, wd)
+        self._wds = dict()
+
+        self._files = set(files)
+        self._dirs = set(dirs)
+
+        for apath in self._dirs | set(f.parent for f in self._files):
+            self._add_watch(apath)
+
+    def _read_events(self):
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self._EVENT_HEADER.unpack_from(
+                    data, offset)
+                offset += self._EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                watched = self._wds.get(wd)
+                if watched is None:
+                    continue
+
+                apath = watched
+                if name:
+                    apath = watched / os.fsdecode(name)
+
+                if apath in self._files:
+                    changed.add(apath)
+                elif watched in self._dirs:
+                    changed.add(apath)
+
+        return changed
+
+    def poll(self, timeout=0):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        return self._read_events()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._wds = dict()
+
+
+def create_backend():
+    """
+    Return an inotify backend if available, otherwise a polling backend
+    """
+
+    try:
+        return InotifyBackend()
+    except (OSError, AttributeError):
+        return PollingBackend()
+
+
+class Watcher(object):
+    """
+    Watch files loaded by a manager and its platforms.
+
+    Each detected change is classified and only the affected entries are
+    invalidated:
+
+    preferences: preferences.txt changed, the manager will be reloaded
+    platform: platform.txt/boards.txt/programmers.txt of a platform changed,
+              only that platform will be reloaded
+    tool: a tool directory under user tools directory changed, only the
+          runtime paths of that tool will be rescanned
+    platforms: platform list changed, the list will be rescanned
+    """
+
+    def __init__(self, manager, backend=None):
+        self._manager = manager
+        self._backend = backend if backend is not None else create_backend()
+        self._platforms = OrderedDict()
+        self._listeners = []
+        self._refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def backend(self):
+        return self._backend
+
+    def add_listener(self, callback):
+        """
+        Register a callback(kind, id_) invoked after an entry invalidated
+        """
+
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def watch_platform(self, platform):
+        self._platforms[platform.id_] = platform
+        self._refresh()
+
+    def unwatch_platform(self, platform):
+        self._platforms.pop(platform.id_, None)
+        self._refresh()
+
+    def _refresh(self):
+        files = [self._manager.preferences_path]
+        for platform in self._platforms.values():
+            files.extend(platform.sources)
+
+        self._backend.set_paths(files, self._manager.scanned_dirs)
+
+    def _classify(self, apath):
+        manager = self._manager
+        if apath == manager.preferences_path:
+            return ("preferences", None)
+
+        for id_, platform in self._platforms.items():
+            if apath in platform.sources:
+                return ("platform", id_)
+
+        tools_dir = manager.user_tools_dir
+        try:
+            parts = apath.relative_to(tools_dir).parts
+        except ValueError:
+            parts = None
+
+        if parts:
+            return ("tool", parts[0])
+
+        if apath.parent == manager._get_platform_base_dir():
+            return ("platforms", None)
+
+        return None
+
+    def _invalidate(self, kind, id_):
+        if kind == "preferences":
+            self._manager.reload()
+        elif kind == "platform":
+            self._platforms[id_].reload()
+        elif kind == "tool":
+            self._manager.reload_tool(id_)
+        elif kind == "platforms":
+            self._manager.reload_platforms()
+
+        for callback in self._listeners:
+            callback(kind, id_)
+
+    def check(self, timeout=0):
+        """
+        Wait up to timeout seconds for changes and invalidate affected
+        entries.
+
+        @return A list of (kind, id_) tuples which invalidated
+        """
+
+        events = []
+        for apath in self._backend.poll(timeout):
+            event = self._classify(Path(apath))
+            if (event is not None) and (event not in events):
+                events.append(event)
+
+        # Reload the manager first, platforms are based on it
+        events.sort(key=lambda event: event[0] != "preferences")
+        for kind, id_ in events:
+            self._invalidate(kind, id_)
+
+        if events:
+            self._refresh()
+
+        return events
+
+    def close(self):
+        self._backend.close()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""Shared fixtures for `ardumgr` tests."""
+
+import pytest
+
+BOARDS_TXT = """\
+menu.cpu=Processor
+
+uno.name=Arduino/Genuino Uno
+uno.vid.0=0x2341
+uno.pid.0=0x0043
+uno.upload.tool=avrdude
+uno.upload.protocol=arduino
+uno.upload.maximum_size=32256
+uno.upload.maximum_data_size=2048
+uno.upload.speed=115200
+uno.build.mcu=atmega328p
+uno.build.core=arduino
+uno.build.variant=standard
+
+mega.name=Arduino/Genuino Mega or Mega 2560
+mega.vid.0=0x2341
+mega.pid.0=0x0010
+mega.upload.tool=avrdude
+mega.upload.maximum_data_size=8192
+mega.build.core=arduino
+mega.build.variant=mega
+mega.menu.cpu.atmega2560=ATmega2560 (Mega 2560)
+mega.menu.cpu.atmega2560.upload.protocol=wiring
+mega.menu.cpu.atmega2560.upload.maximum_size=253952
+mega.menu.cpu.atmega2560.upload.speed=115200
+mega.menu.cpu.atmega2560.build.mcu=atmega2560
+mega.menu.cpu.atmega1280=ATmega1280
+mega.menu.cpu.atmega1280.upload.protocol=arduino
+mega.menu.cpu.atmega1280.upload.maximum_size=126976
+mega.menu.cpu.atmega1280.upload.speed=57600
+mega.menu.cpu.atmega1280.build.mcu=atmega1280
+"""
+
+PLATFORM_TXT = """\
+name=Arduino AVR Boards
+version=1.6.20
+tools.avrdude.path={runtime.tools.avrdude.path}
+tools.avrdude.cmd.path={path}/bin/avrdude
+tools.avrdude.cmd.path.windows={path}/bin/avrdude.exe
+tools.avrdude.config.path={path}/etc/avrdude.conf
+tools.avrdude.upload.params.verbose=-v
+tools.avrdude.upload.pattern="{cmd.path}" "-C{config.path}" \
+{upload.verbose} {upload.verify} -p{build.mcu} -c{upload.protocol} \
+-P{serial.port} -b{upload.speed} -D \
+"-Uflash:w:{build.path}/{build.project_name}.hex:i"
+"""
+
+PROGRAMMERS_TXT = """\
+avrisp.name=AVR ISP
+avrisp.protocol=stk500v1
+usbtinyisp.name=USBtinyISP
+usbtinyisp.protocol=usbtiny
+"""
+
+
+@pytest.fixture
+def arduino_home(tmp_path, monkeypatch):
+    """A minimal Arduino 1.8 installation with a single avr platform.
+
+    Returns preferences suitable for constructing an ArduMgr.
+    """
+    home_path = tmp_path / "arduino"
+    user_home = tmp_path / "user"
+    platform_dir = home_path / "hardware" / "arduino" / "avr"
+    platform_dir.mkdir(parents=True)
+    (home_path / "revisions.txt").write_text("ARDUINO 1.8.5 - 2017.10.01\n")
+    (platform_dir / "boards.txt").write_text(BOARDS_TXT)
+    (platform_dir / "platform.txt").write_text(PLATFORM_TXT)
+    (platform_dir / "programmers.txt").write_text(PROGRAMMERS_TXT)
+
+    user_dir = user_home / ".arduino15"
+    (user_dir / "packages" / "arduino" / "tools" / "avrdude" /
+     "6.3.0-arduino9").mkdir(parents=True)
+    (user_dir / "preferences.txt").write_text(
+        "upload.verify=true\nupload.verbose=false\n")
+
+    monkeypatch.setenv("HOME", str(user_home))
+
+    return {
+        "ardumgr.home_path": str(home_path),
+        "ardumgr.platform": "avr",
+        "ardumgr.board": "mega",
+        "ardumgr.cpu": "atmega2560",
+        "ardumgr.programmer": "avrisp",
+        "ardumgr.serial_port": "/dev/ttyUSB0",
+    }
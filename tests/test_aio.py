@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.aio` module."""
+
+import time
+import asyncio
+
+import pytest
+
+from ardumgr import aio
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+async def create_programmer(preferences, pattern, semaphore=None):
+    manager = await aio.create_manager(preferences)
+    platform = await aio.create_platform(manager, "avr")
+    programmer = await aio.AsyncProgrammer.create(platform, semaphore)
+    programmer.programmer._cfgs["upload.pattern"] = pattern
+    return programmer
+
+
+def test_upload_concurrency_limit(arduino_home, loop):
+    async def run():
+        semaphore = asyncio.Semaphore(2)
+        programmer = await create_programmer(
+            arduino_home, "sleep 0.2", semaphore)
+        return await asyncio.gather(
+            *[programmer.upload() for _ in range(4)])
+
+    started = time.monotonic()
+    assert loop.run_until_complete(run()) == [0, 0, 0, 0]
+    assert time.monotonic() - started >= 0.4
+
+
+def test_upload_shell_pattern(arduino_home, loop):
+    async def run():
+        programmer = await create_programmer(
+            arduino_home, "true && exit $((1 + 2))")
+        return await programmer.upload()
+
+    assert loop.run_until_complete(run()) == 3
+
+
+def test_upload_cancel_kills_tool(arduino_home, loop, tmp_path):
+    marker = tmp_path / "uploaded"
+
+    async def run():
+        programmer = await create_programmer(
+            arduino_home, "sleep 1 && touch '%s'" % marker)
+        task = loop.create_task(programmer.upload())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # Children of the shell are killed with it
+        await asyncio.sleep(1.5)
+
+    started = time.monotonic()
+    loop.run_until_complete(run())
+    assert time.monotonic() - started < 5
+    assert not marker.exists()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.builder` module."""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.programmer import Programmer
+from ardumgr.builder import Builder, parse_dep_file
+
+# A fake toolchain: "compiles" by copying sources and writes a dependency
+# file listing quoted includes just like gcc -MMD
+FAKE_TOOLCHAIN = r'''
+import re
+import sys
+
+command = sys.argv[1]
+if command == "cc":
+    source, obj = sys.argv[-2:]
+    content = open(source).read()
+    headers = re.findall(r'#include "([^"]+)"', content)
+    base_dir = source.rsplit("/", 1)[0]
+    deps = [source] + ["%s/%s" % (base_dir, header) for header in headers]
+    for header in deps[1:]:
+        content += open(header).read()
+    open(obj, "w").write(content)
+    open(obj[:-2] + ".d", "w").write("%s: %s\n" % (obj, " \\\n  ".join(deps)))
+elif command == "ar":
+    with open(sys.argv[2], "a") as archive:
+        archive.write(open(sys.argv[3]).read())
+elif command == "ld":
+    with open(sys.argv[2], "w") as elf:
+        for path in sys.argv[3:]:
+            elf.write(open(path).read())
+elif command == "objcopy":
+    open(sys.argv[3], "w").write(open(sys.argv[2]).read())
+'''
+
+RECIPES_TXT = """\
+tool={python} "{runtime.platform.path}/toolchain.py"
+recipe.c.o.pattern={tool} cc {includes} "{source_file}" "{object_file}"
+recipe.cpp.o.pattern={tool} cc {includes} "{source_file}" "{object_file}"
+recipe.ar.pattern={tool} ar "{archive_file_path}" "{object_file}"
+recipe.c.combine.pattern={tool} ld \
+"{build.path}/{build.project_name}.elf" {object_files} \
+"{build.path}/{archive_file}"
+recipe.objcopy.hex.pattern={tool} objcopy \
+"{build.path}/{build.project_name}.elf" "{build.path}/{build.project_name}.hex"
+"""
+
+
+@pytest.fixture
+def programmer(arduino_home):
+    platform_path = (Path(arduino_home["ardumgr.home_path"]) / "hardware" /
+                     "arduino" / "avr")
+    (platform_path / "toolchain.py").write_text(FAKE_TOOLCHAIN)
+    with (platform_path / "platform.txt").open("a") as platform_file:
+        platform_file.write(RECIPES_TXT)
+
+    core_path = platform_path / "cores" / "arduino"
+    core_path.mkdir(parents=True)
+    (core_path / "main.cpp").write_text("int main() {}\n")
+    (core_path / "wiring.c").write_text("void init() {}\n")
+
+    arduino_home["python"] = sys.executable
+    return Programmer(Platform(ArduMgr(arduino_home), "avr"))
+
+
+def test_parse_dep_file(tmp_path):
+    dep_path = tmp_path / "a.cpp.d"
+    dep_path.write_text(
+        "C:/build/a.cpp.o: a.cpp my\\ header.h \\\n  b.h\n\nb.h:\n")
+    assert parse_dep_file(dep_path) == ["a.cpp", "my header.h", "b.h"]
+
+
+def test_incremental_build(programmer, tmp_path):
+    sketch_path = tmp_path / "Blink"
+    sketch_path.mkdir()
+    (sketch_path / "Blink.cpp").write_text('#include "config.h"\n')
+    (sketch_path / "other.c").write_text("int other;\n")
+    (sketch_path / "config.h").write_text("#define LED 13\n")
+    build_path = tmp_path / "build"
+
+    def build():
+        return Builder(programmer, sketch_path, build_path, jobs=2).build()
+
+    result = build()
+    assert (result.compiled, result.linked) == (4, True)
+    assert "#define LED 13" in (build_path / "Blink.hex").read_text()
+
+    result = build()
+    assert (result.compiled, result.linked) == (0, False)
+
+    # Deleted images are made again
+    (build_path / "Blink.hex").unlink()
+    build()
+    assert (build_path / "Blink.hex").exists()
+
+    # Touched without changes
+    os.utime(str(sketch_path / "other.c"), None)
+    assert build().compiled == 0
+
+    (sketch_path / "config.h").write_text("#define LED 12\n")
+    result = build()
+    assert (result.compiled, result.linked) == (1, True)
+    assert "#define LED 12" in (build_path / "Blink.hex").read_text()
+
+
+def test_build_ino_sketch(programmer, tmp_path):
+    sketch_path = tmp_path / "Blink"
+    sketch_path.mkdir()
+    (sketch_path / "Blink.ino").write_text("void setup() {}\n")
+    (sketch_path / "helpers.ino").write_text("int helper() {}\n")
+    build_path = tmp_path / "build"
+
+    builder = Builder(programmer, sketch_path, build_path)
+    assert builder.project_name == "Blink.ino"
+
+    result = builder.build()
+    assert result.compiled == 3
+    hex_text = (build_path / "Blink.ino.hex").read_text()
+    assert "int helper();" in hex_text
+
+    assert Builder(programmer, sketch_path, build_path).build().compiled == 0
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.cache` module."""
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.cache import LRUCache, DEFAULT_SIZE
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.watcher import Watcher, PollingBackend
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    created = []
+
+    def factory(value):
+        return lambda: created.append(value) or value
+
+    assert cache.get("a", factory(1)) == 1
+    assert cache.get("b", factory(2)) == 2
+    assert cache.get("a", factory(3)) == 1
+    # "b" is the least recently used one
+    cache.get("c", factory(4))
+    assert "b" not in cache
+    assert created == [1, 2, 4]
+    assert cache.stats == (1, 3, 2, 2)
+
+    cache.maxsize = 1
+    assert list(cache.values()) == [4]
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_factories(arduino_home):
+    arduino_home["ardumgr.cache_size"] = "4"
+    manager = ArduMgr(arduino_home)
+    platform = manager.get_platform("avr")
+    assert manager.get_platform("avr") is platform
+    assert manager.platform_cache.stats.hits == 1
+    assert manager.platform_cache.maxsize == 4
+
+    with pytest.raises(ArduMgrError):
+        manager.get_platform("sam")
+
+    programmer = platform.get_programmer()
+    assert platform.get_programmer() is programmer
+    uno = platform.get_programmer("uno", "", port="/dev/ttyACM0")
+    assert uno is not programmer
+    assert uno.metric_labels == ("uno", "", "avrisp", "/dev/ttyACM0")
+    assert platform.get_programmer("uno", "", port="/dev/ttyACM0") is uno
+    assert platform.programmer_cache.stats[:2] == (2, 2)
+
+
+def test_invalidation(arduino_home):
+    manager = ArduMgr(arduino_home)
+    platform = manager.get_platform("avr")
+    programmer = platform.get_programmer()
+
+    with Watcher(manager, PollingBackend(interval=0.01)) as watcher:
+        watcher.watch_platform(platform)
+        with platform.sources[1].open("a") as boards_file:
+            boards_file.write("mega.build.extra_flags=-DWATCHED\n")
+
+        assert watcher.check(1.0) == [("platform", "avr")]
+
+    # Platform reloaded in place, programmers created again
+    assert manager.get_platform("avr") is platform
+    assert platform.get_programmer() is not programmer
+    assert platform.get_programmer().cfgs[
+        "build.extra_flags"] == "-DWATCHED"
+
+    programmer = platform.get_programmer()
+    manager.reload()
+    assert platform.get_programmer() is not programmer
+
+
+def test_reload(arduino_home):
+    manager = ArduMgr(arduino_home)
+    platform = manager.get_platform("avr")
+    assert "nano" not in platform.boards
+    assert platform.programmer_cache.maxsize == DEFAULT_SIZE
+
+    with platform.sources[1].open("a") as boards_file:
+        boards_file.write("nano.name=Arduino Nano\n")
+
+    with open(str(manager.preferences_path), "a") as preferences_file:
+        preferences_file.write("ardumgr.cache_size=8\n")
+
+    manager.reload()
+    assert manager.get_platform("avr") is platform
+    assert "nano" in manager.get_platform("avr").boards
+    assert manager.platform_cache.maxsize == 8
+    assert platform.programmer_cache.maxsize == 8
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.checker` module."""
+
+from pathlib import Path
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.checker import check_platform
+
+PATTERNS_TXT = """\
+recipe.c.o.pattern={compiler.c.cmd} {compiler.c.flags} "{source_file}"
+compiler.c.cmd=avr-gcc
+compiler.c.flags={compiler.c.extra_flags}
+compiler.c.extra_flags={compiler.c.flags}
+recipe.size.pattern={compiler.size.cmd} "{build.path}/x.elf"
+compiler.size.cmd.windows=avr-size.exe
+"""
+
+
+def test_check_platform(arduino_home):
+    platform_path = (Path(arduino_home["ardumgr.home_path"]) / "hardware" /
+                     "arduino" / "avr" / "platform.txt")
+    with platform_path.open("a") as platform_file:
+        platform_file.write(PATTERNS_TXT)
+
+    issues = check_platform(ArduMgr(arduino_home), "avr", jobs=1)
+    uno_issues = set(
+        (issue.kind, issue.key, issue.detail)
+        for issue in issues if issue.board == "uno")
+
+    assert uno_issues == set([
+        ("cycle", "recipe.c.o.pattern",
+         "compiler.c.flags -> compiler.c.extra_flags -> compiler.c.flags"),
+        ("os-gap", "recipe.size.pattern",
+         "compiler.size.cmd (linux, macosx)"),
+    ])
+
+    mega_menus = set(issue.menus for issue in issues if issue.board == "mega")
+    assert mega_menus == set(["cpu=atmega2560", "cpu=atmega1280"])
+    assert all(issue.programmer == "*" for issue in issues)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.configs` module."""
+
+import shutil
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import (
+    ConfigsMgr, ConfigChange, diff_items, replace_install_roots)
+from ardumgr.exceptions import ArduMgrError
+
+
+@pytest.fixture
+def chain():
+    base = ConfigsMgr()
+    base["runtime.os"] = "windows"
+    base["cmd"] = "avrdude"
+    base["cmd.windows"] = "avrdude.exe"
+    base["path"] = "/usr"
+
+    middle = ConfigsMgr()
+    middle.base_on(base)
+
+    top = ConfigsMgr([("path", "/opt"), ("path.linux", "/opt/linux")])
+    top.base_on(middle)
+    return base, top
+
+
+def test_get_overrided(chain):
+    base, top = chain
+    # OS specific keys in base override plain keys of upper layers
+    top["cmd"] = "top-avrdude"
+    assert top.get_overrided("cmd") == "avrdude.exe"
+    assert top.get_overrided("path") == "/opt"
+    assert top.get_expanded("path") == "/opt"
+
+    base["runtime.os"] = "linux"
+    assert top.get_overrided("cmd") == "top-avrdude"
+    assert top.get_overrided("path") == "/opt/linux"
+
+    with pytest.raises(KeyError):
+        top.get_overrided("missing")
+
+
+def test_overrides_kept_current(chain):
+    base, top = chain
+    del base["cmd.windows"]
+    assert top.get_overrided("cmd") == "avrdude"
+    assert "cmd.windows" not in top
+
+    base["cmd.windows"] = "new.exe"
+    assert top.get_overrided("cmd") == "new.exe"
+
+    base.clear()
+    base["runtime.os"] = "windows"
+    with pytest.raises(KeyError):
+        top.get_overrided("cmd")
+
+
+def test_expand_for_os(chain):
+    base, top = chain
+    top["tool"] = "{path}/bin/{cmd}"
+    top["pattern"] = "{tool} -C{path}/etc -p {mcu} ({runtime.os})"
+    top["mcu"] = "atmega328p"
+
+    expanded = top.expand_for_os(["pattern", "mcu"], ["linux", "windows"])
+    assert list(expanded.keys()) == ["linux", "windows"]
+    assert expanded["linux"] == {
+        "pattern": "/opt/linux/bin/avrdude -C/opt/linux/etc -p atmega328p "
+                   "(linux)",
+        "mcu": "atmega328p",
+    }
+    assert expanded["windows"]["pattern"] == (
+        "/opt/bin/avrdude.exe -C/opt/etc -p atmega328p (windows)")
+    # Same results as expanding with each runtime.os
+    base["runtime.os"] = "linux"
+    assert top.get_expanded("pattern") == expanded["linux"]["pattern"]
+
+    top["loop"] = "{loop}"
+    with pytest.raises(ArduMgrError):
+        top.expand_for_os(["loop"])
+
+    with pytest.raises(KeyError):
+        top.expand_for_os(["missing"])
+
+
+def test_diff_items():
+    old = [("a", "1"), ("b", "2"), ("d", "4")]
+    new = [("b", "3"), ("c", "5"), ("d", "4"), ("e", "6")]
+    assert diff_items(old, new) == [
+        ConfigChange("a", "1", None),
+        ConfigChange("b", "2", "3"),
+        ConfigChange("c", None, "5"),
+        ConfigChange("e", None, "6"),
+    ]
+    assert diff_items([], []) == []
+
+
+def test_diff(chain):
+    base, top = chain
+    other = ConfigsMgr([("runtime.os", "windows"), ("cmd", "avrdude"),
+                        ("path", "/opt"), ("tool", "{path}/{cmd}")])
+    top["boards.uno.name"] = "Uno"
+
+    assert top.diff(other, exclude=["boards."]) == [
+        ConfigChange("cmd.windows", "avrdude.exe", None),
+        ConfigChange("path.linux", "/opt/linux", None),
+        ConfigChange("tool", None, "{path}/{cmd}"),
+    ]
+    # Expanded for windows, OS specific keys resolved
+    top["tool"] = "{path}/{cmd}"
+    assert top.diff(other, expand=True, exclude=["boards."]) == [
+        ConfigChange("cmd", "avrdude.exe", "avrdude"),
+        ConfigChange("tool", "/opt/avrdude.exe", "/opt/avrdude"),
+    ]
+
+
+def test_platform_diff(arduino_home, tmp_path):
+    other_home = tmp_path / "arduino-upgraded"
+    shutil.copytree(arduino_home["ardumgr.home_path"], str(other_home))
+    boards_path = other_home / "hardware" / "arduino" / "avr" / "boards.txt"
+    boards_txt = boards_path.read_text().replace(
+        "uno.upload.speed=115200", "uno.upload.speed=57600")
+    boards_path.write_text(boards_txt + "nano.name=Arduino Nano\n")
+
+    platform = ArduMgr(arduino_home).get_platform("avr")
+    preferences = dict(arduino_home)
+    preferences["ardumgr.home_path"] = str(other_home)
+    other = ArduMgr(preferences).get_platform("avr")
+
+    assert platform.diff(platform) == {}
+    # Unchanged boards don't differ in install roots
+    diffs = platform.diff(other)
+    assert list(diffs.keys()) == ["uno"]
+    assert diffs["uno"] == [ConfigChange("upload.speed", "115200", "57600")]
+
+    diffs = platform.diff(other, expand=True)
+    assert list(diffs.keys()) == ["uno"]
+    changes = dict((change.key, change) for change in diffs["uno"])
+    assert "-b57600" in changes["upload.pattern"].new
+    assert "-b115200" in changes["upload.pattern"].old
+    assert str(other_home) not in changes["upload.pattern"].new
+
+
+def test_replace_install_roots():
+    items = [
+        ("cmd", "/opt/arduino/hardware/avr/bin/gcc -I/opt/arduino-1.8"),
+        ("runtime.ide.path", "/opt/arduino"),
+        ("runtime.platform.path", "/opt/arduino/hardware/avr"),
+        ("runtime.tools.avrdude-6.3.path", "/opt/tools/avrdude"),
+        ("runtime.tools.avrdude.path", "/opt/tools/avrdude"),
+        ("upload", '"/opt/tools/avrdude/bin/avrdude" -C/opt/arduino/a.conf'),
+    ]
+    assert replace_install_roots(items) == [
+        ("cmd", "{runtime.platform.path}/bin/gcc -I/opt/arduino-1.8"),
+        ("runtime.ide.path", "{runtime.ide.path}"),
+        ("runtime.platform.path", "{runtime.platform.path}"),
+        ("runtime.tools.avrdude-6.3.path", "{runtime.tools.avrdude-6.3.path}"),
+        ("runtime.tools.avrdude.path", "{runtime.tools.avrdude-6.3.path}"),
+        ("upload", '"{runtime.tools.avrdude-6.3.path}/bin/avrdude" '
+         '-C{runtime.ide.path}/a.conf'),
+    ]
+    assert replace_install_roots(items[:1]) == items[:1]
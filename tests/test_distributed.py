@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.distributed` module."""
+
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import threading
+
+import pytest
+
+from ardumgr.builder import CompileUnit
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.distributed import (
+    WorkerServer, WorkerError, DistributedCompiler, check_compile_args,
+    get_toolchain_identity, recv_message, send_message, serve,
+    split_compile_command)
+
+# A fake gcc: "-E" prints the source and writes the dependency file,
+# "-c" writes the source with a marker of the host compiled it
+FAKE_GCC = r'''#!{python}
+import os
+import sys
+
+args = sys.argv[1:]
+if args == ["--version"]:
+    print("fake-gcc 1.0")
+elif args == ["-dumpmachine"]:
+    print("avr")
+elif "-E" in args:
+    source = [arg for arg in args if arg.endswith(".c")][0]
+    sys.stdout.write(open(source).read())
+    if "-MF" in args:
+        dep, target = args[args.index("-MF") + 1], args[args.index("-MT") + 1]
+        open(dep, "w").write("%s: %s\n" % (target, source))
+else:
+    source = [arg for arg in args if arg.endswith((".c", ".i"))][0]
+    obj = args[args.index("-o") + 1]
+    if "-DNO_OBJECT" not in args:
+        open(obj, "w").write(open(source).read() + os.environ["FAKE_HOST"])
+'''
+
+
+def make_compiler(adir):
+    adir.mkdir()
+    path = adir / "fake-gcc"
+    path.write_text(FAKE_GCC.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_HOST", "remote")
+    servers = []
+    for i in range(2):
+        compiler = make_compiler(tmp_path / ("worker%s" % i))
+        server = WorkerServer(
+            ("127.0.0.1", 0), [compiler], jobs=2, token="secret")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+
+    yield [server.server_address for server in servers]
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_units(tmp_path, count):
+    compiler = make_compiler(tmp_path / "local")
+    units = []
+    for i in range(count):
+        source = tmp_path / ("source%s.c" % i)
+        source.write_text("int value%s;\n" % i)
+        obj = str(source) + ".o"
+        command = '"%s" -c -MMD -DF_CPU=16000000L "%s" -o "%s"' % (
+            compiler, source, obj)
+        units.append(CompileUnit("sketch", str(source), obj, command))
+
+    return units
+
+
+def test_split_compile_command(tmp_path):
+    unit = make_units(tmp_path, 1)[0]
+    preprocess, compile_, suffix = split_compile_command(unit)
+    assert preprocess[1:] == [
+        "-E", "-MMD", "-MF", unit.object[:-2] + ".d", "-MT", unit.object,
+        "-DF_CPU=16000000L", unit.source]
+    assert compile_[1:] == ["-c", "@SOURCE@", "-o", "@OBJECT@"]
+    assert suffix == ".i"
+
+
+def test_remote_compile(workers, tmp_path):
+    units = make_units(tmp_path, 6)
+    compiler = DistributedCompiler(
+        [worker + (2,) for worker in workers], local_jobs=0, token="secret")
+    assert compiler.jobs == 4
+
+    for unit in units:
+        assert compiler.compile(unit) == (0, "")
+        with open(unit.object) as object_file:
+            assert object_file.read().endswith("remote")
+        assert os.path.exists(unit.object[:-2] + ".d")
+
+
+def test_fallback_to_local(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_HOST", "local")
+    unit = make_units(tmp_path, 1)[0]
+
+    # Nothing listens on the port
+    compiler = DistributedCompiler([("127.0.0.1", 1)], local_jobs=0)
+    assert compiler.compile(unit)[0] == 0
+    with open(unit.object) as object_file:
+        assert object_file.read().endswith("local")
+
+    # Failed worker's slot serves as a local slot afterwards
+    assert compiler.compile(unit)[0] == 0
+
+
+def test_check_compile_args():
+    args = ["-c", "-g", "-Os", "-std=gnu++11", "-fno-exceptions", "-Wall",
+            "-mmcu=atmega328p", "-DF_CPU=16000000L", "-x", "c++",
+            "@SOURCE@", "-o", "@OBJECT@"]
+    assert check_compile_args(args) == args
+
+    for extra in (["-fplugin=/tmp/evil.so"], ["-wrapper", "sh"],
+                  ["-B/tmp"], ["@/tmp/args"], ["-o", "/tmp/other"],
+                  ["-Wl,-T,/tmp/x"], ["-x", "none"]):
+        with pytest.raises(WorkerError):
+            check_compile_args(args[:-3] + extra + args[-3:])
+
+    with pytest.raises(WorkerError):
+        check_compile_args(["-c", "@SOURCE@"])
+
+
+def test_worker_refuses(workers, tmp_path):
+    unit = make_units(tmp_path, 1)[0]
+    compile_ = split_compile_command(unit)[1]
+
+    def request(token, header):
+        sock = socket.create_connection(workers[0])
+        with sock:
+            send_message(sock, {"type": "hello", "token": token})
+            response, _ = recv_message(sock)
+            if response["type"] != "ready":
+                return response
+
+            send_message(sock, header, b"int a;\n")
+            return recv_message(sock)[0]
+
+    header = {"type": "compile", "command": compile_,
+              "toolchain": get_toolchain_identity(compile_[0]),
+              "source_name": "a.c.i"}
+    assert request("wrong", header)["type"] == "error"
+    assert request("secret", header)["type"] == "result"
+
+    for key, value in (("command", compile_ + ["-fplugin=evil.so"]),
+                       ("command", compile_ + ["-DNO_OBJECT"]),
+                       ("source_name", "../../a.sh"),
+                       ("toolchain", None)):
+        bad = dict(header)
+        if value is None:
+            del bad[key]
+        else:
+            bad[key] = value
+        assert request("secret", bad)["type"] == "error"
+
+    # Worker still serves after errors
+    assert request("secret", header)["type"] == "result"
+
+    # Wrong token, units fall back to local compile
+    compiler = DistributedCompiler([workers[0]], local_jobs=0, token="x")
+    assert compiler.compile(unit)[0] == 0
+    assert not compiler._workers[0].alive
+
+
+def test_worker_closes_bad_messages(workers, monkeypatch):
+    monkeypatch.setattr(WorkerServer, "idle_timeout", 0.5)
+
+    def closed(data):
+        sock = socket.create_connection(workers[0])
+        with sock:
+            sock.settimeout(5)
+            sock.sendall(data)
+            return sock.recv(1) == b""
+
+    # Nothing buffered for a 4 GiB header or a huge payload
+    assert closed(struct.pack(">I", 0xffffffff))
+    for size in (1 << 40, -1, "1", 1.5):
+        header = json.dumps({"type": "hello", "size": size}).encode()
+        assert closed(struct.pack(">I", len(header)) + header)
+
+    # Handshake carries no payload
+    sock = socket.create_connection(workers[0])
+    with sock:
+        send_message(sock, {"type": "hello", "token": "secret"}, b"x")
+        assert sock.recv(1) == b""
+
+    # Idle connections time out
+    assert closed(b"")
+
+    # Worker still serves
+    sock = socket.create_connection(workers[0])
+    with sock:
+        send_message(sock, {"type": "hello", "token": "secret"})
+        assert recv_message(sock)[0]["type"] == "ready"
+
+
+def test_serve_requires_token():
+    with pytest.raises(ArduMgrError):
+        serve("0.0.0.0", 0, [])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.emulator` module."""
+
+import os
+import threading
+
+from ardumgr.emulator import Stk500Emulator, emulate
+
+PAGE_SIZE = 128
+
+
+def transact(fd, request, response_size):
+    os.write(fd, request)
+    response = b""
+    while len(response) < response_size:
+        response += os.read(fd, response_size - len(response))
+
+    return response
+
+
+def upload(port, data):
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        assert transact(fd, b"\x30\x20", 2) == b"\x14\x10"
+        assert transact(fd, b"\x41\x81\x20", 3) == b"\x14\x04\x10"
+        assert transact(fd, b"\x50\x20", 2) == b"\x14\x10"
+        assert transact(fd, b"\x75\x20", 5) == b"\x14\x1e\x95\x0f\x10"
+
+        for address in range(0, len(data), PAGE_SIZE):
+            page = data[address:address + PAGE_SIZE]
+            word = address // 2
+            transact(fd, bytes((0x55, word & 0xFF, word >> 8, 0x20)), 2)
+            assert transact(fd, bytes((0x64, 0, len(page), ord("F"))) +
+                            page + b"\x20", 2) == b"\x14\x10"
+
+        transact(fd, b"\x55\x00\x00\x20", 2)
+        readback = transact(fd, bytes((0x74, 0, PAGE_SIZE, ord("F"), 0x20)),
+                            PAGE_SIZE + 2)
+        assert readback[1:-1] == data[:PAGE_SIZE]
+
+        assert transact(fd, b"\x51\x20", 2) == b"\x14\x10"
+    finally:
+        os.close(fd)
+
+
+def test_session_report():
+    data = os.urandom(1000)
+    with Stk500Emulator() as emulator:
+        # Out of sync bytes are rejected
+        fd = os.open(emulator.port, os.O_RDWR | os.O_NOCTTY)
+        assert transact(fd, b"\x30\x30", 1) == b"\x15"
+        os.close(fd)
+
+        upload(emulator.port, data)
+        assert emulator.wait_sessions(1, timeout=5)
+
+    assert bytes(emulator.flash[:len(data)]) == data
+    assert emulator.written.size == len(data)
+
+    report = emulator.report()[0]
+    assert report["pages_written"] == 8
+    assert report["bytes_written"] == len(data)
+    assert report["bytes_read"] == PAGE_SIZE
+    assert report["bytes_per_second"] > 0
+    assert list(report["stages"]) == [
+        "sync", "setup", "write", "verify", "leave"]
+    assert report["stages"]["write"]["commands"] == 16
+
+
+def test_concurrent_uploads():
+    images = [os.urandom(512) for _ in range(4)]
+    with emulate(4, baudrate=1000000) as emulators:
+        threads = [
+            threading.Thread(target=upload, args=(emulator.port, image))
+            for emulator, image in zip(emulators, images)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for emulator, image in zip(emulators, images):
+            assert emulator.wait_sessions(1, timeout=5)
+            assert emulator.written.to_bin() == image
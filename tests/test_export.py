@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.export` module."""
+
+import shutil
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.programmer import Programmer
+from ardumgr.export import export_programmer, write_export, read_export
+
+
+@pytest.fixture
+def programmer(arduino_home):
+    return Programmer(Platform(ArduMgr(arduino_home), "avr"))
+
+
+def test_flatten(programmer):
+    flat = programmer.cfgs.flatten()
+    assert flat["upload.protocol"] == "wiring"
+    assert flat["boards.mega.upload.tool"] == "avrdude"
+    assert sorted(flat.keys()) == sorted(programmer.cfgs.keys())
+
+
+@pytest.mark.parametrize("expand", [False, True])
+def test_export_roundtrip(programmer, arduino_home, tmp_path, expand):
+    path = tmp_path / "mega.json"
+    write_export(export_programmer(programmer, expand), path)
+
+    imported = Programmer.from_export(path)
+    assert imported.platform is None
+    assert imported.menus == programmer.menus
+    assert imported.metric_labels == programmer.metric_labels
+    assert (imported._generate_upload_pattern("/tmp/build", "Blink")
+            == programmer._generate_upload_pattern("/tmp/build", "Blink"))
+
+    imported = Programmer.from_export(
+        read_export(path), {"ardumgr.serial_port": "/dev/ttyACM1"})
+    assert "-P/dev/ttyACM1" in imported._generate_upload_pattern(
+        "/tmp/build", "Blink")
+
+    # Imported without the installation
+    shutil.rmtree(arduino_home["ardumgr.home_path"])
+    manager = ArduMgr.from_export(path)
+    assert manager.platforms == ["avr"]
+    assert manager.version == "1.8.5"
+
+
+def test_expanded_export(programmer):
+    configs = export_programmer(programmer, expand=True)["configs"]
+    pattern = configs["upload.pattern"]
+    assert "{cmd.path}" not in pattern
+    assert "{build.path}/{build.project_name}.hex" in pattern
+    assert "tools.avrdude.cmd.path.windows" not in configs
+
+
+def test_msgpack_export(programmer, tmp_path):
+    pytest.importorskip("msgpack")
+
+    path = tmp_path / "mega.msgpack"
+    write_export(export_programmer(programmer), path)
+    assert Programmer.from_export(path).menus == programmer.menus
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.image` module."""
+
+import io
+import os
+import zlib
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.image import Image, format_ranges, image_size
+from ardumgr.programmer import Programmer
+
+BLINK_HEX = (
+    b":100000000C945C000C946E000C946E000C946E00CA\n"
+    b":100010000C946E000C946E000C946E000C946E00A8\n"
+    b":04002000FFCF00000E\n"
+    b":020000040001F9\n"
+    b":03000000010203F7\n"
+    b":00000001FF\n")
+
+
+def test_parse_hex():
+    image = Image.from_hex(io.BytesIO(BLINK_HEX))
+    segments = image.segments
+    assert [(start, len(view)) for start, view in segments] == [
+        (0, 36), (0x10000, 3)]
+    assert bytes(segments[0][1][:4]) == b"\x0c\x94\x5c\x00"
+    assert bytes(segments[1][1]) == b"\x01\x02\x03"
+    assert image.size == 39
+    assert (image.start, image.end) == (0, 0x10003)
+    del segments
+
+
+@pytest.mark.parametrize("text, message", [
+    (BLINK_HEX.replace(b"CA\n", b"CB\n"), "Checksum mismatch at record 1"),
+    (BLINK_HEX.replace(b"A8\n", b"A9\n"), "Checksum mismatch at record 2"),
+    (BLINK_HEX.replace(b"0E\n", b"0X\n"), "Invalid Intel HEX text"),
+    (BLINK_HEX[:-12], "Missing end of file record"),
+])
+def test_invalid_hex(text, message):
+    with pytest.raises(ArduMgrError) as excinfo:
+        Image.from_hex(io.BytesIO(text))
+
+    assert message in str(excinfo.value)
+
+
+def test_write_read_round_trip(tmp_path):
+    data = bytes(range(256)) * 300
+    image = Image()
+    image.write(0x1F000, data)
+    image.write(0, b"\xaa" * 5)
+    image.write(0x100, bytes(range(50)))
+
+    hex_path = tmp_path / "big.hex"
+    image.write_hex(hex_path, record_size=32)
+    assert Image.from_hex(hex_path) == image
+    assert image_size(hex_path) == len(data) + 55
+
+    # Records are split at 64K windows, out of order records are merged
+    lines = hex_path.read_bytes().splitlines()
+    assert b":020000040002F8" in lines
+    lines.insert(4, lines.pop(5))
+    hex_path.write_bytes(b"\n".join(lines) + b"\n")
+    assert Image.from_hex(hex_path) == image
+
+
+def test_merge_split_fill():
+    application = Image()
+    application.write(0, b"\x01" * 10)
+    bootloader = Image()
+    bootloader.write(0x7E00, b"\x02" * 4)
+
+    application.merge(bootloader)
+    assert application.size == 14
+    with pytest.raises(ArduMgrError):
+        application.merge(bootloader)
+
+    patch = Image()
+    patch.write(8, b"\x03" * 4)
+    application.merge(patch, overwrite=True)
+    assert application.read(6, 8, fill=0) == (
+        b"\x01\x01\x03\x03\x03\x03\x00\x00")
+
+    lower, upper = application.split(10)
+    assert (lower.start, lower.end) == (0, 10)
+    assert [start for start, _ in upper.segments] == [10, 0x7E00]
+    lower.merge(upper)
+    assert lower == application
+
+    binary = application.to_bin()
+    assert len(binary) == 0x7E04
+    assert application.crc32() == zlib.crc32(binary) & 0xFFFFFFFF
+
+    application.fill(0xFF)
+    assert len(application.segments) == 1
+    assert application.to_bin() == binary
+
+
+def test_compare():
+    image = Image()
+    image.write(4, b"\x01" * 200)
+    image.write(0x300, b"\x02\x03")
+    assert image.page_ranges(128) == [(0, 256), (0x300, 0x380)]
+
+    flash = Image()
+    flash.write(0, bytes(image.read(0, 0x400)))
+    assert image.compare(flash, 128) == []
+    assert image.compare(flash, 128, hash_only=True) == []
+
+    flash.write(10, b"\0\0\0")
+    flash.write(0xFF, b"\0")
+    flash.write(0x301, b"\0")
+    # Bytes outside of the image's pages are ignored
+    flash.write(0x200, b"\0")
+    mismatches = image.compare(flash, 128)
+    assert mismatches == [(10, 13), (0xFF, 0x100), (0x301, 0x302)]
+    assert format_ranges(mismatches) == (
+        "0x000A-0x000C, 0x00FF, 0x0301")
+    assert image.compare(flash, 128, hash_only=True) == [
+        (0, 256), (0x300, 0x380)]
+
+
+def test_check_size(arduino_home, tmp_path):
+    programmer = Programmer(Platform(ArduMgr(arduino_home), "avr"), {
+        "ardumgr.board": "uno", "ardumgr.cpu": ""})
+    image_path = tmp_path / "huge.bin"
+    image_path.write_bytes(b"\0" * 32257)
+
+    programmer._cfgs["upload.pattern"] = "true"
+    with pytest.raises(ArduMgrError) as excinfo:
+        programmer.upload_bin(image_path)
+
+    assert "32257" in str(excinfo.value)
+
+    image_path.write_bytes(b"\0" * 32256)
+    assert programmer.upload_bin(image_path) == 0
+    assert Image.load(image_path).size == os.path.getsize(str(image_path))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.jobqueue` module."""
+
+import threading
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.jobqueue import JobQueue, RUNNING
+
+
+@pytest.fixture
+def manager(arduino_home):
+    return ArduMgr(arduino_home)
+
+
+def target(port, board="uno", cpu=""):
+    return {"ardumgr.board": board, "ardumgr.cpu": cpu,
+            "ardumgr.serial_port": port}
+
+
+def test_run_and_resume(manager, tmp_path):
+    db_path = tmp_path / "queue.sqlite"
+    uploaded = []
+    lock = threading.Lock()
+
+    def upload(programmer, image):
+        port = programmer.metric_labels[3]
+        with lock:
+            uploaded.append(port)
+        return 1 if port == "/dev/ttyUSB1" else 0
+
+    with JobQueue(db_path) as queue:
+        for i in range(4):
+            queue.add("Blink.hex", target("/dev/ttyUSB%s" % i))
+        queue.add("Blink.hex", target("/dev/ttyUSB9", "missing"))
+
+        status = queue.run(manager, workers=3, upload=upload)
+        assert status == {"pending": 0, "running": 0, "done": 3,
+                          "failed": 2}
+        assert sorted(uploaded) == ["/dev/ttyUSB%s" % i for i in range(4)]
+
+        failed = queue.jobs(state="failed")
+        assert failed[0].exit_code == 1
+        assert failed[1].exit_code is None
+        assert failed[1].error.startswith("KeyError")
+        assert all(job.duration is not None for job in queue.jobs())
+
+        # Simulate a process killed while uploading
+        job = queue.claim()
+        assert job is None
+        queue.add("Blink.hex", target("/dev/ttyUSB5"))
+        assert queue.claim().state == RUNNING
+
+    del uploaded[:]
+    with JobQueue(db_path) as queue:
+        assert queue.resume() == 3
+        status = queue.run(manager, workers=2, upload=upload)
+        assert sorted(uploaded) == ["/dev/ttyUSB1", "/dev/ttyUSB5"]
+        assert status["done"] == 4
+        assert queue.jobs()[1].attempts == 2
+
+
+def test_batches(manager, tmp_path):
+    with JobQueue(tmp_path / "queue.sqlite") as queue:
+        queue.add("a.hex", target("/dev/ttyUSB0"), batch="a")
+        queue.add("b.hex", target("/dev/ttyUSB0"), batch="b")
+
+        images = []
+        queue.run(manager, batch="b",
+                  upload=lambda programmer, image: images.append(image) or 0)
+        assert images == ["b.hex"]
+        assert queue.status("a")["pending"] == 1
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.libraries` module."""
+
+from ardumgr.libraries import LibraryIndex, resolve_dependencies
+
+
+def make_library(root, headers, sources, legacy=False):
+    src_dir = root if legacy else root / "src"
+    src_dir.mkdir(parents=True)
+    if not legacy:
+        (root / "library.properties").write_text("name=%s\n" % root.name)
+
+    for name, content in list(headers.items()) + list(sources.items()):
+        (src_dir / name).write_text(content)
+
+
+def test_index_and_dependencies(tmp_path):
+    user_dir = tmp_path / "sketchbook"
+    ide_dir = tmp_path / "ide"
+    make_library(user_dir / "Servo", {"Servo.h": ""}, {})
+    make_library(ide_dir / "Servo", {"Servo.h": ""}, {})
+    make_library(ide_dir / "Wire", {"Wire.h": ""},
+                 {"Wire.cpp": '#include "Wire.h"\n#include "twi.h"\n'},
+                 legacy=True)
+
+    cache_path = tmp_path / "cache" / "libraries.json"
+    index = LibraryIndex([user_dir, ide_dir], cache_path)
+    assert index.resolve("Servo.h").root == str(user_dir / "Servo")
+    assert index.resolve("Wire.h").legacy
+    assert cache_path.exists()
+
+    sketch = tmp_path / "sketch.cpp"
+    sketch.write_text(
+        "#include <Arduino.h>\n  # include <Servo.h>\n#include <Wire.h>\n")
+    libraries, unresolved = resolve_dependencies(index, [sketch], jobs=2)
+    assert [lib.name for lib in libraries] == ["Servo", "Wire"]
+    assert unresolved == set(["Arduino.h", "twi.h"])
+
+    # Reloaded from cache without changes, then a new library is noticed
+    index = LibraryIndex([user_dir, ide_dir], cache_path)
+    assert not index.update()
+    make_library(ide_dir / "SPI", {"SPI.h": ""}, {})
+    assert index.update()
+    assert index.resolve("SPI.h").name == "SPI"
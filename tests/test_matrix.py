@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.matrix` module."""
+
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.matrix import BuildMatrix, TIMINGS_FILE_NAME, write_json
+
+from .test_builder import FAKE_TOOLCHAIN, RECIPES_TXT
+
+# Menus of mega only change build.mcu, which fake recipes don't use
+BOARDS = ["avr:mega:cpu=atmega2560", "avr:mega:cpu=atmega1280", "avr:uno"]
+
+
+@pytest.fixture
+def manager(arduino_home):
+    platform_path = (Path(arduino_home["ardumgr.home_path"]) / "hardware" /
+                     "arduino" / "avr")
+    (platform_path / "toolchain.py").write_text(FAKE_TOOLCHAIN)
+    with (platform_path / "platform.txt").open("a") as platform_file:
+        platform_file.write(RECIPES_TXT)
+
+    core_path = platform_path / "cores" / "arduino"
+    core_path.mkdir(parents=True)
+    (core_path / "main.cpp").write_text("int main() {}\n")
+    (core_path / "wiring.c").write_text("void init() {}\n")
+
+    for variant in ("mega", "standard"):
+        variant_path = platform_path / "variants" / variant
+        variant_path.mkdir(parents=True)
+        (variant_path / "pins.c").write_text("int %s_pins;\n" % variant)
+
+    arduino_home["python"] = sys.executable
+    return ArduMgr(arduino_home)
+
+
+def make_sketch(path, source):
+    path.mkdir()
+    (path / (path.name + ".cpp")).write_text(source)
+    return path
+
+
+def test_build_matrix(manager, tmp_path):
+    sketches = [make_sketch(tmp_path / "Blink", "int blink;\n"),
+                make_sketch(tmp_path / "Fade", "int fade;\n")]
+    build_root = tmp_path / "matrix"
+
+    def run():
+        return BuildMatrix(manager, sketches, BOARDS, build_root, 3).run()
+
+    result = run()
+    assert result.cores == 2
+    assert [(Path(job.sketch).name, job.board) for job in result.jobs] == [
+        (sketch.name, board) for sketch in sketches for board in BOARDS]
+    assert all(job.error is None and job.linked for job in result.jobs)
+    assert [job.compiled for job in result.jobs] == [1] * 6
+
+    # Both mega menus link the same core build
+    mega, mega1280, uno = result.jobs[:3]
+    assert mega.fingerprint == mega1280.fingerprint != uno.fingerprint
+    assert len(list((build_root / "cores").glob("*/core/core.a"))) == 2
+    elf_text = Path(mega1280.elf).read_text()
+    assert "int blink;" in elf_text
+    assert "int mega_pins;" in elf_text and "void init() {}" in elf_text
+    assert (Path(mega1280.elf).parent / "Blink.hex").exists()
+
+    # Core units, core archive then link at least
+    assert len(result.critical_path) >= 3
+    assert result.critical_path[-1].name.endswith(".elf")
+    assert result.critical_seconds == pytest.approx(
+        sum(timing.seconds for timing in result.critical_path))
+    durations = json.loads(
+        (build_root / TIMINGS_FILE_NAME).read_text())["durations"]
+    assert all(timing.name in durations for timing in result.critical_path)
+
+    output = io.StringIO()
+    write_json(result, output)
+    assert json.loads(output.getvalue())["cores"] == 2
+
+    # Up to date units are not scheduled, archives and links are no-ops
+    result = run()
+    assert all(job.compiled == 0 and not job.linked for job in result.jobs)
+
+    (sketches[1] / "Fade.cpp").write_text("int fade = 1;\n")
+    result = run()
+    assert [job.compiled for job in result.jobs] == [0, 0, 0, 1, 1, 1]
+    assert "int fade = 1;" in Path(result.jobs[5].elf).read_text()
+
+
+def test_failed_job(manager, tmp_path):
+    sketches = [make_sketch(tmp_path / "Good", "int good;\n"),
+                make_sketch(tmp_path / "Bad", '#include "missing.h"\n')]
+    result = BuildMatrix(
+        manager, sketches, BOARDS[:1], tmp_path / "matrix").run()
+
+    good, bad = result.jobs
+    assert good.error is None and good.linked
+    assert bad.error is not None and not bad.linked
+    assert "missing.h" in bad.error
+
+    with pytest.raises(ArduMgrError):
+        BuildMatrix(manager, [sketches[0], tmp_path / "other" / "Good"],
+                    BOARDS, tmp_path / "matrix")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.metrics` module."""
+
+from ardumgr import metrics
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.programmer import Programmer
+
+
+def test_registry_expose(tmp_path):
+    registry = metrics.Registry()
+    counter = registry.counter("jobs_total", "Jobs", ("port",))
+    histogram = registry.histogram(
+        "job_seconds", "Job duration", ("port",), buckets=(1, 10))
+
+    counter.inc(("/dev/tty\"0",))
+    histogram.observe(("a",), 5)
+
+    text = registry.expose()
+    assert 'jobs_total{port="/dev/tty\\"0"} 1' in text
+    assert 'job_seconds_bucket{port="a",le="1.0"} 0' in text
+    assert 'job_seconds_bucket{port="a",le="+Inf"} 1' in text
+    assert 'job_seconds_count{port="a"} 1' in text
+
+    path = tmp_path / "ardumgr.prom"
+    registry.write_textfile(path)
+    assert path.read_text() == text
+
+
+def test_upload_records_metrics(arduino_home, tmp_path):
+    programmer = Programmer(Platform(ArduMgr(arduino_home), "avr"))
+    labels = programmer.metric_labels
+    image_path = tmp_path / "blink.hex"
+    image_path.write_text(
+        ":100000000C945C000C946E000C946E000C946E00CA\n"
+        ":00000001FF\n")
+
+    failed = metrics.upload_exit_codes.get(labels + (1,))
+    retries = metrics.upload_retries.get(labels)
+    programmer._cfgs["upload.pattern"] = "exit 1"
+    assert programmer.upload_bin(image_path, retries=2) == 1
+    assert metrics.upload_exit_codes.get(labels + (1,)) == failed + 3
+    assert metrics.upload_retries.get(labels) == retries + 2
+
+    flashed = metrics.upload_bytes.get(labels)
+    count = metrics.upload_duration.get_count(labels)
+    programmer._cfgs["upload.pattern"] = "true"
+    assert programmer.upload_bin(image_path) == 0
+    assert metrics.upload_bytes.get(labels) == flashed + 16
+    assert metrics.upload_duration.get_count(labels) == count + 1
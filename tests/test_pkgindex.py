@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.pkgindex` module."""
+
+import io
+import json
+import os
+
+import pytest
+
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.pkgindex import JsonStream, PackageIndex, version_key
+
+
+def avr_platform(version, boards, avrdude="6.3.0-arduino9"):
+    return {
+        "name": "Arduino AVR Boards",
+        "architecture": "avr",
+        "version": version,
+        "category": "Arduino",
+        "archiveFileName": "avr-%s.tar.bz2" % version,
+        "size": "4897949",
+        "boards": [{"name": name} for name in boards],
+        "toolsDependencies": [
+            {"packager": "arduino", "name": "avr-gcc",
+             "version": "5.4.0-atmel3.6.1-arduino2"},
+            {"packager": "arduino", "name": "avrdude", "version": avrdude},
+        ],
+    }
+
+
+ARDUINO_INDEX = {
+    "packages": [{
+        # Platforms before package fields
+        "platforms": [
+            avr_platform("1.6.9", ["Arduino Uno", "Arduino Yún"],
+                         "6.0.1-arduino5"),
+            avr_platform("1.6.21", ["Arduino Uno", "Arduino Mega"]),
+            avr_platform("1.6.10", ["Arduino Uno"]),
+        ],
+        "tools": [{
+            "name": "avrdude",
+            "version": "6.3.0-arduino9",
+            "systems": [
+                {"host": "x86_64-linux-gnu", "url": "http://a/linux.tgz",
+                 "archiveFileName": "linux.tgz", "size": "1"},
+                {"host": "i686-mingw32", "url": "http://a/win.zip",
+                 "archiveFileName": "win.zip", "size": "2"},
+            ],
+        }],
+        "name": "arduino",
+        "maintainer": "Arduino",
+        "help": {"online": "http://www.arduino.cc/en/Reference/HomePage"},
+    }],
+}
+
+THIRD_PARTY_INDEX = {
+    "packages": [{
+        "name": "esp8266",
+        "platforms": [{
+            "name": "esp8266", "architecture": "esp8266", "version": "2.4.1",
+            "boards": [{"name": "WeMos D1 R2 & mini"},
+                       {"name": "Generic ESP8266 Module"}],
+            "toolsDependencies": [],
+        }],
+        "tools": [],
+    }],
+}
+
+
+@pytest.fixture
+def index_files(tmp_path):
+    arduino = tmp_path / "package_index.json"
+    arduino.write_text(json.dumps(ARDUINO_INDEX, indent=1))
+    third_party = tmp_path / "package_esp8266com_index.json"
+    third_party.write_text(json.dumps(THIRD_PARTY_INDEX))
+    return arduino, third_party
+
+
+def test_json_stream():
+    text = '{"a": [1, {"b": 2}, 12345678], "c": "x\\"y", "d": []}'
+    stream = JsonStream(io.StringIO(text), chunk_size=3)
+
+    values = []
+    for key in stream.iter_object():
+        if key == "a":
+            for _ in stream.iter_array():
+                values.append(stream.decode())
+        elif key == "d":
+            values.append(list(stream.iter_array()))
+        else:
+            values.append(stream.decode())
+
+    assert values == [1, {"b": 2}, 12345678, 'x"y', []]
+
+    with pytest.raises(ArduMgrError):
+        for _ in JsonStream(io.StringIO('[1, 2')).iter_array():
+            pass
+
+
+def test_version_key():
+    versions = ["1.6.10", "1.6.9", "1.6.21", "1.6.21-rc1", "1.10"]
+    assert sorted(versions, key=version_key) == [
+        "1.6.9", "1.6.10", "1.6.21-rc1", "1.6.21", "1.10"]
+
+
+def test_queries(index_files, tmp_path):
+    with PackageIndex(index_files, tmp_path / "index.sqlite") as index:
+        assert index.counts["platforms"] == 4
+        assert [(board.package, board.version) for board in
+                index.find_boards("uno")] == [("arduino", "1.6.21")]
+        assert len(index.find_boards("uno", all_versions=True)) == 3
+        assert index.find_boards("yún", all_versions=True)[0].version == (
+            "1.6.9")
+        assert index.find_boards("D1 R2 &")[0].architecture == "esp8266"
+        assert index.find_boards("%") == []
+
+        assert index.get_platform("arduino", "avr").version == "1.6.21"
+        assert index.get_boards("arduino", "avr", "1.6.9") == [
+            "Arduino Uno", "Arduino Yún"]
+        dependencies = index.get_tool_dependencies("arduino", "avr", "1.6.9")
+        assert dependencies[1] == ("arduino", "avrdude", "6.0.1-arduino5")
+        assert [system.host for system in index.get_tool_systems(
+            "arduino", "avrdude", "6.3.0-arduino9")] == [
+                "x86_64-linux-gnu", "i686-mingw32"]
+
+        with pytest.raises(ArduMgrError):
+            index.get_platform("arduino", "sam")
+
+
+def test_update_only_changed(index_files, tmp_path):
+    arduino, third_party = index_files
+    db_path = tmp_path / "index.sqlite"
+    with PackageIndex(index_files, db_path) as index:
+        assert index.update() == []
+
+    with PackageIndex(index_files, db_path) as index:
+        assert index.update() == []
+
+        content = json.loads(json.dumps(THIRD_PARTY_INDEX))
+        content["packages"][0]["platforms"][0]["version"] = "2.5.0"
+        third_party.write_text(json.dumps(content))
+        stat = third_party.stat()
+        os.utime(str(third_party), ns=(stat.st_atime_ns,
+                                       stat.st_mtime_ns + 1000000000))
+        assert index.update() == [str(third_party)]
+        assert index.get_platform("esp8266", "esp8266").version == "2.5.0"
+        assert index.counts["platforms"] == 4
+
+        arduino.unlink()
+        assert index.update() == []
+        assert index.counts["packages"] == 1
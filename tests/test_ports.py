@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.ports` module."""
+
+import os
+import threading
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.ports import (PortPool, PortLeaseTimeout, enumerate_ports,
+                           get_board_ids)
+
+
+def add_usb_tty(sysfs_root, name, usb_name, vid, pid, serial=None):
+    usb_dir = sysfs_root / "devices" / "usb1" / usb_name
+    interface_dir = usb_dir / ("%s:1.0" % usb_name)
+    interface_dir.mkdir(parents=True)
+    (usb_dir / "idVendor").write_text(vid + "\n")
+    (usb_dir / "idProduct").write_text(pid + "\n")
+    (usb_dir / "product").write_text("Arduino\n")
+    if serial is not None:
+        (usb_dir / "serial").write_text(serial + "\n")
+
+    tty_dir = sysfs_root / "class" / "tty" / name
+    tty_dir.mkdir(parents=True)
+    os.symlink(str(interface_dir), str(tty_dir / "device"))
+
+
+@pytest.fixture
+def sysfs_root(tmp_path):
+    root = tmp_path / "sys"
+    add_usb_tty(root, "ttyACM0", "1-1", "2341", "0043", "A1")
+    add_usb_tty(root, "ttyACM1", "1-2", "2341", "0043", "A2")
+    add_usb_tty(root, "ttyUSB0", "1-3", "2341", "0010")
+
+    # Virtual and legacy ports
+    (root / "class" / "tty" / "tty0").mkdir()
+    legacy_dir = root / "devices" / "platform" / "serial8250"
+    legacy_dir.mkdir(parents=True)
+    (root / "class" / "tty" / "ttyS0").mkdir()
+    os.symlink(str(legacy_dir), str(root / "class" / "tty" / "ttyS0" /
+                                    "device"))
+    return root
+
+
+@pytest.fixture
+def platform(arduino_home):
+    return Platform(ArduMgr(arduino_home), "avr")
+
+
+def test_enumerate_ports(sysfs_root):
+    ports = enumerate_ports(str(sysfs_root), "/dev")
+    assert [port.device for port in ports] == [
+        "/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyUSB0"]
+    assert ports[0][2:] == ("0x2341", "0x0043", "A1", None, "Arduino", "1-1")
+
+    # Unplugged while enumerating
+    (sysfs_root / "devices" / "usb1" / "1-2" / "idProduct").unlink()
+    assert [port.name for port in enumerate_ports(str(sysfs_root))] == [
+        "ttyACM0", "ttyUSB0"]
+
+
+def test_board_matching(sysfs_root, platform):
+    assert get_board_ids(platform) == {
+        ("0x2341", "0x0043"): ["uno"],
+        ("0x2341", "0x0010"): ["mega"],
+    }
+
+    pool = PortPool(str(sysfs_root), "/dev")
+    assert [port.name for port in pool.find_ports(platform, "uno")] == [
+        "ttyACM0", "ttyACM1"]
+    assert pool.get_boards(platform, pool.ports[2]) == ["mega"]
+
+    # Cached until interval elapsed
+    add_usb_tty(sysfs_root, "ttyACM2", "1-4", "2341", "0043")
+    assert len(pool.find_ports(platform, "uno")) == 2
+    pool.refresh(force=True)
+    assert len(pool.find_ports(platform, "uno")) == 3
+
+
+def test_lease(sysfs_root, platform):
+    pool = PortPool(str(sysfs_root), "/dev")
+
+    with pool.lease(platform, "uno") as first:
+        with pool.lease(platform, "uno") as second:
+            assert first.device != second.device
+            with pytest.raises(PortLeaseTimeout):
+                pool.acquire(platform, "uno", timeout=0.05)
+
+            # Released by another thread while waiting
+            timer = threading.Timer(0.05, pool.release, [second])
+            timer.start()
+            third = pool.acquire(platform, "uno", timeout=5)
+            assert third.device == second.device
+            pool.release(third)
+
+        assert pool.leased == set([first.device])
+
+    assert pool.leased == set()
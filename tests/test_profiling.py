@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.profiling` module."""
+
+import json
+
+from ardumgr import profiling
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+
+
+def test_profiler_records_hot_paths(arduino_home):
+    events = []
+    profiler = profiling.enable()
+    profiler.add_hook(lambda kind, name, value: events.append(name))
+    try:
+        manager = ArduMgr(arduino_home)
+        Platform(manager, "avr").boards
+    finally:
+        assert profiling.disable() is profiler
+
+    summary = json.loads(profiler.format_json())
+    assert summary["counters"]["configs.load.files"] == 4
+    assert summary["timers"]["platform.init"]["calls"] == 1
+    assert summary["timers"]["configs.get_children"]["calls"] == 1
+    assert "configs.load" in events
+    assert "configs.load.keys" in profiler.format_table()
+
+
+def test_profiler_disabled(arduino_home):
+    profiler = profiling.enable()
+    profiling.disable()
+    ArduMgr(arduino_home)
+    assert profiling.active is None
+    assert profiler.summary()["counters"] == {}
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.programmer` module."""
+
+from pathlib import Path
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.programmer import Programmer
+from ardumgr.exceptions import ArduMgrError
+
+MENU_BOARDS_TXT = """\
+menu.speed=CPU Speed
+pro.name=Pro Mini
+pro.upload.tool=avrdude
+pro.menu.speed.16mhz=16 MHz
+pro.menu.speed.16mhz.build.f_cpu=16000000L
+pro.menu.speed.8mhz=8 MHz
+pro.menu.speed.8mhz.build.f_cpu=8000000L
+pro.menu.speed.8mhz.upload.speed=57600
+pro.menu.cpu.atmega328=ATmega328P
+pro.menu.cpu.atmega328.upload.speed=115200
+pro.menu.cpu.atmega328.build.mcu=atmega328p
+"""
+
+
+@pytest.fixture
+def menu_platform(arduino_home):
+    boards_path = (Path(arduino_home["ardumgr.home_path"]) / "hardware" /
+                   "arduino" / "avr" / "boards.txt")
+    with boards_path.open("a") as boards_file:
+        boards_file.write(MENU_BOARDS_TXT)
+
+    arduino_home["ardumgr.board"] = "pro"
+    arduino_home["ardumgr.cpu"] = "atmega328"
+    return Platform(ArduMgr(arduino_home), "avr")
+
+
+def test_board_menus(menu_platform):
+    assert list(menu_platform.menus.keys()) == ["cpu", "speed"]
+    menus = menu_platform.get_board_menus("pro")
+    assert list(menus.keys()) == ["cpu", "speed"]
+    assert list(menus["speed"].keys()) == ["16mhz", "8mhz"]
+    assert menu_platform.get_board_supported_cpus("pro") == ["atmega328"]
+    assert "menu" not in menu_platform.boards
+
+
+def test_menu_options_layered_in_declaration_order(menu_platform):
+    programmer = Programmer(menu_platform)
+    assert programmer.menus == {"cpu": "atmega328", "speed": "16mhz"}
+    assert programmer._cfgs["build.f_cpu"] == "16000000L"
+
+    menu_platform.cfgs["ardumgr.menu.speed"] = "8mhz"
+    programmer = Programmer(menu_platform)
+    assert programmer._cfgs["build.f_cpu"] == "8000000L"
+    # speed menu declared after cpu menu, so it overrides cpu's options
+    assert programmer._cfgs["upload.speed"] == "57600"
+    assert programmer._cfgs["custom_speed"] == "pro_8mhz"
+
+
+def test_invalid_menu_option(menu_platform):
+    menu_platform.cfgs["ardumgr.menu.speed"] = "20mhz"
+    with pytest.raises(ArduMgrError):
+        Programmer(menu_platform)
+
+
+def test_default_cpu(arduino_home):
+    del arduino_home["ardumgr.cpu"]
+    arduino_home["ardumgr.board"] = "uno"
+    programmer = Programmer(Platform(ArduMgr(arduino_home), "avr"))
+    assert programmer.menus == {}
+    assert programmer._cfgs["upload.protocol"] == "arduino"
+
+
+def test_expand_for_os(arduino_home):
+    programmer = Programmer(Platform(ArduMgr(arduino_home), "avr"))
+    expanded = programmer.expand_for_os(
+        ["upload.pattern", "build.mcu"], build_path="/tmp/build",
+        project_name="Blink.ino")
+    assert list(expanded.keys()) == ["linux", "windows", "macosx"]
+    assert expanded["linux"]["build.mcu"] == "atmega2560"
+    assert "/bin/avrdude\"" in expanded["linux"]["upload.pattern"]
+    assert "/bin/avrdude.exe\"" in expanded["windows"]["upload.pattern"]
+    assert expanded["macosx"]["upload.pattern"] == (
+        expanded["linux"]["upload.pattern"])
+    assert expanded["linux"]["upload.pattern"] == (
+        programmer._generate_upload_pattern("/tmp/build", "Blink.ino"))
+
+    expanded = programmer.expand_for_os(["build.mcu"], ["windows"])
+    assert list(expanded.keys()) == ["windows"]
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.registry` module."""
+
+import shutil
+from pathlib import Path
+
+import pytest
+
+from ardumgr.configs import Platform
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.registry import ArduMgrRegistry, parse_constraint
+from ardumgr.ardumgr import version_to_int
+
+
+@pytest.fixture
+def homes(arduino_home, tmp_path):
+    """Homes of 1.8.5, 1.8.9 (same avr platform) and 1.0.5 (old style)"""
+
+    base_dir = tmp_path / "homes"
+    base_dir.mkdir()
+    home_path = Path(arduino_home["ardumgr.home_path"])
+    shutil.copytree(str(home_path), str(base_dir / "arduino-1.8.5"))
+    shutil.copytree(str(home_path), str(base_dir / "arduino-1.8.9"))
+    (base_dir / "arduino-1.8.9" / "revisions.txt").write_text(
+        "ARDUINO 1.8.9 - 2019.03.15\n")
+
+    old_home = base_dir / "arduino-1.0.5"
+    (old_home / "lib").mkdir(parents=True)
+    (old_home / "lib" / "version.txt").write_text("1.0.5\n")
+    shutil.copytree(
+        str(home_path / "hardware" / "arduino" / "avr"),
+        str(old_home / "hardware" / "arduino"))
+
+    (base_dir / "not-arduino").mkdir()
+    return base_dir
+
+
+def test_parse_constraint():
+    check = parse_constraint(">=1.6.10, <1.9")
+    assert check(version_to_int("1.8.5"))
+    assert not check(version_to_int("1.9.0"))
+    assert not check(version_to_int("1.0.5"))
+    assert parse_constraint("1.8.5")(version_to_int("1.8.5"))
+
+    with pytest.raises(ArduMgrError):
+        parse_constraint(">=abc")
+
+
+def test_registry(homes):
+    registry = ArduMgrRegistry({"ardumgr.platform": "avr"})
+    found = registry.discover([homes])
+    assert len(found) == 3
+    assert registry.discover([homes / "arduino-1.8.5"]) == [found[1]]
+
+    assert [manager.version for manager in registry.managers] == [
+        "1.8.9", "1.8.5", "1.0.5"]
+    assert registry.get().version == "1.8.9"
+    assert registry.get("<1.8.9").version == "1.8.5"
+    assert registry.get("<1.5", platform="avr").version == "1.0.5"
+    assert registry.find(">=1.6", platform="sam") == []
+    with pytest.raises(ArduMgrError):
+        registry.get(">2")
+
+
+def test_shared_file_cache(homes):
+    registry = ArduMgrRegistry()
+    registry.discover([homes])
+
+    cache = registry.file_cache
+    misses = cache.misses
+    platforms = [Platform(manager, "avr") for manager in registry.managers]
+
+    # Each platform file parsed once for all installations
+    assert cache.misses - misses == 3
+    assert cache.hits >= 6
+    for platform in platforms:
+        assert platform.cfgs["boards.mega.name"] == (
+            "Arduino/Genuino Mega or Mega 2560")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.size` module."""
+
+import io
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.exceptions import ArduMgrError
+from ardumgr.image import Image
+from ardumgr.size import parse_identity, measure, write_csv, write_json
+
+# Fake "avr-size -A": images contain the report itself
+FAKE_SIZE = """\
+import sys
+sys.stdout.write(open(sys.argv[1]).read())
+"""
+
+RECIPES_TXT = r"""
+size.tool={python} "{runtime.platform.path}/size.py"
+recipe.size.pattern={size.tool} "{build.path}/{build.project_name}.elf"
+recipe.size.regex=^(?:\.text|\.data|\.bootloader)\s+([0-9]+).*
+recipe.size.regex.data=^(?:\.data|\.bss|\.noinit)\s+([0-9]+).*
+"""
+
+REPORT = """\
+section    size      addr
+.data        %s   8388864
+.text       %s         0
+.bss         %s   8388864
+Total      999
+"""
+
+
+@pytest.fixture
+def manager(arduino_home):
+    platform_path = (Path(arduino_home["ardumgr.home_path"]) / "hardware" /
+                     "arduino" / "avr")
+    (platform_path / "size.py").write_text(FAKE_SIZE)
+    with (platform_path / "platform.txt").open("a") as platform_file:
+        platform_file.write(RECIPES_TXT)
+
+    arduino_home["python"] = sys.executable
+    return ArduMgr(arduino_home)
+
+
+def test_parse_identity():
+    platform_id, preferences = parse_identity("avr:mega:cpu=atmega1280,x=y")
+    assert platform_id == "avr"
+    assert list(preferences.items()) == [
+        ("ardumgr.board", "mega"),
+        ("ardumgr.cpu", "atmega1280"),
+        ("ardumgr.menu.x", "y"),
+    ]
+
+    with pytest.raises(ArduMgrError):
+        parse_identity("mega")
+
+
+def test_measure(manager, tmp_path):
+    small = tmp_path / "small.elf"
+    small.write_text(REPORT % (100, 30000, 500))
+    large = tmp_path / "large.elf"
+    large.write_text(REPORT % (100, 200000, 500))
+    # Flash images are measured without the size recipe
+    large_hex = tmp_path / "large.hex"
+    Image.from_bin(io.BytesIO(b"\x0c" * 40000)).write_hex(str(large_hex))
+    small_bin = tmp_path / "small.bin"
+    small_bin.write_bytes(b"\x0c" * 1000)
+
+    results = measure(manager, [
+        (str(small), "avr:uno"),
+        (str(large), "avr:uno"),
+        (str(large), "avr:mega:cpu=atmega2560"),
+        (str(large_hex), "avr:uno"),
+        (str(large_hex), "avr:mega:cpu=atmega2560"),
+        (str(small_bin), "avr:uno"),
+        (str(tmp_path / "missing.elf"), "avr:uno"),
+        (str(tmp_path / "missing.hex"), "avr:uno"),
+    ], jobs=2)
+
+    assert [result[2:7] for result in results[:6]] == [
+        (30100, 32256, 600, 2048, True),
+        (200100, 32256, 600, 2048, False),
+        (200100, 253952, 600, 8192, True),
+        (40000, 32256, None, 2048, False),
+        (40000, 253952, None, 8192, True),
+        (1000, 32256, None, 2048, True),
+    ]
+    assert all((not result.passed) and result.error
+               for result in results[6:])
+
+    output = io.StringIO()
+    write_json(results, output)
+    assert json.loads(output.getvalue())[0]["board"] == "avr:uno"
+
+    output = io.StringIO()
+    write_csv(results[:1], output)
+    assert output.getvalue().splitlines() == [
+        "path,board,flash,max_flash,data,max_data,passed,error",
+        "%s,avr:uno,30100,32256,600,2048,True," % small,
+    ]
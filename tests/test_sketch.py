@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.sketch` module."""
+
+import os
+
+from ardumgr.sketch import get_ino_files, scan_functions, convert, preprocess
+
+BLINK_INO = """\
+// Blink with a helper
+#include "config.h"
+
+struct Pin { int number; };
+int counter = 0;
+void blink(int times);
+
+void setup() {
+    pinMode(LED, OUTPUT);
+    if (check("{")) { blink(2); }
+}
+
+ISR(TIMER1_vect) {
+}
+
+void loop() { blink(count(3)); }
+
+int Pin::read() { return 0; }
+"""
+
+HELPERS_INO = """\
+static int count(int value) {
+    return value * 2;
+}
+
+void blink(int times) /* comment */ {
+}
+
+bool check(const char *text, int
+           base = 10) {
+    return text[0] != '}';
+}
+"""
+
+
+def test_get_ino_files(tmp_path):
+    sketch_path = tmp_path / "Blink"
+    sketch_path.mkdir()
+    for name in ("a.ino", "Blink.ino", "z.ino", "b.cpp"):
+        (sketch_path / name).write_text("")
+
+    assert [os.path.basename(apath) for apath in get_ino_files(
+        sketch_path)] == ["Blink.ino", "a.ino", "z.ino"]
+
+
+def test_scan_functions():
+    definitions, declarations = scan_functions(BLINK_INO)
+    assert definitions == [(8, "void setup();"), (16, "void loop();")]
+    assert declarations == set(["void blink(int times);"])
+
+    definitions, _ = scan_functions(HELPERS_INO)
+    assert [prototype for _, prototype in definitions] == [
+        "static int count(int value);",
+        "void blink(int times);",
+        "bool check(const char *text, int base = 10);",
+    ]
+
+
+def test_convert():
+    text = convert([("/s/Blink.ino", BLINK_INO),
+                    ("/s/helpers.ino", HELPERS_INO)])
+    lines = text.splitlines()
+    assert lines[:2] == ["#include <Arduino.h>", '#line 1 "/s/Blink.ino"']
+
+    # Prototypes inserted before the first definition
+    index = lines.index("void setup();")
+    assert lines[index:index + 4] == [
+        "void setup();",
+        "void loop();",
+        "static int count(int value);",
+        '#line 8 "/s/Blink.ino"',
+    ]
+    assert lines[index - 2] == "void blink(int times);"
+    assert lines[index + 4] == "void setup() {"
+    assert '#line 1 "/s/helpers.ino"' in lines
+
+
+def test_preprocess_cache(tmp_path):
+    sketch_path = tmp_path / "Blink"
+    sketch_path.mkdir()
+    ino_path = sketch_path / "Blink.ino"
+    ino_path.write_text("void setup() {}\n")
+    output_path = tmp_path / "build" / "Blink.ino.cpp"
+
+    assert preprocess(sketch_path, output_path)
+    assert "void setup();" in output_path.read_text()
+    assert not preprocess(sketch_path, output_path)
+
+    # Touched without changes
+    os.utime(str(ino_path), (0, 0))
+    assert not preprocess(sketch_path, output_path)
+
+    ino_path.write_text("void loop() {}\n")
+    assert preprocess(sketch_path, output_path)
+    assert "void loop();" in output_path.read_text()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.stk500` module."""
+
+import os
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.emulator import Stk500Emulator
+from ardumgr.image import Image
+from ardumgr.programmer import Programmer
+
+pytest.importorskip("serial")
+
+
+@pytest.fixture
+def platform(arduino_home):
+    return Platform(ArduMgr(arduino_home), "avr")
+
+
+def make_programmer(platform, port, **preferences):
+    preferences.update({
+        "ardumgr.board": "uno",
+        "ardumgr.cpu": "",
+        "ardumgr.serial_port": port,
+        "ardumgr.native_upload": "true",
+    })
+    return Programmer(platform, preferences)
+
+
+def test_native_upload(platform, tmp_path):
+    image = Image()
+    image.write(0, os.urandom(1000))
+    image.write(0x7E00, b"\x01\x02")
+    image_path = tmp_path / "Blink.hex"
+    image.write_hex(image_path)
+
+    with Stk500Emulator() as emulator:
+        programmer = make_programmer(platform, emulator.port)
+        uploader = programmer.get_native_uploader()
+        assert (uploader.baudrate, uploader.page_size) == (115200, 128)
+        assert uploader.verify
+
+        programmer._cfgs["upload.pattern"] = "exit 1"
+        assert programmer.upload_bin(image_path) == 0
+        assert emulator.wait_sessions(1, timeout=5)
+
+    report = emulator.report()[0]
+    assert report["pages_written"] == 9
+    assert report["bytes_read"] == 9 * 128
+    assert bytes(emulator.flash[:1000]) == image.read(0, 1000)
+    assert emulator.flash[0x7E00:0x7E02] == b"\x01\x02"
+
+
+def test_native_upload_failures(platform, tmp_path):
+    image_path = tmp_path / "Blink.bin"
+    image_path.write_bytes(b"\0" * 200)
+
+    with Stk500Emulator(signature=b"\x1e\x98\x01") as emulator:
+        programmer = make_programmer(platform, emulator.port)
+        assert programmer.upload_bin(image_path, retries=1) == 1
+        assert emulator.finished_sessions == []
+
+
+def test_native_upload_selection(platform):
+    # Mega 2560 uses protocol "wiring"
+    programmer = Programmer(platform, {"ardumgr.native_upload": "true"})
+    assert programmer.get_native_uploader() is None
+
+    programmer = Programmer(platform, {
+        "ardumgr.board": "uno", "ardumgr.cpu": ""})
+    assert programmer.get_native_uploader() is None
+
+    # Unknown MCUs use avrdude
+    programmer = make_programmer(platform, "/dev/null")
+    programmer._cfgs["build.mcu"] = "attiny85"
+    assert programmer.get_native_uploader() is None
+
+
+def test_native_upload_without_verify(platform, tmp_path):
+    image_path = tmp_path / "Blink.bin"
+    image_path.write_bytes(os.urandom(200))
+
+    with Stk500Emulator() as emulator:
+        programmer = make_programmer(
+            platform, emulator.port, **{"ardumgr.verify": "false"})
+        assert not programmer.get_native_uploader().verify
+        assert programmer.upload_bin(image_path) == 0
+        assert emulator.wait_sessions(1, timeout=5)
+
+    report = emulator.report()[0]
+    assert (report["pages_written"], report["bytes_read"]) == (2, 0)
+
+
+def test_dump_and_verify(platform, tmp_path):
+    image = Image()
+    image.write(0x100, os.urandom(300))
+    image_path = tmp_path / "Blink.hex"
+    image.write_hex(image_path)
+
+    with Stk500Emulator() as emulator:
+        emulator.flash[0x100:0x100 + 300] = image.read(0x100, 300)
+        emulator.flash[0x180] ^= 0xFF
+        # Reading flash doesn't need native uploads
+        programmer = make_programmer(
+            platform, emulator.port, **{"ardumgr.native_upload": "false"})
+        assert programmer.verify_bin(image_path) == [(0x180, 0x181)]
+        assert programmer.verify_bin(image_path, hash_only=True) == [
+            (0x100, 0x280)]
+
+        flash = programmer.dump()
+        assert emulator.wait_sessions(3, timeout=5)
+
+    assert emulator.report()[0]["bytes_read"] == 3 * 128
+    assert (flash.start, flash.end) == (0, 32256)
+    assert flash.read(0, 0x100) == b"\xff" * 0x100
+
+    dump_path = tmp_path / "dump.bin"
+    flash.write_bin(dump_path)
+    assert programmer.verify_bin(image_path, dump_path) == [(0x180, 0x181)]
+    flash.write(0x180, image.read(0x180, 1))
+    flash.write_bin(dump_path)
+    assert programmer.verify_bin(image_path, dump_path, True) == []
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `ardumgr.watcher` module."""
+
+import pytest
+
+from ardumgr.ardumgr import ArduMgr
+from ardumgr.configs import Platform
+from ardumgr.watcher import Watcher, PollingBackend, InotifyBackend
+
+
+@pytest.fixture(params=["polling", "inotify"])
+def backend(request):
+    if request.param == "polling":
+        return PollingBackend(interval=0.01)
+
+    try:
+        return InotifyBackend()
+    except OSError:
+        pytest.skip("inotify not available")
+
+
+def test_platform_file_changed(arduino_home, backend):
+    manager = ArduMgr(arduino_home)
+    platform = Platform(manager, "avr")
+    assert "nano" not in platform.boards
+
+    with Watcher(manager, backend) as watcher:
+        watcher.watch_platform(platform)
+        boards_path = platform.cfgs.sources[1]
+        with boards_path.open("a") as boards_file:
+            boards_file.write("nano.name=Arduino Nano\n")
+
+        assert watcher.check(1.0) == [("platform", "avr")]
+
+    assert "nano" in platform.boards
+
+
+def test_tool_dir_changed(arduino_home, backend):
+    manager = ArduMgr(arduino_home)
+    events = []
+
+    with Watcher(manager, backend) as watcher:
+        watcher.add_listener(lambda kind, id_: events.append((kind, id_)))
+        (manager.user_tools_dir / "avr-gcc" / "4.9.2").mkdir(parents=True)
+        watcher.check(1.0)
+
+    assert events == [("tool", "avr-gcc")]
+    assert manager._cfgs["runtime.tools.avr-gcc.path"].endswith("4.9.2")
+    assert "runtime.tools.avrdude.path" in manager._cfgs